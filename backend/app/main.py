@@ -1,10 +1,16 @@
 import sys
 sys.stdout.reconfigure(line_buffering=True)
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from db.database import SessionLocal
+from db.database import SessionLocal, async_engine
+from core.backplane import backplane
+from core.compression import compression_report
+from core.security import PasswordHasherBusy
 
 from routers import auth, session, message, websocket, material, editor
 
@@ -13,7 +19,17 @@ from models.session import Session
 from models.message import Message
 from models.session_member import SessionMember
 
-app = FastAPI(title="ThinkRoom API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Graceful shutdown: persist queued chat and unsaved sketch/editor edits, then stop relaying realtime frames
+    await websocket.supervisor.stop()
+    await websocket.chat_ingest.stop()
+    await websocket.persistence.stop()
+    await backplane.close()
+    await async_engine.dispose()
+
+app = FastAPI(title="ThinkRoom API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +39,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy(request: Request, exc: PasswordHasherBusy):
+    # login spike: shed load early instead of queueing requests behind the hash workers
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again"}, headers={"Retry-After": "1"})
+
 app.include_router(auth.router)
 app.include_router(session.router)
 app.include_router(message.router)
@@ -53,4 +74,9 @@ def debug_db():
             ],
         }
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@app.get("/debug/realtime")
+def debug_realtime():
+    # Compressed snapshot frames sent so far; permessage-deflate savings happen inside the server (uvicorn)
+    return {"snapshot_compression": compression_report()}
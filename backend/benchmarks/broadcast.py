@@ -0,0 +1,70 @@
+"""Micro-benchmark: per-event CPU of a sketch_update broadcast for 2, 10 and 50 listeners.
+
+Compares encoding per recipient (what send_json does), encoding once with the
+stdlib, and encoding once with core.codec (orjson when installed).
+
+Run from backend/:  python -m benchmarks.broadcast
+"""
+import asyncio
+import json
+import time
+
+from core import codec
+from core.backplane import LocalBackplane
+from core.connection_manager import ConnectionManager
+
+EVENTS = 2_000
+
+
+class _NullSocket:
+    async def send_text(self, message: str) -> None:
+        pass
+
+
+def _event(i: int) -> dict:
+    points = [{"x": 100.5 + j, "y": 200.25 + j * 0.5} for j in range(40)]
+    return {
+        "type": "sketch_update",
+        "user": {"id": 1, "username": "tutor"},
+        "seq": i,
+        "content": {"seq": i, "type": "stroke", "points": points, "color": "#222222", "lineWidth": 3, "mode": "draw"},
+    }
+
+
+async def _drain(manager: ConnectionManager) -> None:
+    while any(conn.outbox.frames for conn in manager.connections):
+        await asyncio.sleep(0)
+
+
+async def _run(listeners: int) -> None:
+    manager = ConnectionManager("bench", backplane=LocalBackplane(), queue_size=EVENTS + 1)
+    sockets = [_NullSocket() for _ in range(listeners)]
+    for ws in sockets:
+        await manager.connect(1, ws)
+    events = [_event(i) for i in range(EVENTS)]
+
+    async def per_recipient():
+        for event in events:
+            for ws in sockets:
+                await manager.send_personal_message(json.dumps(event), ws)
+
+    async def once_stdlib():
+        for event in events:
+            await manager.broadcast(1, json.dumps(event))
+
+    async def once_codec():
+        for event in events:
+            await manager.broadcast(1, codec.encode(event))
+
+    results = []
+    for name, fn in (("per recipient", per_recipient), ("once json", once_stdlib), (f"once codec[{codec.CODEC}]", once_codec)):
+        start = time.process_time()
+        await fn()
+        await _drain(manager)
+        results.append(f"{name} {(time.process_time() - start) * 1e6 / EVENTS:8.1f} us")
+    print(f"{listeners:>3} listeners  " + "  ".join(results))
+
+
+if __name__ == "__main__":
+    for n in (2, 10, 50):
+        asyncio.run(_run(n))
@@ -0,0 +1,58 @@
+"""Load test: login password checks per second under a burst of concurrent logins.
+
+"before" verifies bcrypt hashes inline on the request threads (40, like the
+AnyIO threadpool FastAPI runs sync endpoints on); "after" goes through
+core.security (dedicated pool, queue limit, configured scheme). While the
+burst runs, a cheap request is timed on the same request threads to show
+what the rest of the API sees.
+
+Run from backend/:  python -m benchmarks.password_hashing [logins]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from core import security
+
+REQUEST_THREADS = 40
+PASSWORD = "correct horse battery staple"
+
+
+def _cheap_request_latency(requests: ThreadPoolExecutor) -> float:
+    start = time.perf_counter()
+    requests.submit(lambda: None).result()
+    return (time.perf_counter() - start) * 1000
+
+
+def _run(name: str, check, hashed: str, logins: int) -> None:
+    rejected = 0
+
+    def login():
+        nonlocal rejected
+        try:
+            check(PASSWORD, hashed)
+        except security.PasswordHasherBusy:
+            rejected += 1
+
+    with ThreadPoolExecutor(max_workers=REQUEST_THREADS) as requests:
+        start = time.perf_counter()
+        futures = [requests.submit(login) for _ in range(logins)]
+        latency = _cheap_request_latency(requests)
+        for f in futures:
+            f.result()
+        elapsed = time.perf_counter() - start
+    served = logins - rejected
+    print(f"{name:<34} {served / elapsed:7.1f} logins/s  {rejected:4d} rejected (503)  other request waited {latency:8.1f} ms")
+
+
+if __name__ == "__main__":
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    legacy = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    legacy_hash = legacy.hash(PASSWORD)
+    current_hash = security.pwd_context.hash(PASSWORD)
+    _run("before: inline bcrypt", legacy.verify, legacy_hash, logins)
+    _run("after: pool, legacy bcrypt hash", security.verify_password, legacy_hash, logins)
+    scheme = security.pwd_context.identify(current_hash)
+    _run(f"after: pool, {scheme} (rehashed)", security.verify_password, current_hash, logins)
@@ -0,0 +1,62 @@
+"""Micro-benchmark: rope TextBuffer vs. string slicing (apply_delta) for editor deltas.
+
+Run from backend/:  python -m benchmarks.text_buffer [size_kb ...]
+"""
+import random
+import sys
+import time
+
+from core.session_state import apply_delta
+from core.text_buffer import TextBuffer
+
+EDITS = 20_000
+
+
+def _deltas(size: int, n: int, seed: int = 0):
+    # typing-like workload: mostly single-char inserts near a moving cursor, some deletes
+    rng = random.Random(seed)
+    cursor = size // 2
+    out = []
+    for _ in range(n):
+        cursor = max(0, min(size, cursor + rng.randint(-40, 40)))
+        if rng.random() < 0.8:
+            out.append((cursor, 0, rng.choice("abcdefgh \n")))
+            size += 1
+            cursor += 1
+        else:
+            out.append((cursor, 1, ""))
+            size = max(0, size - 1)
+    return out
+
+
+def _run(size_kb: int) -> None:
+    text = ("lorem ipsum dolor sit amet\n" * (size_kb * 1024 // 27 + 1))[: size_kb * 1024]
+    deltas = _deltas(len(text), EDITS)
+
+    start = time.perf_counter()
+    s = text
+    for offset, length, insert_text in deltas:
+        s = apply_delta(s, offset, length, insert_text)
+    slicing = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buf = TextBuffer(text)
+    for offset, length, insert_text in deltas:
+        buf.replace(offset, length, insert_text)
+    rope = time.perf_counter() - start
+    materialize_start = time.perf_counter()
+    result = str(buf)
+    materialize = time.perf_counter() - materialize_start
+
+    assert result == s
+    print(
+        f"{size_kb:>6} KB  {EDITS} edits  "
+        f"slicing {slicing * 1e6 / EDITS:8.2f} us/edit  "
+        f"rope {rope * 1e6 / EDITS:8.2f} us/edit  "
+        f"(one str() {materialize * 1e3:.2f} ms)"
+    )
+
+
+if __name__ == "__main__":
+    for kb in [int(a) for a in sys.argv[1:]] or [10, 100, 1024]:
+        _run(kb)
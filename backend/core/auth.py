@@ -1,3 +1,9 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -8,16 +14,69 @@ from core.config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+
+class Principal:
+    """Who a verified access token belongs to; everything most endpoints need, without a DB query."""
+
+    __slots__ = ("id", "username", "expires")
+
+    def __init__(self, id: int, username: str, expires: float):
+        self.id = id
+        self.username = username
+        self.expires = expires
+
+
+# sha256(token) -> Principal, least recently used first; entries die with the token's exp
+_verified: "OrderedDict[str, Principal]" = OrderedDict()
+_verified_lock = threading.Lock()  # sync dependencies run in the threadpool
+
+
+def _decode(token: str) -> Tuple[int, str, float]:
+    payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise JWTError("missing sub")
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        return int(user_id), payload.get("username", ""), float(payload.get("exp", 0))
+    except (TypeError, ValueError):
+        raise JWTError("malformed claims")
+
+
+def verify_token(token: str) -> Principal:
+    """Principal for an access token; raises JWTError if it is invalid or expired.
+
+    The signature is checked once per token; repeats are a hash and a dict lookup.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+    with _verified_lock:
+        principal = _verified.get(key)
+        if principal is not None:
+            if principal.expires > now:
+                _verified.move_to_end(key)
+                return principal
+            del _verified[key]
+
+    user_id, username, expires = _decode(token)
+    principal = Principal(user_id, username, expires)
+    if expires > now:  # tokens without exp are verified every time
+        with _verified_lock:
+            _verified[key] = principal
+            while len(_verified) > settings.JWT_CACHE_SIZE:
+                _verified.popitem(last=False)
+    return principal
+
+
+def get_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    try:
+        return verify_token(token)
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    user = db.query(User).filter(User.id == int(user_id)).first()
+
+def get_current_user(principal: Principal = Depends(get_principal), db: Session = Depends(get_db)) -> User:
+    """The full user row, for endpoints that read or change more than id/username."""
+    user = db.query(User).filter(User.id == principal.id).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
\ No newline at end of file
+    return user
@@ -0,0 +1,211 @@
+import asyncio
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from core.codec import decode, encode
+from core.config import settings
+
+# Envelope relayed between workers:
+# {"node": <origin node id>, "session_id": int, "message": str, "user_id": Optional[int], "key": Optional[str],
+#  "channel": Optional[str]}
+# or, for a flushed batch of coalesced events, {"node": ..., "session_id": int, "messages": [str, ...],
+#  "channels": [Optional[str], ...]}
+# Events with a binary encoding also carry "frame" (base64) next to "message".
+Envelope = Dict[str, Any]
+EnvelopeHandler = Callable[[Envelope], Awaitable[None]]
+
+CHANNEL_PREFIX = "thinkroom:rt"
+
+
+def session_channel(namespace: str, session_id: int) -> str:
+    return f"{CHANNEL_PREFIX}:{namespace}:{session_id}"
+
+
+def pack_envelope(envelope: Envelope) -> str:
+    """Header JSON on the first line, then the already-encoded frame(s) verbatim.
+
+    Frames are compact JSON (no raw newlines), so they are relayed without
+    being escaped into, and decoded back out of, the envelope.
+    """
+    header = {k: v for k, v in envelope.items() if k not in ("message", "messages")}
+    if "messages" in envelope:
+        header["batch"] = True
+        return "\n".join([encode(header), *envelope["messages"]])
+    return encode(header) + "\n" + envelope["message"]
+
+
+def unpack_envelope(data: str) -> Envelope:
+    header, _, body = data.partition("\n")
+    envelope = decode(header)
+    if envelope.pop("batch", False):
+        envelope["messages"] = body.split("\n")
+    else:
+        envelope["message"] = body
+    return envelope
+
+
+class Backplane:
+    """Relays realtime frames between API workers/nodes.
+
+    Delivery to sockets on the publishing worker is done by the caller; the
+    backplane only carries the frame to *other* workers, which hand it to
+    the handler registered for the channel.
+    """
+
+    relays = False  # whether frames reach other workers at all
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+
+    async def subscribe(self, channel: str, handler: EnvelopeHandler) -> None:
+        pass
+
+    def unsubscribe(self, channel: str) -> None:
+        pass
+
+    async def publish(self, channel: str, envelope: Envelope) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalBackplane(Backplane):
+    """Single-process deployments: every socket lives in this worker, nothing to relay."""
+
+
+class PubSubBackplane(Backplane):
+    """Backplane over a Redis-style pub/sub client (redis.asyncio.Redis or InMemoryBroker)."""
+
+    relays = True
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.handlers: Dict[str, EnvelopeHandler] = {}
+        self._subscribed: Set[str] = set()
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, channel: str, handler: EnvelopeHandler) -> None:
+        self.handlers[channel] = handler
+        await self._sync_subscriptions()
+
+    def unsubscribe(self, channel: str) -> None:
+        # Called from sync disconnect paths; the actual UNSUBSCRIBE runs in the background
+        if self.handlers.pop(channel, None) is not None:
+            asyncio.create_task(self._sync_subscriptions())
+
+    async def _sync_subscriptions(self):
+        # Serialized diff of wanted vs. subscribed channels so a quick
+        # leave/re-join of the same session can never end up unsubscribed.
+        async with self._lock:
+            wanted = set(self.handlers)
+            to_add = wanted - self._subscribed
+            to_remove = self._subscribed - wanted
+            if self._pubsub is None and to_add:
+                self._pubsub = self.client.pubsub()
+            if to_add:
+                await self._pubsub.subscribe(*to_add)
+            if to_remove:
+                await self._pubsub.unsubscribe(*to_remove)
+            self._subscribed = wanted
+            if self._subscribed and self._reader is None:
+                self._reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        while True:
+            try:
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if msg is None:
+                    continue
+                channel = msg["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                data = msg["data"]
+                envelope = unpack_envelope(data.decode() if isinstance(data, bytes) else data)
+                if envelope.get("node") == self.node_id:
+                    continue  # our own publish, already delivered locally
+                handler = self.handlers.get(channel)
+                if handler:
+                    await handler(envelope)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("backplane read error:", e)
+                await asyncio.sleep(0.5)
+
+    async def publish(self, channel: str, envelope: Envelope) -> None:
+        envelope["node"] = self.node_id
+        try:
+            await self.client.publish(channel, pack_envelope(envelope))
+        except Exception as e:
+            print("backplane publish error:", e)
+
+    async def close(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.aclose()
+            except Exception:
+                pass
+            self._pubsub = None
+        self._subscribed = set()
+
+
+class _MemoryPubSub:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+        self.channels: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        self.channels.update(channels)
+
+    async def unsubscribe(self, *channels: str):
+        self.channels.difference_update(channels)
+
+    async def get_message(self, ignore_subscribe_messages: bool = True, timeout: float = 1.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        self.broker.pubsubs.remove(self)
+
+
+class InMemoryBroker:
+    """Fake Redis pub/sub broker; several PubSubBackplanes sharing one instance behave like separate workers."""
+
+    def __init__(self):
+        self.pubsubs: List[_MemoryPubSub] = []
+        self.published: Dict[str, int] = defaultdict(int)
+
+    def pubsub(self) -> _MemoryPubSub:
+        ps = _MemoryPubSub(self)
+        self.pubsubs.append(ps)
+        return ps
+
+    async def publish(self, channel: str, data: str) -> int:
+        self.published[channel] += 1
+        receivers = [ps for ps in self.pubsubs if channel in ps.channels]
+        for ps in receivers:
+            ps.queue.put_nowait({"type": "message", "channel": channel, "data": data})
+        return len(receivers)
+
+
+def create_backplane() -> Backplane:
+    if settings.REALTIME_BACKPLANE == "redis":
+        if not settings.REDIS_URL:
+            raise RuntimeError("REALTIME_BACKPLANE=redis requires REDIS_URL")
+        import redis.asyncio as aioredis
+        return PubSubBackplane(aioredis.from_url(settings.REDIS_URL, decode_responses=True))
+    return LocalBackplane()
+
+
+backplane = create_backplane()
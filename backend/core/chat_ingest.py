@@ -0,0 +1,119 @@
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core.config import settings
+
+# {"provisional_id", "session_id", "user_id", "content", "created_at"}
+PendingChat = Dict[str, Any]
+
+
+def provisional_id() -> str:
+    """Id a chat message is broadcast with before its row exists."""
+    return f"tmp-{uuid.uuid4().hex}"
+
+
+class ChatIngestor:
+    """Group commit for chat messages.
+
+    Messages are broadcast right away by the caller and only queued here;
+    a background task hands them to `write` in batches of up to `max_batch`,
+    at most `interval` seconds after the first one arrived, so inserts cost
+    one round-trip and one commit per batch instead of per message. `write`
+    is expected to insert the batch and reconcile provisional ids; a batch
+    it raises for stays queued and is retried after a pause. While writes
+    keep failing the queue holds at most `max_queue` messages.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[PendingChat]], Awaitable[None]],
+        interval: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        max_queue: Optional[int] = None,
+    ):
+        self._write = write
+        self.interval = settings.CHAT_BATCH_INTERVAL if interval is None else interval
+        self.max_batch = settings.CHAT_BATCH_MAX if max_batch is None else max_batch
+        self.max_queue = settings.CHAT_QUEUE_MAX if max_queue is None else max_queue
+        if self.max_batch < 1:
+            raise ValueError(f"max_batch must be at least 1, got {self.max_batch}")
+        self.queue: List[PendingChat] = []
+        self._pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def has_room(self) -> bool:
+        return len(self.queue) < self.max_queue
+
+    def submit(self, message: PendingChat) -> bool:
+        """Queue a message; returns False (and drops it) when the queue is full."""
+        if not self.has_room():
+            return False
+        self.queue.append(message)
+        self._pending.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if len(self.queue) >= self.max_batch:
+            self._full.set()
+        return True
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            await self._pending.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if not await self.flush():
+                try:
+                    # the write failed; don't hammer the DB (stop() still gets through)
+                    await asyncio.wait_for(self._stopping.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def flush(self) -> bool:
+        """Write everything queued so far, one batch at a time.
+
+        Stops at the first failed batch and returns False, leaving it queued.
+        """
+        written = True
+        async with self._lock:
+            while self.queue:
+                batch = self.queue[:self.max_batch]
+                del self.queue[:len(batch)]
+                try:
+                    await self._write(batch)
+                except asyncio.CancelledError:
+                    self.queue[:0] = batch  # not written; whoever flushes next picks it up
+                    raise
+                except Exception as e:
+                    # put the batch back in front; the next tick retries it
+                    print("chat ingest error:", e)
+                    self.queue[:0] = batch
+                    written = False
+                    break
+            if len(self.queue) < self.max_batch:
+                self._full.clear()
+            if not self.queue:
+                self._pending.clear()
+        return written
+
+    async def stop(self) -> None:
+        """Stop the background task and write what is still queued (graceful shutdown).
+
+        The task is woken rather than cancelled, so a batch it is writing
+        completes before the final flush.
+        """
+        if self._task:
+            self._stopping.set()
+            self._pending.set()
+            self._full.set()
+            try:
+                await self._task
+            finally:
+                self._stopping.clear()
+                self._task = None
+        await self.flush()
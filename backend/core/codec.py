@@ -0,0 +1,32 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson  # shipped with fastapi[all]; several times faster than the stdlib
+except ImportError:  # pragma: no cover - depends on the installed extras
+    orjson = None
+
+# Raised by decode() on malformed input (orjson's error subclasses it)
+DecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    CODEC = "orjson"
+    _OPTIONS = orjson.OPT_NON_STR_KEYS  # media status maps are keyed by int user ids
+
+    def encode(obj: Any) -> str:
+        """Compact JSON text for a realtime frame; encode once, send the result to every socket."""
+        return orjson.dumps(obj, option=_OPTIONS).decode()
+
+    def decode(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+else:
+    CODEC = "json"
+    _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def encode(obj: Any) -> str:
+        """Compact JSON text for a realtime frame; encode once, send the result to every socket."""
+        return _encoder.encode(obj)
+
+    def decode(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
@@ -0,0 +1,35 @@
+import asyncio
+import zlib
+from typing import Dict
+
+from core.config import settings
+
+# Binary frame kinds share the first byte with core.stroke_codec (STROKE = 1)
+SNAPSHOT = 2  # kind byte followed by the zlib-compressed JSON message
+
+# Counters for compressed snapshot frames (see /debug/realtime)
+snapshot_stats: Dict[str, int] = {"frames": 0, "raw_bytes": 0, "sent_bytes": 0}
+
+
+def should_compress(message: str) -> bool:
+    threshold = settings.WS_SNAPSHOT_COMPRESS_THRESHOLD
+    return threshold > 0 and len(message) >= threshold
+
+
+async def compress_snapshot(message: str) -> bytes:
+    """Binary snapshot frame for a large JSON message.
+
+    zlib format, so browsers can inflate it with DecompressionStream("deflate").
+    Runs in a thread because whole canvases can take a while to compress.
+    """
+    raw = message.encode()
+    body = await asyncio.to_thread(zlib.compress, raw, settings.WS_SNAPSHOT_COMPRESS_LEVEL)
+    frame = bytes([SNAPSHOT]) + body
+    snapshot_stats["frames"] += 1
+    snapshot_stats["raw_bytes"] += len(raw)
+    snapshot_stats["sent_bytes"] += len(frame)
+    return frame
+
+
+def compression_report() -> Dict[str, int]:
+    return {**snapshot_stats, "saved_bytes": snapshot_stats["raw_bytes"] - snapshot_stats["sent_bytes"]}
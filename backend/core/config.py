@@ -8,6 +8,7 @@ class Settings(BaseSettings):
 
     # Database and cache
     DB_URL: str
+    ASYNC_DB_URL: Optional[str] = None  # defaults to DB_URL with an async driver (psycopg / aiosqlite)
     REDIS_URL: Optional[str] = None
 
     # Object storage (MinIO / S3)
@@ -21,6 +22,59 @@ class Settings(BaseSettings):
     JWT_SECRET: str
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRE_MINUTES: int = 60 * 6  # 6
+    JWT_CACHE_SIZE: int = 10000  # verified tokens remembered per process (until their exp)
+
+    # Password hashing: new hashes use this scheme/cost, older ones are upgraded on login
+    PASSWORD_HASH_SCHEME: str = "argon2"  # argon2 | bcrypt
+    PASSWORD_ARGON2_TIME_COST: int = 2
+    PASSWORD_ARGON2_MEMORY_COST: int = 19 * 1024  # KiB per hash
+    PASSWORD_ARGON2_PARALLELISM: int = 1
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4  # hashes computed at once (per process)
+    PASSWORD_HASH_QUEUE: int = 16  # requests allowed to wait for a worker before answering 503
+
+    # Session membership cache for authorization checks: "memory" (single process) or "redis"
+    MEMBERSHIP_CACHE_BACKEND: str = "memory"
+    MEMBERSHIP_CACHE_SIZE: int = 10000  # (session, user) answers kept per process
+    MEMBERSHIP_CACHE_TTL: float = 60.0  # seconds a positive answer is trusted
+    MEMBERSHIP_CACHE_NEGATIVE_TTL: float = 5.0  # seconds a "not a member" answer is trusted
+
+    # Realtime backplane: "local" (single process) or "redis" (uses REDIS_URL, multi-worker)
+    REALTIME_BACKPLANE: str = "local"
+
+    # Live session state (sketch/editor/presence): "memory" (single process) or "redis"
+    SESSION_STATE_BACKEND: str = "memory"
+    REALTIME_STATE_TTL: int = 60 * 60 * 24  # seconds idle session state is kept in Redis
+    PRESENCE_NODE_TTL: int = 30  # seconds a worker's presence counts outlive it (crash) in Redis
+
+    # Write-behind persistence of sketch/editor state
+    PERSIST_FLUSH_INTERVAL: float = 5.0  # max seconds of edits lost on a crash
+    PERSIST_MAX_DIRTY: int = 50  # flush early once this many sessions are dirty
+    SKETCH_CHUNK_SIZE: int = 256  # max sketch actions per stored chunk
+
+    # Chat group commit: messages are broadcast at once and inserted in micro-batches
+    CHAT_BATCH_INTERVAL: float = 0.05  # max seconds a message waits for its batch
+    CHAT_BATCH_MAX: int = 200  # messages per INSERT/commit
+    CHAT_QUEUE_MAX: int = 10_000  # unwritten messages held while the DB fails; new ones are refused past it
+
+    # Sketch compaction: fold the log into a checkpoint once it reaches the threshold
+    SKETCH_COMPACT_THRESHOLD: int = 500  # log length that triggers a compaction pass
+    SKETCH_COMPACT_TAIL: int = 100  # most recent actions left untouched
+    SKETCH_COMPACT_CELL: float = 8.0  # grid size (canvas px) for erased-stroke detection
+    SKETCH_COMPACT_MAX_CELLS: int = 50_000  # grid cells analysed per stroke; larger strokes are kept as is
+    SKETCH_RESUME_MAX_GAP: int = 2000  # sketch_get since_seq further behind than this gets a snapshot
+    EDITOR_HISTORY_SIZE: int = 1000  # applied editor deltas kept for rebasing concurrent edits
+
+    # Realtime fan-out (per-socket outbound queues)
+    WS_SEND_QUEUE_SIZE: int = 512
+    WS_OVERFLOW_POLICY: str = "disconnect"  # drop_oldest | coalesce | disconnect
+    WS_SEND_TIMEOUT: float = 10.0  # seconds a single send may take before the socket is dropped
+    WS_PING_INTERVAL: float = 20.0  # seconds between pings to sockets that opted in (?heartbeat=1); 0 = off
+    WS_IDLE_TIMEOUT: float = 60.0  # seconds of silence after which such a socket is reaped; 0 = never
+    WS_COALESCE_WINDOW: float = 0.0  # seconds to buffer editor/sketch broadcasts per session (e.g. 0.02); 0 = off
+    # Sync snapshots at least this large go out zlib-compressed to sockets that opted in (?compress=1); 0 = off
+    WS_SNAPSHOT_COMPRESS_THRESHOLD: int = 16 * 1024
+    WS_SNAPSHOT_COMPRESS_LEVEL: int = 6
 
     # CORS
     ALLOWED_ORIGINS: str = ""
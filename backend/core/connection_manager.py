@@ -1,30 +1,450 @@
+import asyncio
+import base64
+import time
+from collections import deque
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Any, Deque, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+from core.codec import encode
+from core.compression import compress_snapshot, should_compress
+from core.backplane import Backplane, Envelope, backplane as default_backplane, session_channel
+from core.config import settings
+from core.connection_registry import Connection, ConnectionRegistry
+
+# What to do when a socket's outbound queue is full
+OVERFLOW_DROP_OLDEST = "drop_oldest"   # discard the oldest queued frame
+OVERFLOW_COALESCE = "coalesce"         # replace a queued frame with the same key in place, else drop oldest
+OVERFLOW_DISCONNECT = "disconnect"     # close the slow consumer so it reconnects and resyncs
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT)
+
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try Again Later"
+
+# Text frame, binary frame, or a binary frame still being produced (compressed
+# snapshots), which holds its place in the queue until it's ready
+Frame = Union[str, bytes, "asyncio.Future[bytes]"]
+
+
+def _merge_editor_update(prev: Dict[str, Any], cur: Dict[str, Any]) -> bool:
+    """Fold `cur` into `prev` if both are one user's adjacent typing/deleting; returns True if merged."""
+    if prev.get("type") != "editor_update" or cur.get("type") != "editor_update":
+        return False
+    if "op_id" in prev or "op_id" in cur or (prev.get("user") or {}).get("id") != (cur.get("user") or {}).get("id"):
+        return False
+    a, b = prev.get("content") or {}, cur.get("content") or {}
+    try:
+        a_off, a_len, a_text = int(a["offset"]), int(a["length"]), str(a["text"])
+        b_off, b_len, b_text = int(b["offset"]), int(b["length"]), str(b["text"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if a_len == 0 and b_len == 0 and b_off == a_off + len(a_text):
+        merged = {"offset": a_off, "length": 0, "text": a_text + b_text}  # typing forward
+    elif not a_text and not b_text and b_off + b_len == a_off:
+        merged = {"offset": b_off, "length": a_len + b_len, "text": ""}  # backspacing
+    elif not a_text and not b_text and b_off == a_off:
+        merged = {"offset": a_off, "length": a_len + b_len, "text": ""}  # forward delete
+    else:
+        return False
+    prev["content"] = merged
+    if "rev" in cur:
+        prev["rev"] = cur["rev"]
+    return True
+
+
+# (channel, event) as buffered by broadcast_event()
+PendingEvent = Tuple[Optional[str], Dict[str, Any]]
+
+
+def coalesce_events(events: List[PendingEvent]) -> List[PendingEvent]:
+    """Merge runs of adjacent editor deltas; everything else is kept as is, in order."""
+    out: List[PendingEvent] = []
+    for channel, event in events:
+        if out and out[-1][0] == channel and _merge_editor_update(out[-1][1], event):
+            continue
+        out.append((channel, event))
+    return out
+
+
+def batch_frame(messages: List[str]) -> str:
+    """One {"type": "batch", "events": [...]} frame from already-encoded messages."""
+    return '{"type":"batch","events":[' + ",".join(messages) + "]}"
+
+
+def _send_frame(websocket: WebSocket, frame: Union[str, bytes]):
+    """The send call for a text or a binary frame."""
+    if isinstance(frame, bytes):
+        return websocket.send_bytes(frame)
+    return websocket.send_text(frame)
+
+
+class _Outbox:
+    """Bounded outbound queue for one socket, drained by its own writer task."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        maxsize: int,
+        policy: str,
+        send_timeout: float,
+        batch: bool = False,
+        binary: bool = False,
+        compress: bool = False,
+        channels: Optional[Iterable[str]] = None,
+    ):
+        self.websocket = websocket
+        self.channels: Optional[FrozenSet[str]] = None if channels is None else frozenset(channels)  # None = all
+        self.batch = batch  # client accepts {"type": "batch"} frames
+        self.binary = binary  # client accepts binary sketch frames (core.stroke_codec)
+        self.compress = compress  # client accepts compressed snapshot frames (core.compression)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.frames: Deque[Tuple[Optional[str], Frame]] = deque()  # (coalesce key, message)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.task = asyncio.create_task(self._run())
+
+    def accepts(self, channel: Optional[str]) -> bool:
+        return channel is None or self.channels is None or channel in self.channels
+
+    def put(self, message: Frame, key: Optional[str] = None) -> bool:
+        """Queue a frame without blocking. Returns False when the consumer must be evicted."""
+        if self.closed:
+            return True
+        if self.policy == OVERFLOW_COALESCE and key is not None:
+            for i, (queued_key, _) in enumerate(self.frames):
+                if queued_key == key:
+                    self.frames[i] = (key, message)  # keeps its place in the queue
+                    self.dropped += 1
+                    return True
+        if len(self.frames) >= self.maxsize:
+            if self.policy == OVERFLOW_DISCONNECT:
+                return False
+            self.frames.popleft()
+            self.dropped += 1
+        self.frames.append((key, message))
+        self.ready.set()
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                while not self.frames:
+                    self.ready.clear()
+                    await self.ready.wait()
+                _, message = self.frames.popleft()
+                if isinstance(message, asyncio.Future):
+                    message = await message
+                await asyncio.wait_for(_send_frame(self.websocket, message), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Dead or stalled socket: stop writing; the receive loop will see the disconnect
+            print(f"⚠️ Writer stopped for socket ({type(e).__name__}), {len(self.frames)} frames discarded")
+            self.closed = True
+            self.frames.clear()
+            await self._close_socket()
+
+    async def _close_socket(self, code: int = 1011):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def evict(self):
+        """Stop writing and close the socket as a slow consumer."""
+        if self.closed:
+            return
+        self.close()
+        asyncio.create_task(self._close_socket(SLOW_CONSUMER_CLOSE_CODE))
+
+    def close(self):
+        self.closed = True
+        self.frames.clear()
+        self.task.cancel()
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-
-    async def connect(self, session_id: int, websocket: WebSocket):
-        if session_id not in self.active_connections:
-            self.active_connections[session_id] = []
-        self.active_connections[session_id].append(websocket)
-        print(f"✅ Now {len(self.active_connections[session_id])} connections in session {session_id}")
-
-    def disconnect(self, session_id: int, websocket: WebSocket):
-        if session_id in self.active_connections:
-            if websocket in self.active_connections[session_id]:
-                self.active_connections[session_id].remove(websocket)
-            if not self.active_connections[session_id]:  # empty list
-                del self.active_connections[session_id]
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, session_id: int, message: str):
-        if session_id in self.active_connections:
-            print(f"📡 Broadcasting to {len(self.active_connections.get(session_id, []))} connections in session {session_id}")
-            for connection in self.active_connections[session_id]:
-                await connection.send_text(message)
-
-    
\ No newline at end of file
+    def __init__(
+        self,
+        namespace: str = "ws",
+        backplane: Optional[Backplane] = None,
+        queue_size: Optional[int] = None,
+        overflow_policy: Optional[str] = None,
+        send_timeout: Optional[float] = None,
+        coalesce_window: Optional[float] = None,
+    ):
+        self.namespace = namespace  # keeps each router's sessions on separate backplane channels
+        self.backplane = backplane or default_backplane
+        self.connections = ConnectionRegistry()
+        self.queue_size = queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.overflow_policy = overflow_policy or settings.WS_OVERFLOW_POLICY
+        self.send_timeout = send_timeout or settings.WS_SEND_TIMEOUT
+        # Seconds broadcast_event() buffers high-rate events per session (0 = send immediately)
+        self.coalesce_window = settings.WS_COALESCE_WINDOW if coalesce_window is None else coalesce_window
+        self.pending: Dict[int, List[PendingEvent]] = {}
+        self._flush_timers: Dict[int, asyncio.Task] = {}
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.overflow_policy}")
+
+    async def connect(
+        self,
+        session_id: int,
+        websocket: WebSocket,
+        user_id: Optional[int] = None,
+        batch: bool = False,
+        binary: bool = False,
+        compress: bool = False,
+        channels: Optional[Iterable[str]] = None,
+        heartbeat: bool = False,
+        present: bool = False,
+    ):
+        """Register a socket; `channels` limits which broadcasts it receives (None = all of them).
+
+        Sockets with `heartbeat` are pinged by the supervisor and reaped once
+        they stay silent for longer than the idle timeout. `present` marks
+        sockets that count towards the session's presence.
+        """
+        if websocket in self.connections:
+            return
+        outbox = _Outbox(
+            websocket, self.queue_size, self.overflow_policy, self.send_timeout,
+            batch, binary, compress, channels,
+        )
+        if self.connections.add(Connection(websocket, session_id, user_id, outbox, present, heartbeat)):
+            await self.backplane.subscribe(session_channel(self.namespace, session_id), self._on_remote)
+        print(f"✅ Now {self.connections.session_count(session_id)} connections in session {session_id}")
+
+    def disconnect(self, websocket: WebSocket) -> Optional[Connection]:
+        """Unregister a socket; returns its record, or None if it was already gone (e.g. reaped)."""
+        conn = self.connections.remove(websocket)
+        if conn is None:
+            return None
+        conn.outbox.close()
+        session_id = conn.session_id
+        if not self.connections.has_session(session_id):
+            self.backplane.unsubscribe(session_channel(self.namespace, session_id))
+            timer = self._flush_timers.pop(session_id, None)
+            if timer:
+                timer.cancel()
+            if session_id in self.pending:
+                # others may still be listening on other workers
+                asyncio.create_task(self._publish_many(session_id, *self._take_pending(session_id)))
+        return conn
+
+    def has_connections(self, session_id: int) -> bool:
+        """Whether this worker holds any socket for the session."""
+        return self.connections.has_session(session_id)
+
+    def set_channels(self, websocket: WebSocket, channels: Optional[Iterable[str]]):
+        """Change which channels a registered socket receives broadcasts for (None = all)."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.outbox.channels = None if channels is None else frozenset(channels)
+
+    def touch(self, websocket: WebSocket):
+        """Record that the client sent something (any frame counts as a pong)."""
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+
+    def stale_connections(self, idle_timeout: float) -> List[Tuple[int, WebSocket, Optional[int]]]:
+        """(session_id, socket, user_id) of heartbeat sockets silent for more than `idle_timeout` seconds."""
+        cutoff = time.monotonic() - idle_timeout
+        return [
+            (conn.session_id, conn.websocket, conn.user_id)
+            for conn in self.connections
+            if conn.heartbeat and conn.last_seen < cutoff
+        ]
+
+    def ping(self, message: str) -> int:
+        """Queue `message` for every heartbeat socket on this worker; returns how many."""
+        count = 0
+        for conn in self.connections:
+            if conn.heartbeat:
+                self._enqueue(conn.outbox, message, key="ping")
+                count += 1
+        return count
+
+    def _enqueue(self, outbox: _Outbox, message: Frame, key: Optional[str] = None, channel: Optional[str] = None):
+        if not outbox.accepts(channel):
+            return  # not subscribed to that channel
+        if not outbox.put(message, key):
+            print(f"🐢 Evicting slow consumer ({len(outbox.frames)} frames queued)")
+            outbox.evict()
+
+    def _deliver_local(
+        self,
+        session_id: int,
+        message: str,
+        key: Optional[str] = None,
+        user_id: Optional[int] = None,
+        channel: Optional[str] = None,
+    ):
+        if user_id is None:
+            targets = self.connections.session(session_id)
+        else:
+            targets = self.connections.user(session_id, user_id)
+        for conn in targets:
+            self._enqueue(conn.outbox, message, key, channel)
+
+    def _deliver_local_many(self, session_id: int, messages: List[str], channels: List[Optional[str]]):
+        # Batch-capable sockets get one frame, the others one frame per event
+        everything = batch_frame(messages) if len(messages) > 1 else messages[0]
+        for conn in self.connections.session(session_id):
+            outbox = conn.outbox
+            if outbox.channels is None:
+                wanted = messages
+                frame = everything
+            else:
+                wanted = [m for m, channel in zip(messages, channels) if outbox.accepts(channel)]
+                if not wanted:
+                    continue
+                frame = batch_frame(wanted) if len(wanted) > 1 else wanted[0]
+            if outbox.batch:
+                self._enqueue(outbox, frame)
+            else:
+                for message in wanted:
+                    self._enqueue(outbox, message)
+
+    def _deliver_local_binary(self, session_id: int, message: str, frame: bytes, channel: Optional[str] = None):
+        for conn in self.connections.session(session_id):
+            self._enqueue(conn.outbox, frame if conn.outbox.binary else message, channel=channel)
+
+    async def _on_remote(self, envelope: Envelope):
+        # Frame published by another worker for a session we hold sockets for
+        if "frame" in envelope:
+            self._deliver_local_binary(
+                envelope["session_id"], envelope["message"], base64.b64decode(envelope["frame"]), envelope.get("channel"),
+            )
+            return
+        if "messages" in envelope:
+            channels = envelope.get("channels") or [None] * len(envelope["messages"])
+            self._deliver_local_many(envelope["session_id"], envelope["messages"], channels)
+            return
+        self._deliver_local(
+            envelope["session_id"],
+            envelope["message"],
+            envelope.get("key"),
+            envelope.get("user_id"),
+            envelope.get("channel"),
+        )
+
+    # --- coalescing ---
+    def _take_pending(self, session_id: int) -> Tuple[List[str], List[Optional[str]]]:
+        events = coalesce_events(self.pending.pop(session_id))
+        return [encode(event) for _, event in events], [channel for channel, _ in events]
+
+    async def _publish_many(self, session_id: int, messages: List[str], channels: List[Optional[str]]):
+        await self.backplane.publish(session_channel(self.namespace, session_id), {
+            "session_id": session_id,
+            "messages": messages,
+            "channels": channels,
+        })
+
+    async def flush_pending(self, session_id: int):
+        """Send the events broadcast_event() buffered for the session, if any."""
+        timer = self._flush_timers.pop(session_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        if session_id not in self.pending:
+            return
+        messages, channels = self._take_pending(session_id)
+        self._deliver_local_many(session_id, messages, channels)
+        await self._publish_many(session_id, messages, channels)
+
+    async def _flush_later(self, session_id: int):
+        await asyncio.sleep(self.coalesce_window)
+        await self.flush_pending(session_id)
+
+    async def broadcast_event(self, session_id: int, event: Dict[str, Any], channel: Optional[str] = None):
+        """Broadcast a high-rate event (editor delta, sketch action), coalesced if enabled.
+
+        Within `coalesce_window` seconds events are buffered per session,
+        adjacent editor deltas of one user are merged, and sockets that
+        negotiated batching receive the rest as a single batch frame. Any
+        other send to the session flushes the buffer first, so clients still
+        see everything in order.
+        """
+        if self.coalesce_window <= 0:
+            await self.broadcast(session_id, encode(event), channel=channel)
+            return
+        self.pending.setdefault(session_id, []).append((channel, event))
+        if session_id not in self._flush_timers:
+            self._flush_timers[session_id] = asyncio.create_task(self._flush_later(session_id))
+
+    async def broadcast_binary(self, session_id: int, message: str, frame: bytes, channel: Optional[str] = None):
+        """Broadcast an event that also has a binary encoding.
+
+        Sockets that negotiated binary frames get `frame`, the others the
+        JSON `message`. Buffered events are flushed first to keep the order.
+        """
+        await self.flush_pending(session_id)
+        self._deliver_local_binary(session_id, message, frame, channel)
+        await self.backplane.publish(session_channel(self.namespace, session_id), {
+            "session_id": session_id,
+            "message": message,
+            "frame": base64.b64encode(frame).decode(),
+            "channel": channel,
+        })
+
+    def wants_binary(self, session_id: int) -> bool:
+        """Whether a binary encoding may be used: a local socket negotiated it, or other workers might have one."""
+        return self.backplane.relays or any(conn.outbox.binary for conn in self.connections.session(session_id))
+
+    async def send_personal_message(self, message: Frame, websocket: WebSocket, key: Optional[str] = None):
+        # Registered sockets go through their outbox so ordering with broadcasts is preserved
+        conn = self.connections.get(websocket)
+        if conn is None:
+            if isinstance(message, asyncio.Future):
+                message = await message
+            await _send_frame(websocket, message)
+            return
+        if conn.session_id in self.pending:
+            await self.flush_pending(conn.session_id)
+        self._enqueue(conn.outbox, message, key)
+
+    async def send_snapshot(self, message: str, websocket: WebSocket, key: Optional[str] = None):
+        """Send a (possibly large) sync message; compressed if the socket opted in and it's big enough."""
+        conn = self.connections.get(websocket)
+        if conn is not None and conn.outbox.compress and should_compress(message):
+            # queued right away so later broadcasts can't overtake the snapshot
+            await self.send_personal_message(asyncio.ensure_future(compress_snapshot(message)), websocket, key)
+        else:
+            await self.send_personal_message(message, websocket, key)
+
+    async def send_to_user(
+        self,
+        session_id: int,
+        user_id: int,
+        message: str,
+        key: Optional[str] = None,
+        channel: Optional[str] = None,
+    ):
+        """Send to every socket the user has open in the session (and subscribed to `channel`), on any worker."""
+        await self.flush_pending(session_id)
+        self._deliver_local(session_id, message, key, user_id, channel)
+        await self.backplane.publish(session_channel(self.namespace, session_id), {
+            "session_id": session_id,
+            "message": message,
+            "user_id": user_id,
+            "key": key,
+            "channel": channel,
+        })
+
+    async def broadcast(self, session_id: int, message: str, key: Optional[str] = None, channel: Optional[str] = None):
+        """Queue `message` for every socket in the session, on this and other workers.
+
+        Never waits on a slow client. `key` marks state-like frames (presence,
+        media state, syncs) that the coalesce policy may replace with a newer
+        frame of the same key. `channel` tags the frame so sockets that
+        subscribed to a subset of channels only get what they asked for.
+        """
+        await self.flush_pending(session_id)
+        self._deliver_local(session_id, message, key, channel=channel)
+        await self.backplane.publish(session_channel(self.namespace, session_id), {
+            "session_id": session_id,
+            "message": message,
+            "key": key,
+            "channel": channel,
+        })
@@ -0,0 +1,104 @@
+import itertools
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_ids = itertools.count(1)
+
+
+class Connection:
+    """One registered socket: who it belongs to, where it is, and its outbound queue."""
+
+    __slots__ = ("id", "websocket", "session_id", "user_id", "present", "heartbeat", "last_seen", "outbox")
+
+    def __init__(
+        self,
+        websocket: Any,
+        session_id: int,
+        user_id: Optional[int],
+        outbox: Any,
+        present: bool = False,
+        heartbeat: bool = False,
+    ):
+        self.id = next(_ids)
+        self.websocket = websocket
+        self.session_id = session_id
+        self.user_id = user_id
+        self.present = present  # counted in the session's (video call) presence
+        self.heartbeat = heartbeat  # client answers pings, so silence means it's gone
+        self.last_seen = time.monotonic()  # last frame received from the client
+        self.outbox = outbox
+
+
+class ConnectionRegistry:
+    """Every socket this worker holds, indexed by socket, session and user.
+
+    All indexes point at the same Connection record. Session and user buckets
+    are dicts keyed by connection id, so adding and removing are O(1) while
+    iteration keeps connect order; empty buckets are dropped right away.
+    """
+
+    def __init__(self):
+        self._by_socket: Dict[Any, Connection] = {}
+        self._by_session: Dict[int, Dict[int, Connection]] = {}
+        self._by_user: Dict[Tuple[int, int], Dict[int, Connection]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_socket)
+
+    def __iter__(self) -> Iterator[Connection]:
+        return iter(list(self._by_socket.values()))
+
+    def __contains__(self, websocket: Any) -> bool:
+        return websocket in self._by_socket
+
+    def add(self, conn: Connection) -> bool:
+        """Index a connection; returns True if it is the first one in its session."""
+        first = conn.session_id not in self._by_session
+        self._by_socket[conn.websocket] = conn
+        self._by_session.setdefault(conn.session_id, {})[conn.id] = conn
+        if conn.user_id is not None:
+            self._by_user.setdefault((conn.session_id, conn.user_id), {})[conn.id] = conn
+        return first
+
+    def remove(self, websocket: Any) -> Optional[Connection]:
+        """Drop a socket from every index; returns its record, or None if it wasn't registered."""
+        conn = self._by_socket.pop(websocket, None)
+        if conn is None:
+            return None
+        bucket = self._by_session[conn.session_id]
+        del bucket[conn.id]
+        if not bucket:
+            del self._by_session[conn.session_id]
+        if conn.user_id is not None:
+            key = (conn.session_id, conn.user_id)
+            bucket = self._by_user[key]
+            del bucket[conn.id]
+            if not bucket:
+                del self._by_user[key]
+        return conn
+
+    def get(self, websocket: Any) -> Optional[Connection]:
+        return self._by_socket.get(websocket)
+
+    def session(self, session_id: int) -> List[Connection]:
+        return list(self._by_session.get(session_id, {}).values())
+
+    def user(self, session_id: int, user_id: int) -> List[Connection]:
+        return list(self._by_user.get((session_id, user_id), {}).values())
+
+    def has_session(self, session_id: int) -> bool:
+        return session_id in self._by_session
+
+    def session_count(self, session_id: int) -> int:
+        return len(self._by_session.get(session_id, ()))
+
+    def present_users(self, session_id: int) -> List[int]:
+        """Users with at least one presence-counted socket here, in connect order."""
+        users: Dict[int, None] = {}
+        for conn in self._by_session.get(session_id, {}).values():
+            if conn.present and conn.user_id is not None:
+                users[conn.user_id] = None
+        return list(users)
+
+    def is_present(self, session_id: int, user_id: int) -> bool:
+        return any(conn.present for conn in self._by_user.get((session_id, user_id), {}).values())
@@ -0,0 +1,66 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from core.codec import encode
+from core.config import settings
+from core.connection_manager import ConnectionManager
+
+# Called for each socket that went silent: (session_id, socket, user_id)
+Reaper = Callable[[int, Any, Optional[int]], Awaitable[None]]
+
+
+class ConnectionSupervisor:
+    """App-level heartbeat for sockets that negotiated it.
+
+    Every `interval` seconds each heartbeat socket gets {"type": "ping"};
+    the client answers {"type": "pong"} (any frame counts). Sockets silent
+    for longer than `idle_timeout` are handed to `reap`, which must run the
+    same cleanup as a regular disconnect, so dead connections leave the
+    fan-out and presence even if their TCP connection never reports it.
+    The task starts with the first heartbeat socket and ends with the last.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        reap: Reaper,
+        interval: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+    ):
+        self.manager = manager
+        self._reap = reap
+        self.interval = settings.WS_PING_INTERVAL if interval is None else interval  # 0 = no pings
+        self.idle_timeout = settings.WS_IDLE_TIMEOUT if idle_timeout is None else idle_timeout  # 0 = never reap
+        self.reaped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_running(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not await self.sweep():
+                self._task = None
+                return
+
+    async def sweep(self) -> int:
+        """Reap silent sockets and ping the rest; returns how many heartbeat sockets remain."""
+        stale = self.manager.stale_connections(self.idle_timeout) if self.idle_timeout > 0 else []
+        for session_id, websocket, user_id in stale:
+            self.reaped += 1
+            try:
+                await self._reap(session_id, websocket, user_id)
+            except Exception as e:
+                print("reaper error:", e)
+        return self.manager.ping(encode({"type": "ping"}))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
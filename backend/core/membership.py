@@ -0,0 +1,158 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from anyio import from_thread
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import select
+
+from core.auth import Principal, get_principal
+from core.config import settings
+from db.database import AsyncSessionLocal
+from models.session_member import SessionMember
+
+
+class MembershipCache:
+    """Caches "is user U a member of session S" so authorization skips the DB.
+
+    Answers expire after MEMBERSHIP_CACHE_TTL seconds (negative ones after
+    MEMBERSHIP_CACHE_NEGATIVE_TTL, so a join racing a check is not hidden for
+    long). Membership changes must call `invalidate`: join/create with the
+    user, session delete without one.
+    """
+
+    async def get(self, session_id: int, user_id: int) -> Optional[bool]:
+        raise NotImplementedError
+
+    async def put(self, session_id: int, user_id: int, member: bool) -> None:
+        raise NotImplementedError
+
+    async def invalidate(self, session_id: int, user_id: Optional[int] = None) -> None:
+        """Forget one user's answer for a session, or every answer for it."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _ttl(member: bool) -> float:
+        return settings.MEMBERSHIP_CACHE_TTL if member else settings.MEMBERSHIP_CACHE_NEGATIVE_TTL
+
+
+class MemoryMembershipCache(MembershipCache):
+    """LRU of at most `size` answers in this process (single worker only: other workers won't see invalidations)."""
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or settings.MEMBERSHIP_CACHE_SIZE
+        self.entries: "OrderedDict[Tuple[int, int], Tuple[bool, float]]" = OrderedDict()
+        self.by_session: Dict[int, Set[int]] = {}
+
+    async def get(self, session_id: int, user_id: int) -> Optional[bool]:
+        key = (session_id, user_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        member, expires = entry
+        if expires <= time.monotonic():
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return member
+
+    async def put(self, session_id: int, user_id: int, member: bool) -> None:
+        key = (session_id, user_id)
+        self.entries[key] = (member, time.monotonic() + self._ttl(member))
+        self.entries.move_to_end(key)
+        self.by_session.setdefault(session_id, set()).add(user_id)
+        while len(self.entries) > self.size:
+            self._drop(next(iter(self.entries)))
+
+    async def invalidate(self, session_id: int, user_id: Optional[int] = None) -> None:
+        users = [user_id] if user_id is not None else list(self.by_session.get(session_id, ()))
+        for uid in users:
+            self._drop((session_id, uid))
+
+    def _drop(self, key: Tuple[int, int]) -> None:
+        if self.entries.pop(key, None) is None:
+            return
+        session_id, user_id = key
+        users = self.by_session.get(session_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.by_session[session_id]
+
+
+class RedisMembershipCache(MembershipCache):
+    """Shared cache, so an invalidation on one worker holds for all of them.
+
+    One hash per session, authz:{sid}: user_id -> "<0|1>:<expiry unix time>".
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def _key(session_id: int) -> str:
+        return f"authz:{session_id}"
+
+    async def get(self, session_id: int, user_id: int) -> Optional[bool]:
+        raw = await self.redis.hget(self._key(session_id), user_id)
+        if raw is None:
+            return None
+        member, _, expires = raw.partition(":")
+        if float(expires) <= time.time():
+            return None
+        return member == "1"
+
+    async def put(self, session_id: int, user_id: int, member: bool) -> None:
+        ttl = self._ttl(member)
+        key = self._key(session_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, user_id, f"{int(member)}:{time.time() + ttl}")
+            pipe.expire(key, int(settings.MEMBERSHIP_CACHE_TTL) + 1)
+            await pipe.execute()
+
+    async def invalidate(self, session_id: int, user_id: Optional[int] = None) -> None:
+        if user_id is None:
+            await self.redis.delete(self._key(session_id))
+        else:
+            await self.redis.hdel(self._key(session_id), user_id)
+
+
+def create_membership_cache() -> MembershipCache:
+    if settings.MEMBERSHIP_CACHE_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise RuntimeError("MEMBERSHIP_CACHE_BACKEND=redis requires REDIS_URL")
+        import redis.asyncio as aioredis
+        return RedisMembershipCache(aioredis.from_url(settings.REDIS_URL, decode_responses=True))
+    return MemoryMembershipCache()
+
+
+membership_cache = create_membership_cache()
+
+
+async def is_member(session_id: int, user_id: int) -> bool:
+    member = await membership_cache.get(session_id, user_id)
+    if member is None:
+        async with AsyncSessionLocal() as db:
+            member = await db.scalar(select(SessionMember.id).where(
+                SessionMember.session_id == session_id,
+                SessionMember.user_id == user_id,
+            )) is not None
+        await membership_cache.put(session_id, user_id, member)
+    return member
+
+
+async def require_membership(session_id: int, current_user: Principal = Depends(get_principal)) -> Principal:
+    """Dependency for routes with a `session_id` path/query parameter; returns the caller."""
+    if not await is_member(session_id, current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this session")
+    return current_user
+
+
+# Sync (threadpool) endpoints reach the cache through the event loop
+
+def check_membership(session_id: int, user_id: int) -> bool:
+    return from_thread.run(is_member, session_id, user_id)
+
+
+def invalidate_membership(session_id: int, user_id: Optional[int] = None) -> None:
+    from_thread.run(membership_cache.invalidate, session_id, user_id)
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from core.config import settings
+
+# session_id -> kinds of state that changed since the last flush ("sketch", "editor", ...)
+DirtyBatch = Dict[int, Set[str]]
+
+
+class WriteBehindScheduler:
+    """Tracks sessions with unsaved realtime edits and persists them in batches.
+
+    Edits only mark a session dirty; a background task hands the dirty set
+    to `flush` every `interval` seconds, or early once `max_dirty` sessions
+    are waiting. A crash therefore loses at most `interval` seconds of work,
+    and DB writes scale with edits instead of with connects/disconnects.
+    The flush callback is expected to do its DB work off the event loop.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[DirtyBatch], Awaitable[None]],
+        interval: Optional[float] = None,
+        max_dirty: Optional[int] = None,
+    ):
+        self._flush = flush
+        self.interval = interval or settings.PERSIST_FLUSH_INTERVAL
+        self.max_dirty = max_dirty or settings.PERSIST_MAX_DIRTY
+        self.dirty: DirtyBatch = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def mark_dirty(self, session_id: int, kind: str) -> None:
+        self.dirty.setdefault(session_id, set()).add(kind)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if len(self.dirty) >= self.max_dirty:
+            self._wakeup.set()
+
+    def is_dirty(self, session_id: int) -> bool:
+        return session_id in self.dirty
+
+    async def _run(self):
+        # Runs only while something is dirty; the next mark_dirty starts it again
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if self._stopping or not self.dirty:
+                self._task = None
+                return
+
+    async def flush(self, session_ids: Optional[Iterable[int]] = None) -> None:
+        """Persist all dirty sessions, or only `session_ids` if given.
+
+        Waits for a flush already in progress, so once this returns nothing
+        of those sessions is still on its way to the DB.
+        """
+        async with self._lock:
+            if session_ids is None:
+                batch, self.dirty = self.dirty, {}
+            else:
+                batch = {sid: self.dirty.pop(sid) for sid in session_ids if sid in self.dirty}
+            if not batch:
+                self._wake_if_idle()
+                return
+            try:
+                await self._flush(batch)
+            except asyncio.CancelledError:
+                self._restore(batch)  # not written; whoever flushes next picks it up
+                raise
+            except Exception as e:
+                # keep the batch dirty so the next tick retries it
+                print("write-behind flush error:", e)
+                self._restore(batch)
+            self._wake_if_idle()
+
+    def _wake_if_idle(self) -> None:
+        # an outside flush emptied the dirty set: let the sleeping task see that and exit now
+        if not self.dirty and self._task is not None and asyncio.current_task() is not self._task:
+            self._wakeup.set()
+
+    def _restore(self, batch: DirtyBatch) -> None:
+        for sid, kinds in batch.items():
+            self.dirty.setdefault(sid, set()).update(kinds)
+
+    async def stop(self) -> None:
+        """Stop the background task and flush everything still dirty (graceful shutdown).
+
+        The task is woken rather than cancelled, so a flush it has in progress
+        completes before the final one runs.
+        """
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            finally:
+                self._stopping = False
+                self._task = None
+        await self.flush()
@@ -1,18 +1,70 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
 from jose import jwt
 from passlib.context import CryptContext
 from core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New hashes use PASSWORD_HASH_SCHEME at the configured cost; older hashes (other
+# scheme or cost) still verify and are replaced on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default=settings.PASSWORD_HASH_SCHEME,
+    deprecated="auto",
+    argon2__time_cost=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+    bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(Exception):
+    """More hashing requests are waiting than PASSWORD_HASH_QUEUE allows."""
+
+
+class _Hasher:
+    """Runs hash/verify on a small dedicated pool instead of the request threads.
+
+    Endpoints are sync and wait for the result, so at most `workers` hashes
+    burn CPU at once and at most `workers + queue` request threads are parked
+    here; the rest are turned away (PasswordHasherBusy) and the threadpool
+    stays free for everything else during a login spike. bcrypt and argon2
+    release the GIL, so threads are enough.
+    """
+
+    def __init__(self, workers: int, queue: int):
+        self.limit = workers + queue
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+
+    def run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                raise PasswordHasherBusy()
+            self.in_flight += 1
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+_hasher = _Hasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return _hasher.run(pwd_context.hash, password)
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+    return _hasher.run(pwd_context.verify, plain, hashed)
+
+def verify_and_update_password(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """(valid, replacement hash or None) - the hash is returned when `hashed` uses an outdated scheme/cost."""
+    return _hasher.run(pwd_context.verify_and_update, plain, hashed)
 
 def create_access_token(data: dict, expires_delta: timedelta):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
\ No newline at end of file
+    return jwt.encode(to_encode, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
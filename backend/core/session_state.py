@@ -0,0 +1,632 @@
+import asyncio
+import json
+import uuid
+from bisect import bisect_right
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.text_buffer import TextBuffer
+
+Delta = Tuple[int, int, str]  # editor delta: (offset, length to delete, text to insert)
+MediaStatus = Dict[str, bool]  # {"mic": bool, "cam": bool}
+DEFAULT_MEDIA: MediaStatus = {"mic": False, "cam": False}
+
+# Sketch log bookkeeping: {"seq": last assigned seq, "floor": oldest seq a client may resume from,
+#                          "gen": rewrite counter, "epoch": id of this incarnation of the log}
+SketchMeta = Dict[str, Any]
+
+
+def stamp_action(action: dict, seq: int) -> dict:
+    """Return the action carrying its server-assigned sequence number."""
+    return {"seq": seq, **{k: v for k, v in action.items() if k != "seq"}}
+
+
+def new_epoch() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def _seq_of(action: dict) -> int:
+    return action["seq"]
+
+
+def apply_delta(base: str, offset: int, length: int, insert_text: str) -> str:
+    if offset <0:
+        offset = 0
+    if offset > len(base):
+        offset = len(base)
+    end = min(len(base), offset + max(0, length))
+    return base[:offset] + (insert_text or "") + base[end:]
+
+
+def transform_delta(delta: Delta, applied: Delta) -> Delta:
+    """Rebase a delta onto a document that already has a concurrent `applied` delta.
+
+    Positions after the applied range shift by its net size, deletions of
+    text the applied delta already removed are dropped, and of two inserts
+    at the same offset the one applied first stays first. A deletion that
+    spans the whole applied range also removes the text inserted there, so
+    the result is always a single contiguous delta.
+    """
+    offset, length, text = delta
+    b_off, b_len, b_text = applied
+    end, b_end = offset + length, b_off + b_len
+    if offset == end == b_off:
+        return b_off + len(b_text), 0, text
+    if end <= b_off:
+        return delta
+    if offset >= b_end:
+        return offset + len(b_text) - b_len, length, text
+    # overlapping ranges
+    after = max(0, end - b_end)
+    if offset < b_off:
+        before = b_off - offset
+        return offset, before + (len(b_text) + after if after else 0), text
+    return b_off + len(b_text), after, text
+
+
+class SessionStateStore:
+    """Live per-session realtime state: editor text, sketch log, presence and media status.
+
+    Editor and sketch state are "not loaded" (None) until warmed from the DB
+    with init_editor/init_sketch; the init calls are set-if-absent so
+    concurrent workers warming the same session agree on one value.
+    Presence is reference counted per user so a user with several sockets,
+    possibly on several workers, only goes offline with the last one.
+    """
+
+    # --- editor ---
+    async def get_editor(self, session_id: int) -> Optional[Tuple[str, int]]:
+        """Return (text, version) or None if the session isn't loaded."""
+        raise NotImplementedError
+
+    async def init_editor(self, session_id: int, text: str) -> Tuple[str, int]:
+        raise NotImplementedError
+
+    async def set_editor(self, session_id: int, text: str) -> int:
+        raise NotImplementedError
+
+    async def patch_editor(
+        self, session_id: int, offset: int, length: int, insert_text: str, base: Optional[int] = None,
+    ) -> Optional[Tuple[int, Delta]]:
+        """Atomically apply a delta to the editor text; returns (new version, applied delta).
+
+        With `base` (the version the client edited), the delta is first
+        transformed against every delta applied since then. Returns None if
+        that history is no longer available (base too old, ahead of the
+        server, or before an editor_set) and the client has to resync.
+        Without `base` the delta is applied as-is (legacy clients).
+        """
+        raise NotImplementedError
+
+    # --- sketch ---
+    # Every action carries a server-assigned, strictly increasing "seq". Clients
+    # resume with the seq/epoch they last saw; that is only valid while
+    # floor <= since_seq <= seq for the same epoch (a clear or compaction raises
+    # the floor, a reload from the DB starts a new epoch).
+    async def get_sketch(self, session_id: int, since_seq: int = 0) -> Optional[List[dict]]:
+        """Return the actions with seq > since_seq, or None if the session isn't loaded."""
+        raise NotImplementedError
+
+    async def get_sketch_meta(self, session_id: int) -> Optional[SketchMeta]:
+        raise NotImplementedError
+
+    async def init_sketch(self, session_id: int, actions: List[dict]) -> List[dict]:
+        """Warm the log with already stamped actions (ordered by seq), unless loaded."""
+        raise NotImplementedError
+
+    async def append_sketch(self, session_id: int, action: dict) -> Tuple[dict, int]:
+        """Atomically stamp and append one action; returns (stamped action, log length)."""
+        raise NotImplementedError
+
+    async def clear_sketch(self, session_id: int) -> int:
+        """Empty the log; the clear consumes a seq of its own, which is returned."""
+        raise NotImplementedError
+
+    async def replace_sketch_prefix(self, session_id: int, generation: int, upto_seq: int, prefix: List[dict]) -> bool:
+        """Swap all actions with seq <= upto_seq for `prefix`, keeping anything appended since.
+
+        Only applies if the log wasn't rewritten since `generation` was read;
+        returns whether it did.
+        """
+        raise NotImplementedError
+
+    # --- presence ---
+    async def add_presence(self, session_id: int, user_id: int) -> int:
+        """Count one more socket for the user; returns the user's socket count."""
+        raise NotImplementedError
+
+    async def remove_presence(self, session_id: int, user_id: int) -> int:
+        """Count one socket less for the user; returns the remaining count (0 = offline)."""
+        raise NotImplementedError
+
+    async def get_presence(self, session_id: int) -> List[int]:
+        raise NotImplementedError
+
+    async def is_present(self, session_id: int, user_id: int) -> bool:
+        return user_id in await self.get_presence(session_id)
+
+    # --- media ---
+    async def get_media(self, session_id: int) -> Dict[int, MediaStatus]:
+        raise NotImplementedError
+
+    async def patch_media(self, session_id: int, user_id: int, **fields: bool) -> MediaStatus:
+        """Merge fields into the user's media status (creating the default); returns the result."""
+        raise NotImplementedError
+
+    async def drop_presence(self, session_id: int) -> None:
+        """Forget presence and media for a session nobody is connected to."""
+        raise NotImplementedError
+
+    async def unload(self, session_id: int) -> None:
+        """Forget the editor/sketch state of a session that is persisted and has no sockets left.
+
+        The next access warms it from the DB again (new sketch epoch).
+        """
+        raise NotImplementedError
+
+
+def _rebase(delta: Delta, history: List[Delta]) -> Delta:
+    for applied in history:
+        delta = transform_delta(delta, applied)
+    return delta
+
+
+class _EditorDoc:
+    def __init__(self, text: str, version: int = 0):
+        self.buffer = TextBuffer(text)  # deltas are O(log n); str() only on sync/persist
+        self.version = version
+        self.history: deque = deque(maxlen=settings.EDITOR_HISTORY_SIZE)  # deltas up to `version`
+
+
+class _SketchLog:
+    def __init__(self, actions: List[dict], epoch: str):
+        self.actions = actions  # ordered by seq
+        self.seq = actions[-1]["seq"] if actions else 0
+        self.floor = self.seq
+        self.gen = 0
+        self.epoch = epoch
+
+    def meta(self) -> SketchMeta:
+        return {"seq": self.seq, "floor": self.floor, "gen": self.gen, "epoch": self.epoch}
+
+
+class MemorySessionStateStore(SessionStateStore):
+    """Process-local store for single-worker deployments and tests."""
+
+    def __init__(self):
+        self.editor: Dict[int, _EditorDoc] = {}
+        self.sketch: Dict[int, _SketchLog] = {}
+        self.presence: Dict[int, Dict[int, int]] = {}
+        self.media: Dict[int, Dict[int, MediaStatus]] = {}
+
+    async def get_editor(self, session_id):
+        doc = self.editor.get(session_id)
+        return (str(doc.buffer), doc.version) if doc else None
+
+    async def init_editor(self, session_id, text):
+        doc = self.editor.get(session_id)
+        if doc is None:
+            doc = self.editor[session_id] = _EditorDoc(text)
+        return str(doc.buffer), doc.version
+
+    async def set_editor(self, session_id, text):
+        doc = self.editor.get(session_id)
+        self.editor[session_id] = _EditorDoc(text, doc.version + 1 if doc else 1)
+        return self.editor[session_id].version
+
+    async def patch_editor(self, session_id, offset, length, insert_text, base=None):
+        doc = self.editor.get(session_id)
+        if doc is None:
+            doc = self.editor[session_id] = _EditorDoc("")
+        delta: Delta = (offset, length, insert_text)
+        if base is not None:
+            behind = doc.version - base
+            if behind < 0 or behind > len(doc.history):
+                return None
+            delta = _rebase(delta, list(doc.history)[len(doc.history) - behind:])
+        doc.buffer.replace(*delta)
+        doc.version += 1
+        doc.history.append(delta)
+        return doc.version, delta
+
+    async def get_sketch(self, session_id, since_seq=0):
+        log = self.sketch.get(session_id)
+        if log is None:
+            return None
+        if not since_seq:
+            return log.actions
+        return log.actions[bisect_right(log.actions, since_seq, key=_seq_of):]
+
+    async def get_sketch_meta(self, session_id):
+        log = self.sketch.get(session_id)
+        return log.meta() if log else None
+
+    async def init_sketch(self, session_id, actions):
+        if session_id not in self.sketch:
+            self.sketch[session_id] = _SketchLog(list(actions), new_epoch())
+        return self.sketch[session_id].actions
+
+    def _log(self, session_id) -> _SketchLog:
+        if session_id not in self.sketch:
+            self.sketch[session_id] = _SketchLog([], new_epoch())
+        return self.sketch[session_id]
+
+    async def append_sketch(self, session_id, action):
+        log = self._log(session_id)
+        log.seq += 1
+        stamped = stamp_action(action, log.seq)
+        log.actions.append(stamped)
+        return stamped, len(log.actions)
+
+    async def clear_sketch(self, session_id):
+        log = self._log(session_id)
+        log.seq += 1
+        log.floor = log.seq
+        log.gen += 1
+        log.actions = []
+        return log.seq
+
+    async def replace_sketch_prefix(self, session_id, generation, upto_seq, prefix):
+        log = self.sketch.get(session_id)
+        if log is None or log.gen != generation:
+            return False
+        log.actions[:bisect_right(log.actions, upto_seq, key=_seq_of)] = prefix
+        log.floor = max(log.floor, upto_seq)
+        log.gen += 1
+        return True
+
+    async def add_presence(self, session_id, user_id):
+        users = self.presence.setdefault(session_id, {})
+        users[user_id] = users.get(user_id, 0) + 1
+        return users[user_id]
+
+    async def remove_presence(self, session_id, user_id):
+        users = self.presence.get(session_id, {})
+        remaining = max(0, users.get(user_id, 0) - 1)
+        if remaining:
+            users[user_id] = remaining
+        else:
+            users.pop(user_id, None)
+        return remaining
+
+    async def get_presence(self, session_id):
+        return sorted(self.presence.get(session_id, {}))
+
+    async def get_media(self, session_id):
+        return {uid: dict(st) for uid, st in self.media.get(session_id, {}).items()}
+
+    async def patch_media(self, session_id, user_id, **fields):
+        st = self.media.setdefault(session_id, {}).setdefault(user_id, dict(DEFAULT_MEDIA))
+        st.update(fields)
+        return dict(st)
+
+    async def drop_presence(self, session_id):
+        self.presence.pop(session_id, None)
+        self.media.pop(session_id, None)
+
+    async def unload(self, session_id):
+        self.editor.pop(session_id, None)
+        self.sketch.pop(session_id, None)
+
+
+class RedisSessionStateStore(SessionStateStore):
+    """Shared store so every worker sees the same state and a restart keeps unsaved work.
+
+    Layout per session (all keys refreshed to REALTIME_STATE_TTL on write):
+      rt:{sid}:editor           hash {text, version}; patches are optimistic WATCH/MULTI on version
+      rt:{sid}:editor:ops       list of the last EDITOR_HISTORY_SIZE applied deltas (JSON [o, l, t])
+      rt:{sid}:sketch           sorted set of JSON actions scored by seq
+      rt:{sid}:sketch:meta      hash {seq, floor, gen, epoch}; exists once the log was warmed
+      rt:{sid}:presence         hash "{user_id}:{node}" -> socket count held by that worker
+      rt:{sid}:media            hash user_id -> JSON media status
+      rt:node:{node}            set while the worker is alive (PRESENCE_NODE_TTL, refreshed by it)
+
+    Presence only counts workers whose node key still exists, so the sockets
+    of a worker that crashed stop counting within PRESENCE_NODE_TTL; their
+    fields are dropped the next time the session's presence is read.
+    """
+
+    # Warm the editor only if nobody did it first; returns the winning [text, version]
+    _INIT_EDITOR = """
+    if redis.call('HSETNX', KEYS[1], 'version', 0) == 1 then
+        redis.call('HSET', KEYS[1], 'text', ARGV[1])
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        redis.call('DEL', KEYS[2])
+    end
+    return redis.call('HMGET', KEYS[1], 'text', 'version')
+    """
+
+    # Warm the sketch log only if nobody did it first.
+    # ARGV = ttl, epoch, last seq, then (seq, entry) pairs
+    _INIT_SKETCH = """
+    if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+    redis.call('DEL', KEYS[1])
+    for i = 4, #ARGV, 2 do redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1]) end
+    redis.call('HSET', KEYS[2], 'seq', ARGV[3], 'floor', ARGV[3], 'gen', 0, 'epoch', ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+    return 1
+    """
+
+    # Stamp ARGV[1] (JSON object without seq) with the next seq and append it; returns {seq, length}
+    _APPEND_SKETCH = """
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        redis.call('HSET', KEYS[2], 'seq', 0, 'floor', 0, 'gen', 0, 'epoch', ARGV[3])
+    end
+    local seq = redis.call('HINCRBY', KEYS[2], 'seq', 1)
+    local entry
+    if ARGV[1] == '{}' then
+        entry = '{"seq":' .. seq .. '}'
+    else
+        entry = '{"seq":' .. seq .. ',' .. string.sub(ARGV[1], 2)
+    end
+    redis.call('ZADD', KEYS[1], seq, entry)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+    return {seq, redis.call('ZCARD', KEYS[1])}
+    """
+
+    _CLEAR_SKETCH = """
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        redis.call('HSET', KEYS[2], 'seq', 0, 'floor', 0, 'gen', 0, 'epoch', ARGV[2])
+    end
+    local seq = redis.call('HINCRBY', KEYS[2], 'seq', 1)
+    redis.call('HSET', KEYS[2], 'floor', seq)
+    redis.call('HINCRBY', KEYS[2], 'gen', 1)
+    redis.call('DEL', KEYS[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+    return seq
+    """
+
+    # Replace entries with seq <= ARGV[2] by the (seq, entry) pairs in ARGV[3..] if gen is still ARGV[1]
+    _REPLACE_SKETCH_PREFIX = """
+    if tonumber(redis.call('HGET', KEYS[2], 'gen') or '-1') ~= tonumber(ARGV[1]) then return 0 end
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    for i = 3, #ARGV, 2 do redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1]) end
+    if tonumber(redis.call('HGET', KEYS[2], 'floor')) < tonumber(ARGV[2]) then
+        redis.call('HSET', KEYS[2], 'floor', ARGV[2])
+    end
+    redis.call('HINCRBY', KEYS[2], 'gen', 1)
+    return 1
+    """
+
+    _PATCH_MEDIA = """
+    local raw = redis.call('HGET', KEYS[1], ARGV[1])
+    local st = raw and cjson.decode(raw) or {mic=false, cam=false}
+    local patch = cjson.decode(ARGV[2])
+    for k, v in pairs(patch) do st[k] = v end
+    local out = cjson.encode(st)
+    redis.call('HSET', KEYS[1], ARGV[1], out)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return out
+    """
+
+    # Sum the user's socket counts over live workers, dropping fields of dead ones.
+    # Shared by the presence scripts below; ARGV[1] = node key prefix
+    _LIVE_COUNTS = """
+    local function live_counts(key, prefix)
+        local counts = {}
+        local rec = redis.call('HGETALL', key)
+        for i = 1, #rec, 2 do
+            local uid, node = string.match(rec[i], '^(%d+):(.+)$')
+            if uid and redis.call('EXISTS', prefix .. node) == 1 then
+                counts[uid] = (counts[uid] or 0) + tonumber(rec[i + 1])
+            else
+                redis.call('HDEL', key, rec[i])
+            end
+        end
+        return counts
+    end
+    """
+
+    # ARGV = node key prefix, user id, node, node ttl, state ttl; returns the user's live socket count
+    _ADD_PRESENCE = _LIVE_COUNTS + """
+    redis.call('SET', ARGV[1] .. ARGV[3], 1, 'EX', ARGV[4])
+    redis.call('HINCRBY', KEYS[1], ARGV[2] .. ':' .. ARGV[3], 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return live_counts(KEYS[1], ARGV[1])[ARGV[2]] or 0
+    """
+
+    # Decrement and delete-at-zero in one step, so a concurrent add can't be wiped out.
+    # ARGV = node key prefix, user id, node; returns the user's remaining live socket count
+    _REMOVE_PRESENCE = _LIVE_COUNTS + """
+    local field = ARGV[2] .. ':' .. ARGV[3]
+    if redis.call('HINCRBY', KEYS[1], field, -1) <= 0 then
+        redis.call('HDEL', KEYS[1], field)
+    end
+    return live_counts(KEYS[1], ARGV[1])[ARGV[2]] or 0
+    """
+
+    # ARGV = node key prefix; returns the ids of users with at least one live socket
+    _GET_PRESENCE = _LIVE_COUNTS + """
+    local users = {}
+    for uid, count in pairs(live_counts(KEYS[1], ARGV[1])) do
+        if count > 0 then table.insert(users, uid) end
+    end
+    return users
+    """
+
+    NODE_PREFIX = "rt:node:"
+
+    def __init__(self, client, ttl: Optional[int] = None):
+        self.redis = client
+        self.ttl = ttl or settings.REALTIME_STATE_TTL
+        self._init_editor = client.register_script(self._INIT_EDITOR)
+        self._init_sketch = client.register_script(self._INIT_SKETCH)
+        self._append_sketch = client.register_script(self._APPEND_SKETCH)
+        self._clear_sketch = client.register_script(self._CLEAR_SKETCH)
+        self._replace_sketch_prefix = client.register_script(self._REPLACE_SKETCH_PREFIX)
+        self._patch_media = client.register_script(self._PATCH_MEDIA)
+        self._add_presence = client.register_script(self._ADD_PRESENCE)
+        self._remove_presence = client.register_script(self._REMOVE_PRESENCE)
+        self._get_presence = client.register_script(self._GET_PRESENCE)
+        self.node_id = uuid.uuid4().hex
+        self.node_ttl = settings.PRESENCE_NODE_TTL
+        self._held = 0  # presence counts this worker holds
+        self._keepalive: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(session_id: int, part: str) -> str:
+        return f"rt:{session_id}:{part}"
+
+    async def get_editor(self, session_id):
+        rec = await self.redis.hgetall(self._key(session_id, "editor"))
+        if not rec:
+            return None
+        return rec.get("text", ""), int(rec.get("version", 0))
+
+    async def init_editor(self, session_id, text):
+        current, version = await self._init_editor(
+            keys=[self._key(session_id, "editor"), self._key(session_id, "editor:ops")], args=[text, self.ttl])
+        return current or "", int(version or 0)
+
+    async def set_editor(self, session_id, text):
+        key = self._key(session_id, "editor")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, "text", text)
+            pipe.hincrby(key, "version", 1)
+            pipe.expire(key, self.ttl)
+            pipe.delete(self._key(session_id, "editor:ops"))  # older bases can't be rebased anymore
+            _, version, _, _ = await pipe.execute()
+        return int(version)
+
+    async def patch_editor(self, session_id, offset, length, insert_text, base=None):
+        from redis.exceptions import WatchError
+
+        key, ops_key = self._key(session_id, "editor"), self._key(session_id, "editor:ops")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    text = await pipe.hget(key, "text") or ""
+                    version = int(await pipe.hget(key, "version") or 0)
+                    delta: Delta = (offset, length, insert_text)
+                    if base is not None:
+                        behind = version - base
+                        history = await pipe.lrange(ops_key, -behind, -1) if behind > 0 else []
+                        if behind < 0 or len(history) < behind:
+                            await pipe.unwatch()
+                            return None
+                        delta = _rebase(delta, [tuple(json.loads(op)) for op in history])
+                    pipe.multi()
+                    pipe.hset(key, mapping={
+                        "text": apply_delta(text, *delta),
+                        "version": version + 1,
+                    })
+                    pipe.expire(key, self.ttl)
+                    pipe.rpush(ops_key, json.dumps(delta, separators=(",", ":")))
+                    pipe.ltrim(ops_key, -settings.EDITOR_HISTORY_SIZE, -1)
+                    pipe.expire(ops_key, self.ttl)
+                    await pipe.execute()
+                    return version + 1, delta
+                except WatchError:
+                    continue  # another worker patched in between; retry on the new version
+
+    def _sketch_keys(self, session_id) -> List[str]:
+        return [self._key(session_id, "sketch"), self._key(session_id, "sketch:meta")]
+
+    @staticmethod
+    def _entries(actions: List[dict]) -> List[Any]:
+        pairs: List[Any] = []
+        for a in actions:
+            pairs += [a["seq"], json.dumps(a, separators=(",", ":"))]
+        return pairs
+
+    async def get_sketch(self, session_id, since_seq=0):
+        if not await self.redis.exists(self._key(session_id, "sketch:meta")):
+            return None
+        entries = await self.redis.zrangebyscore(self._key(session_id, "sketch"), f"({since_seq}", "+inf")
+        return [json.loads(a) for a in entries]
+
+    async def get_sketch_meta(self, session_id):
+        rec = await self.redis.hgetall(self._key(session_id, "sketch:meta"))
+        if not rec:
+            return None
+        return {"seq": int(rec["seq"]), "floor": int(rec["floor"]), "gen": int(rec["gen"]), "epoch": rec["epoch"]}
+
+    async def init_sketch(self, session_id, actions):
+        last_seq = actions[-1]["seq"] if actions else 0
+        await self._init_sketch(
+            keys=self._sketch_keys(session_id),
+            args=[self.ttl, new_epoch(), last_seq] + self._entries(actions),
+        )
+        return await self.get_sketch(session_id) or []
+
+    async def append_sketch(self, session_id, action):
+        body = json.dumps({k: v for k, v in action.items() if k != "seq"}, separators=(",", ":"))
+        seq, length = await self._append_sketch(
+            keys=self._sketch_keys(session_id),
+            args=[body, self.ttl, new_epoch()],
+        )
+        return stamp_action(action, int(seq)), int(length)
+
+    async def clear_sketch(self, session_id):
+        seq = await self._clear_sketch(keys=self._sketch_keys(session_id), args=[self.ttl, new_epoch()])
+        return int(seq)
+
+    async def replace_sketch_prefix(self, session_id, generation, upto_seq, prefix):
+        # entries appended while the prefix was being compacted have seq > upto_seq and stay
+        done = await self._replace_sketch_prefix(
+            keys=self._sketch_keys(session_id),
+            args=[generation, upto_seq] + self._entries(prefix),
+        )
+        return bool(done)
+
+    async def _refresh_node(self):
+        # Keep this worker's presence counts alive while it holds any
+        while self._held > 0:
+            await asyncio.sleep(self.node_ttl / 3)
+            try:
+                await self.redis.set(self.NODE_PREFIX + self.node_id, 1, ex=self.node_ttl)
+            except Exception as e:
+                print("presence keepalive error:", e)
+        self._keepalive = None
+
+    async def add_presence(self, session_id, user_id):
+        count = await self._add_presence(
+            keys=[self._key(session_id, "presence")],
+            args=[self.NODE_PREFIX, user_id, self.node_id, self.node_ttl, self.ttl],
+        )
+        self._held += 1
+        if self._keepalive is None:
+            self._keepalive = asyncio.create_task(self._refresh_node())
+        return int(count)
+
+    async def remove_presence(self, session_id, user_id):
+        self._held = max(0, self._held - 1)
+        remaining = await self._remove_presence(
+            keys=[self._key(session_id, "presence")],
+            args=[self.NODE_PREFIX, user_id, self.node_id],
+        )
+        return int(remaining)
+
+    async def get_presence(self, session_id):
+        users = await self._get_presence(keys=[self._key(session_id, "presence")], args=[self.NODE_PREFIX])
+        return sorted(int(uid) for uid in users)
+
+    async def get_media(self, session_id):
+        rec = await self.redis.hgetall(self._key(session_id, "media"))
+        return {int(uid): json.loads(st) for uid, st in rec.items()}
+
+    async def patch_media(self, session_id, user_id, **fields):
+        out = await self._patch_media(
+            keys=[self._key(session_id, "media")],
+            args=[user_id, json.dumps(fields), self.ttl],
+        )
+        return json.loads(out)
+
+    async def drop_presence(self, session_id):
+        await self.redis.delete(self._key(session_id, "presence"), self._key(session_id, "media"))
+
+    async def unload(self, session_id):
+        pass  # other workers may still hold sockets for it; idle keys expire after REALTIME_STATE_TTL
+
+
+def create_state_store() -> SessionStateStore:
+    if settings.SESSION_STATE_BACKEND == "redis":
+        if not settings.REDIS_URL:
+            raise RuntimeError("SESSION_STATE_BACKEND=redis requires REDIS_URL")
+        import redis.asyncio as aioredis
+        return RedisSessionStateStore(aioredis.from_url(settings.REDIS_URL, decode_responses=True))
+    return MemorySessionStateStore()
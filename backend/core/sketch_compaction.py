@@ -0,0 +1,142 @@
+import math
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+Cell = Tuple[int, int]
+
+# Cell visits allowed per stroke; a stroke above it (huge lineWidth, far-apart
+# points) isn't analysed and is treated as possibly painting/erasing anywhere
+MAX_STROKE_CELLS = 50_000
+
+
+def _point(p: Any) -> Optional[Tuple[float, float]]:
+    try:
+        x, y = float(p["x"]), float(p["y"])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+    if not (math.isfinite(x) and math.isfinite(y)):
+        return None
+    return x, y
+
+
+def _samples(points: list, step: float) -> Iterable[Tuple[float, float]]:
+    """Points along the stroke polyline, at most `step` apart."""
+    prev: Optional[Tuple[float, float]] = None
+    for p in points:
+        point = _point(p)
+        if point is None:
+            continue
+        x, y = point
+        if prev is not None:
+            dist = math.hypot(x - prev[0], y - prev[1])
+            n = int(dist // step)
+            for i in range(1, n + 1):
+                t = i * step / dist
+                yield prev[0] + (x - prev[0]) * t, prev[1] + (y - prev[1]) * t
+        yield x, y
+        prev = (x, y)
+
+
+def _has_segment(points: list) -> bool:
+    """Whether the polyline has a segment of non-zero length; canvas paints nothing for it otherwise."""
+    first = None
+    for p in points:
+        point = _point(p)
+        if point is None:
+            continue
+        if first is None:
+            first = point
+        elif point != first:
+            return True
+    return False
+
+
+def _cells(action: dict, cell: float, full: bool, max_cells: int = MAX_STROKE_CELLS) -> Optional[Set[Cell]]:
+    """Grid cells a stroke touches (full=False) or is sure to cover completely (full=True).
+
+    Both are conservative: "touched" may over-approximate the painted area and
+    "full" may under-approximate the erased area, so a stroke is only ever
+    dropped when it is certainly invisible. Returns None when the stroke would
+    take more than `max_cells` cell visits.
+    """
+    try:
+        radius = max(float(action.get("lineWidth") or 2), 1.0) / 2
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if not math.isfinite(radius):
+        return None
+    step = cell / 2
+    budget = max_cells
+    out: Set[Cell] = set()
+    for x, y in _samples(action.get("points") or [], step):
+        if full:
+            # cell fits inside the disc around the sample: every corner within radius
+            reach = radius
+        else:
+            # any cell within radius (+ half the sampling gap) of the centre line
+            reach = radius + step / 2
+        lo_x, hi_x = int((x - reach) // cell), int((x + reach) // cell)
+        lo_y, hi_y = int((y - reach) // cell), int((y + reach) // cell)
+        budget -= (hi_x - lo_x + 1) * (hi_y - lo_y + 1)
+        if budget < 0:
+            return None
+        for cx in range(lo_x, hi_x + 1):
+            for cy in range(lo_y, hi_y + 1):
+                if full:
+                    far_x = max(abs(cx * cell - x), abs((cx + 1) * cell - x))
+                    far_y = max(abs(cy * cell - y), abs((cy + 1) * cell - y))
+                    if math.hypot(far_x, far_y) > radius:
+                        continue
+                out.add((cx, cy))
+    return out
+
+
+def _is_stroke(action: dict) -> bool:
+    return action.get("type") == "stroke" and isinstance(action.get("points"), list)
+
+
+def compact_actions(actions: List[dict], cell: float = 8.0, max_cells: int = MAX_STROKE_CELLS) -> List[dict]:
+    """Fold a sketch action log into an equivalent, shorter one.
+
+    Drops strokes without points, drawn strokes that later eraser strokes
+    fully cover, and eraser strokes that no longer erase anything that is
+    still drawn. Everything else (including unknown action types) is kept
+    in its original order, so replaying the result paints the same canvas.
+    Strokes too large to analyse within `max_cells` are always kept, and a
+    drawn one keeps every eraser after it.
+    """
+    # Backward pass: drop drawn strokes fully covered by erasers that come after them
+    erased: Set[Cell] = set()
+    keep = [True] * len(actions)
+    touched_cache = {}
+    for i in range(len(actions) - 1, -1, -1):
+        action = actions[i]
+        if not isinstance(action, dict) or not _is_stroke(action):
+            continue
+        if not action["points"]:
+            keep[i] = False
+        elif action.get("mode") == "erase":
+            if _has_segment(action["points"]):  # a dot or zero-length eraser erases nothing
+                erased |= _cells(action, cell, full=True, max_cells=max_cells) or set()
+        else:
+            touched_cache[i] = _cells(action, cell, full=False, max_cells=max_cells)
+            if touched_cache[i] is not None and touched_cache[i] <= erased:
+                keep[i] = False
+
+    # Forward pass: drop erasers that don't touch any surviving drawn stroke before them
+    painted: Set[Cell] = set()
+    painted_anywhere = False  # a drawn stroke too large to analyse came before
+    out: List[dict] = []
+    for i, action in enumerate(actions):
+        if not keep[i]:
+            continue
+        if isinstance(action, dict) and _is_stroke(action):
+            touched = touched_cache[i] if i in touched_cache else _cells(action, cell, full=False, max_cells=max_cells)
+            if action.get("mode") == "erase":
+                if touched is not None and not painted_anywhere and not touched & painted:
+                    continue
+            elif touched is None:
+                painted_anywhere = True
+            else:
+                painted |= touched
+        out.append(action)
+    return out
@@ -0,0 +1,143 @@
+import struct
+from typing import Optional
+
+# Compact binary encoding of a sketch stroke, for clients that negotiate it.
+#
+#   offset  size  field
+#   0       1     kind (STROKE = 1; 2 is a compressed snapshot, see core.compression)
+#   1       1     flags (bit 0: erase)
+#   2       4     seq (u32, 0 from the client; stamped by the server)
+#   6       4     user id (u32, 0 from the client; filled in by the server)
+#   10      2     lineWidth in 1/10 px (u16)
+#   12      1     color length n
+#   13      n     color (utf-8, e.g. "#1e90ff")
+#   ...           point count (varint), then per point dx, dy (zigzag varints)
+#                 in 1/QUANT px, relative to the previous point (first to 0,0)
+#
+# All fixed-width fields are big-endian. Coordinates are quantized to 1/QUANT
+# px, which is below what the canvas can show.
+
+STROKE = 1
+FLAG_ERASE = 0x01
+QUANT = 4
+
+_HEADER = struct.Struct(">BBIIHB")
+_SEQ_USER = struct.Struct(">II")
+_SEQ_OFFSET = 2
+
+# Quantized coordinates must fit the 64-bit zigzag encoding
+_MAX_COORD = 2 ** 62
+
+# Keys a JSON stroke may have to be representable without loss
+_STROKE_KEYS = {"seq", "type", "points", "color", "lineWidth", "mode"}
+
+
+class StrokeDecodeError(ValueError):
+    pass
+
+
+def _put_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf: bytes, pos: int):
+    result = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise StrokeDecodeError("truncated varint")
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise StrokeDecodeError("varint too long")
+
+
+def encode_stroke(action: dict, seq: int = 0, user_id: int = 0) -> Optional[bytes]:
+    """Binary frame for a JSON stroke action, or None if it can't be represented.
+
+    Point coordinates are quantized to 1/QUANT px; every other field (and
+    anything outside the fields' ranges) must fit exactly.
+    """
+    if action.get("type") != "stroke" or not set(action) <= _STROKE_KEYS:
+        return None
+    points = action.get("points")
+    color = action.get("color", "")
+    mode = action.get("mode", "draw")
+    if not isinstance(points, list) or not isinstance(color, str) or mode not in ("draw", "erase"):
+        return None
+    color_bytes = color.encode()
+    try:
+        width = round(float(action.get("lineWidth", 0)) * 10)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if len(color_bytes) > 255 or not 0 <= width <= 0xFFFF:
+        return None
+
+    try:
+        header = _HEADER.pack(STROKE, FLAG_ERASE if mode == "erase" else 0, seq, user_id, width, len(color_bytes))
+    except struct.error:
+        return None  # seq or user id beyond u32
+    out = bytearray(header)
+    out += color_bytes
+    _put_varint(out, len(points))
+    px = py = 0
+    for p in points:
+        try:
+            x, y = round(float(p["x"]) * QUANT), round(float(p["y"]) * QUANT)
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return None
+        if not (-_MAX_COORD < x < _MAX_COORD and -_MAX_COORD < y < _MAX_COORD):
+            return None
+        dx, dy = x - px, y - py
+        _put_varint(out, (dx << 1) ^ (dx >> 63))
+        _put_varint(out, (dy << 1) ^ (dy >> 63))
+        px, py = x, y
+    return bytes(out)
+
+
+def decode_stroke(frame: bytes) -> dict:
+    """JSON-style stroke action ({"type": "stroke", ...}, without seq) from a binary frame."""
+    if len(frame) < _HEADER.size:
+        raise StrokeDecodeError("frame too short")
+    kind, flags, _, _, width, color_len = _HEADER.unpack_from(frame)
+    if kind != STROKE:
+        raise StrokeDecodeError(f"unknown frame kind {kind}")
+    pos = _HEADER.size + color_len
+    if pos > len(frame):
+        raise StrokeDecodeError("truncated color")
+    color = frame[_HEADER.size:pos].decode(errors="replace")
+    count, pos = _get_varint(frame, pos)
+    points = []
+    x = y = 0
+    for _ in range(count):
+        zx, pos = _get_varint(frame, pos)
+        zy, pos = _get_varint(frame, pos)
+        x += (zx >> 1) ^ -(zx & 1)
+        y += (zy >> 1) ^ -(zy & 1)
+        points.append({"x": x / QUANT, "y": y / QUANT})
+    return {
+        "type": "stroke",
+        "points": points,
+        "color": color,
+        "lineWidth": width / 10,
+        "mode": "erase" if flags & FLAG_ERASE else "draw",
+    }
+
+
+def stamp_stroke(frame: bytes, seq: int, user_id: int) -> Optional[bytes]:
+    """Copy of a client frame carrying the server seq and sender, without re-encoding the points.
+
+    None if seq or user id doesn't fit the header (u32).
+    """
+    out = bytearray(frame)
+    try:
+        _SEQ_USER.pack_into(out, _SEQ_OFFSET, seq, user_id)
+    except struct.error:
+        return None
+    return bytes(out)
@@ -0,0 +1,241 @@
+from typing import List, Optional, Tuple, Union
+
+LEAF_MAX = 512  # max characters per leaf; adjacent small leaves are merged up to this size
+
+
+class _Leaf:
+    __slots__ = ("text", "length", "newlines", "height")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self.newlines = text.count("\n")
+        self.height = 0
+
+
+class _Node:
+    __slots__ = ("left", "right", "length", "newlines", "height")
+
+    def __init__(self, left: "_Rope", right: "_Rope"):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.newlines = left.newlines + right.newlines
+        self.height = max(left.height, right.height) + 1
+
+
+_Rope = Union[_Leaf, _Node]
+
+
+def _rotate_left(n: _Node) -> _Node:
+    r = n.right
+    return _Node(_Node(n.left, r.left), r.right)
+
+
+def _rotate_right(n: _Node) -> _Node:
+    l = n.left
+    return _Node(l.left, _Node(l.right, n.right))
+
+
+def _balance(n: _Rope) -> _Rope:
+    if isinstance(n, _Leaf):
+        return n
+    diff = n.left.height - n.right.height
+    if diff > 1:
+        left = n.left
+        if left.left.height < left.right.height:
+            n = _Node(_rotate_left(left), n.right)
+        return _rotate_right(n)
+    if diff < -1:
+        right = n.right
+        if right.right.height < right.left.height:
+            n = _Node(n.left, _rotate_right(right))
+        return _rotate_left(n)
+    return n
+
+
+def _join(a: Optional[_Rope], b: Optional[_Rope]) -> Optional[_Rope]:
+    """Concatenate two balanced ropes in O(|height(a) - height(b)|)."""
+    if a is None or a.length == 0:
+        return b
+    if b is None or b.length == 0:
+        return a
+    if isinstance(a, _Leaf) and isinstance(b, _Leaf) and a.length + b.length <= LEAF_MAX:
+        return _Leaf(a.text + b.text)
+    if a.height > b.height + 1:
+        return _balance(_Node(a.left, _join(a.right, b)))
+    if b.height > a.height + 1:
+        return _balance(_Node(_join(a, b.left), b.right))
+    return _Node(a, b)
+
+
+def _split(n: Optional[_Rope], i: int) -> Tuple[Optional[_Rope], Optional[_Rope]]:
+    """Split into [0, i) and [i, len) in O(log n)."""
+    if n is None:
+        return None, None
+    if i <= 0:
+        return None, n
+    if i >= n.length:
+        return n, None
+    if isinstance(n, _Leaf):
+        return _Leaf(n.text[:i]), _Leaf(n.text[i:])
+    if i < n.left.length:
+        a, b = _split(n.left, i)
+        return a, _join(b, n.right)
+    a, b = _split(n.right, i - n.left.length)
+    return _join(n.left, a), b
+
+
+def _build(text: str) -> Optional[_Rope]:
+    if not text:
+        return None
+    leaves: List[_Rope] = [_Leaf(text[i:i + LEAF_MAX]) for i in range(0, len(text), LEAF_MAX)]
+    while len(leaves) > 1:
+        leaves = [_Node(leaves[i], leaves[i + 1]) if i + 1 < len(leaves) else leaves[i] for i in range(0, len(leaves), 2)]
+    return leaves[0]
+
+
+def _collect(n: Optional[_Rope], out: List[str]) -> None:
+    stack = [n] if n is not None else []
+    while stack:
+        node = stack.pop()
+        if isinstance(node, _Leaf):
+            out.append(node.text)
+        else:
+            stack.append(node.right)
+            stack.append(node.left)
+
+
+class TextBuffer:
+    """Rope-backed document for the collaborative editor.
+
+    Inserts and deletes are O(log n) instead of rebuilding the whole string;
+    the full text is only materialized (and cached until the next edit) when
+    it is actually needed, e.g. for editor_sync or persistence. Also keeps
+    per-subtree newline counts for offset <-> line/column lookups.
+    """
+
+    __slots__ = ("_root", "_text")
+
+    def __init__(self, text: str = ""):
+        self._root = _build(text)
+        self._text: Optional[str] = text
+
+    def __len__(self) -> int:
+        return self._root.length if self._root else 0
+
+    def __str__(self) -> str:
+        if self._text is None:
+            parts: List[str] = []
+            _collect(self._root, parts)
+            self._text = "".join(parts)
+            # rebuild from the materialized text so fragmented leaves get packed again
+            self._root = _build(self._text)
+        return self._text
+
+    def replace(self, offset: int, length: int, insert_text: str) -> None:
+        """Same clamping semantics as session_state.apply_delta."""
+        size = len(self)
+        offset = min(max(offset, 0), size)
+        end = min(size, offset + max(0, length))
+        self._text = None
+        if self._root is not None and self._patch_leaf(offset, end, insert_text):
+            return
+        left, rest = _split(self._root, offset)
+        _, right = _split(rest, end - offset)
+        middle = _build(insert_text) if insert_text else None
+        self._root = _join(_join(left, middle), right)
+
+    def _patch_leaf(self, offset: int, end: int, insert_text: str) -> bool:
+        """Fast path: edit inside a single leaf in place and fix up the counts on its path.
+
+        The tree is owned by this buffer alone, so mutating it is safe; the
+        leaf may grow to 2 * LEAF_MAX before edits go through split/join again.
+        """
+        path = []
+        n = self._root
+        while not isinstance(n, _Leaf):
+            path.append(n)
+            if offset < n.left.length:
+                n = n.left
+            else:
+                offset -= n.left.length
+                end -= n.left.length
+                n = n.right
+        if end > n.length:
+            return False
+        text = n.text[:offset] + insert_text + n.text[end:]
+        if not text or len(text) > 2 * LEAF_MAX:
+            return False
+        delta_len = len(text) - n.length
+        delta_nl = insert_text.count("\n") - n.text.count("\n", offset, end)
+        n.text, n.length, n.newlines = text, len(text), n.newlines + delta_nl
+        for node in path:
+            node.length += delta_len
+            node.newlines += delta_nl
+        return True
+
+    def insert(self, offset: int, text: str) -> None:
+        self.replace(offset, 0, text)
+
+    def delete(self, offset: int, length: int) -> None:
+        self.replace(offset, length, "")
+
+    def slice(self, start: int, end: int) -> str:
+        size = len(self)
+        start, end = min(max(start, 0), size), min(max(end, 0), size)
+        if start >= end:
+            return ""
+        if self._text is not None:
+            return self._text[start:end]
+        _, rest = _split(self._root, start)
+        piece, _ = _split(rest, end - start)
+        parts: List[str] = []
+        _collect(piece, parts)
+        return "".join(parts)
+
+    def line_count(self) -> int:
+        return (self._root.newlines if self._root else 0) + 1
+
+    def offset_to_position(self, offset: int) -> Tuple[int, int]:
+        """0-based (line, column) of a character offset."""
+        offset = min(max(offset, 0), len(self))
+        line = 0
+        consumed = 0
+        n = self._root
+        while n is not None and not isinstance(n, _Leaf):
+            if offset < n.left.length:
+                n = n.left
+            else:
+                offset -= n.left.length
+                consumed += n.left.length
+                line += n.left.newlines
+                n = n.right
+        if n is None:
+            return 0, 0
+        head = n.text[:offset]
+        line += head.count("\n")
+        if "\n" in head:
+            return line, offset - head.rfind("\n") - 1
+        # column continues from the last newline before this leaf
+        return line, offset + consumed - self.line_start(line)
+
+    def line_start(self, line: int) -> int:
+        """Offset of the first character of a 0-based line (clamped to the last line)."""
+        line = min(max(line, 0), self.line_count() - 1)
+        if line == 0:
+            return 0
+        offset = 0
+        n = self._root
+        while not isinstance(n, _Leaf):
+            if line <= n.left.newlines:
+                n = n.left
+            else:
+                line -= n.left.newlines
+                offset += n.left.length
+                n = n.right
+        # the line-th newline in this leaf ends the previous line
+        idx = -1
+        for _ in range(line):
+            idx = n.text.index("\n", idx + 1)
+        return offset + idx + 1
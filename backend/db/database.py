@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from core.config import settings
 
@@ -10,6 +11,27 @@ SessionLocal = sessionmaker(
     bind=engine, autoflush=False, autocommit=False, future=True
 )
 
+# Async engine for the realtime hot path (websocket handlers, write-behind flushes),
+# so DB round-trips never block the event loop
+def _async_db_url(url: str) -> str:
+    """Async driver for DB_URL: psycopg 3 for Postgres, aiosqlite for SQLite."""
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+psycopg://"),
+        ("postgresql://", "postgresql+psycopg://"),
+        ("postgres://", "postgresql+psycopg://"),
+        ("sqlite+pysqlite://", "sqlite+aiosqlite://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url  # already async (postgresql+psycopg, postgresql+asyncpg, sqlite+aiosqlite)
+
+async_engine = create_async_engine(settings.ASYNC_DB_URL or _async_db_url(settings.DB_URL), pool_pre_ping=True)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 # Base class for models
 Base = declarative_base()
 
@@ -19,4 +41,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
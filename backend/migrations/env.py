@@ -19,7 +19,7 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from db.database import engine, Base
-from models import user, session, message, session_member, material, session_editor, session_sketch  # import all models so Alembic sees them
+from models import user, session, message, session_member, material, session_editor, session_sketch_action  # import all models so Alembic sees them
 from core.config import settings
 config.set_main_option("sqlalchemy.url", settings.DB_URL)
 
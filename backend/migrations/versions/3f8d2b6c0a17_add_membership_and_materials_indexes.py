@@ -0,0 +1,35 @@
+"""unique (session_id, user_id) index on session_members, session_id index on materials
+
+Revision ID: 3f8d2b6c0a17
+Revises: e7b3c5a19f42
+Create Date: 2026-10-18 15:02:11.847263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8d2b6c0a17'
+down_revision: Union[str, Sequence[str], None] = 'e7b3c5a19f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # joins were never guarded against races; keep the oldest row of any duplicate membership
+    op.execute(
+        "DELETE FROM session_members WHERE id NOT IN "
+        "(SELECT MIN(id) FROM session_members GROUP BY session_id, user_id)"
+    )
+    op.create_index('ix_session_members_session_user', 'session_members', ['session_id', 'user_id'], unique=True)
+    op.create_index(op.f('ix_materials_session_id'), 'materials', ['session_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_materials_session_id'), table_name='materials')
+    op.drop_index('ix_session_members_session_user', table_name='session_members')
@@ -0,0 +1,115 @@
+"""add session_sketch_actions table (chunked sketch log), migrate session_sketches blobs
+
+Revision ID: 5c3e9a71d2b4
+Revises: bd006cf19336
+Create Date: 2026-10-18 09:12:40.118305
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c3e9a71d2b4'
+down_revision: Union[str, Sequence[str], None] = 'bd006cf19336'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CHUNK_SIZE = 256  # actions per chunk when splitting existing blobs
+
+session_sketches = sa.table(
+    'session_sketches',
+    sa.column('session_id', sa.Integer()),
+    sa.column('content', sa.Text()),
+)
+session_sketch_actions = sa.table(
+    'session_sketch_actions',
+    sa.column('session_id', sa.Integer()),
+    sa.column('seq', sa.Integer()),
+    sa.column('count', sa.Integer()),
+    sa.column('content', sa.Text()),
+)
+
+
+def _parse_blob(content):
+    if content in (None, "", "null"):
+        return []
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        return []
+    if isinstance(parsed, list):
+        return parsed
+    if isinstance(parsed, dict):
+        return [parsed]
+    return []
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('session_sketch_actions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['sessions.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id', 'seq', name='uq_session_sketch_actions_session_seq')
+    )
+    op.create_index(op.f('ix_session_sketch_actions_id'), 'session_sketch_actions', ['id'], unique=False)
+
+    # Split every existing blob into chunks; sequence numbers start at 1
+    conn = op.get_bind()
+    for session_id, content in conn.execute(sa.select(session_sketches.c.session_id, session_sketches.c.content)):
+        actions = _parse_blob(content)
+        rows = [
+            {
+                'session_id': session_id,
+                'seq': start + 1,
+                'count': len(actions[start:start + CHUNK_SIZE]),
+                'content': json.dumps(actions[start:start + CHUNK_SIZE], separators=(",", ":")),
+            }
+            for start in range(0, len(actions), CHUNK_SIZE)
+        ]
+        if rows:
+            conn.execute(session_sketch_actions.insert(), rows)
+
+    op.drop_index(op.f('ix_session_sketches_id'), table_name='session_sketches')
+    op.drop_table('session_sketches')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table('session_sketches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['sessions.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id')
+    )
+    op.create_index(op.f('ix_session_sketches_id'), 'session_sketches', ['id'], unique=False)
+
+    # Reassemble one blob per session from its chunks
+    conn = op.get_bind()
+    blobs = {}
+    chunks = conn.execute(
+        sa.select(session_sketch_actions.c.session_id, session_sketch_actions.c.content)
+        .order_by(session_sketch_actions.c.session_id, session_sketch_actions.c.seq)
+    )
+    for session_id, content in chunks:
+        blobs.setdefault(session_id, []).extend(_parse_blob(content))
+    if blobs:
+        conn.execute(session_sketches.insert(), [
+            {'session_id': session_id, 'content': json.dumps(actions, separators=(",", ":"))}
+            for session_id, actions in blobs.items()
+        ])
+
+    op.drop_index(op.f('ix_session_sketch_actions_id'), table_name='session_sketch_actions')
+    op.drop_table('session_sketch_actions')
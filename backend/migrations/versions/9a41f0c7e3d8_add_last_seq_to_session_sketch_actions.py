@@ -0,0 +1,31 @@
+"""add last_seq to session_sketch_actions
+
+Revision ID: 9a41f0c7e3d8
+Revises: 5c3e9a71d2b4
+Create Date: 2026-10-18 11:47:05.902214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a41f0c7e3d8'
+down_revision: Union[str, Sequence[str], None] = '5c3e9a71d2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('session_sketch_actions', sa.Column('last_seq', sa.Integer(), nullable=True))
+    # chunks written so far hold gap-free sequence numbers
+    op.execute("UPDATE session_sketch_actions SET last_seq = seq + count - 1")
+    op.alter_column('session_sketch_actions', 'last_seq', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('session_sketch_actions', 'last_seq')
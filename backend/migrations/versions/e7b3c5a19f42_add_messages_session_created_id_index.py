@@ -0,0 +1,28 @@
+"""add (session_id, created_at, id) index on messages
+
+Revision ID: e7b3c5a19f42
+Revises: 9a41f0c7e3d8
+Create Date: 2026-10-18 14:21:37.530118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b3c5a19f42'
+down_revision: Union[str, Sequence[str], None] = '9a41f0c7e3d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_session_created_id', 'messages', ['session_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_session_created_id', table_name='messages')
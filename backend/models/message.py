@@ -1,11 +1,15 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import Integer, String, ForeignKey, DateTime
+from sqlalchemy import Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from db.database import Base
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # keyset pagination of a session's history (see GET /sessions/{id}/messages)
+        Index("ix_messages_session_created_id", "session_id", "created_at", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     content: Mapped[str] = mapped_column(String, nullable=False)
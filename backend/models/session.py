@@ -18,5 +18,5 @@ class Session(Base):
     members: Mapped[List["SessionMember"]] = relationship("SessionMember", back_populates="session", cascade="all, delete-orphan")
     materials: Mapped[List["Material"]] = relationship("Material", back_populates="session", cascade="all, delete-orphan")
     editor: Mapped["SessionEditor"] = relationship("SessionEditor", back_populates="session", uselist=False, cascade="all, delete-orphan")
-    sketch: Mapped["SessionSketch"] = relationship("SessionSketch", back_populates="session", uselist=False, cascade="all, delete-orphan")
+    sketch_actions: Mapped[List["SessionSketchAction"]] = relationship("SessionSketchAction", back_populates="session", cascade="all, delete-orphan", order_by="SessionSketchAction.seq")
     
\ No newline at end of file
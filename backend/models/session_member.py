@@ -1,10 +1,14 @@
 from datetime import datetime
-from sqlalchemy import Integer, ForeignKey, DateTime
+from sqlalchemy import Integer, ForeignKey, DateTime, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from db.database import Base
 
 class SessionMember(Base):
     __tablename__ = "session_members"
+    __table_args__ = (
+        # membership lookups on every connect/upload/list; also makes double joins impossible
+        Index("ix_session_members_session_user", "session_id", "user_id", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     session_id: Mapped[int] = mapped_column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=False)
@@ -1,22 +0,0 @@
-from sqlalchemy import Integer, Text, ForeignKey, DateTime, func
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-from db.database import Base
-
-class SessionSketch(Base):
-    __tablename__ = "session_sketches"
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    session_id: Mapped[int] = mapped_column(
-        Integer,
-        ForeignKey("sessions.id", ondelete="CASCADE"),
-        unique=True,
-        nullable=False
-    )
-    content: Mapped[str] = mapped_column(Text, nullable=False, default="")
-    updated_at: Mapped[DateTime] = mapped_column(
-        DateTime(timezone=True),
-        server_default=func.now(),
-        onupdate=func.now()
-    )
-
-    session: Mapped["Session"] = relationship("Session", back_populates="sketch")
\ No newline at end of file
@@ -0,0 +1,32 @@
+from sqlalchemy import Integer, Text, ForeignKey, DateTime, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from db.database import Base
+
+class SessionSketchAction(Base):
+    """Append-only chunk of consecutive sketch actions with sequence numbers seq..last_seq.
+
+    Sequence numbers may have gaps once the log was compacted, so `count`
+    is not necessarily last_seq - seq + 1.
+    """
+    __tablename__ = "session_sketch_actions"
+    __table_args__ = (
+        # also serves ordered, per-session chunk streaming
+        UniqueConstraint("session_id", "seq", name="uq_session_sketch_actions_session_seq"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    session_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("sessions.id", ondelete="CASCADE"),
+        nullable=False
+    )
+    seq: Mapped[int] = mapped_column(Integer, nullable=False)     # sequence number of the first action in the chunk
+    last_seq: Mapped[int] = mapped_column(Integer, nullable=False)  # sequence number of the last action in the chunk
+    count: Mapped[int] = mapped_column(Integer, nullable=False)   # number of actions in the chunk
+    content: Mapped[str] = mapped_column(Text, nullable=False)    # JSON array of actions
+    created_at: Mapped[DateTime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+
+    session: Mapped["Session"] = relationship("Session", back_populates="sketch_actions")
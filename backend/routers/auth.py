@@ -2,7 +2,7 @@ from core.auth import get_current_user
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from core.security import hash_password, verify_password, create_access_token
+from core.security import hash_password, verify_password, verify_and_update_password, create_access_token
 from core.config import settings
 from core.email import send_reset_email
 from db.database import get_db
@@ -24,8 +24,15 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
 @router.post("/token", response_model=Token)
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = verify_and_update_password(form_data.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # hash predates the current scheme/cost: upgrade it while we have the plain password
+        user.password_hash = new_hash
+        db.commit()
 
     token = create_access_token({"sub": str(user.id), "username": user.username}, timedelta(minutes=settings.JWT_EXPIRE_MINUTES))
     return {"access_token": token, "token_type": "bearer"}
@@ -1,127 +1,86 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session as OrmSession
-from typing import Annotated
-from jose import jwt, JWTError
+from fastapi import APIRouter, WebSocket
+from typing import Any, Dict, Optional, Tuple
 import json
-import asyncio
 
-from db.database import get_db
-from core.config import settings
-from core.connection_manager import ConnectionManager
-from models.session_member import SessionMember
-from models.session_editor import SessionEditor
+from core.codec import decode
+from routers.websocket import EDITOR, open_session_socket, serve_session, state
 
 router = APIRouter(
     prefix="/editor",
     tags=["editor"]
 )
 
-manager = ConnectionManager()
-editor_state: dict[int, str] = {}  # session_id -> current editor content
-save_tasks: dict[int, asyncio.Task] = {}
 
-db_dependency = Annotated[OrmSession, Depends(get_db)]
+# session_id -> (editor version, full text) last built for legacy sockets, so a
+# broadcast materializes the document once per worker instead of once per socket
+_full_texts: Dict[int, Tuple[int, str]] = {}
+_legacy_sockets: Dict[int, int] = {}  # session_id -> open legacy editor sockets
+
+
+async def _full_text(session_id: int, rev: Optional[int]) -> str:
+    cached = _full_texts.get(session_id)
+    if cached is None or rev is None or cached[0] < rev:
+        current = await state.get_editor(session_id)
+        cached = (current[1], current[0]) if current else (rev or 0, "")
+        _full_texts[session_id] = cached
+    return cached[1]
+
+
+class _LegacyEditorSocket:
+    """Writes the session gateway's editor events in the old /editor format.
+
+    Old clients send and expect the whole text: every editor change goes out
+    as {"type": "editor_update", "user": <username>, "content": <full text>}.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: int):
+        self.websocket = websocket
+        self.session_id = session_id
+
+    async def send_text(self, message: str):
+        event = decode(message)
+        mtype = event.get("type")
+        if mtype == "editor_sync":
+            out = {"type": "editor_sync", "content": event.get("content", "")}
+        elif mtype in ("editor_update", "editor_set", "editor_cleared"):
+            out = {
+                "type": "editor_update",
+                "user": (event.get("user") or {}).get("username", ""),
+                "content": await _full_text(self.session_id, event.get("rev")),
+            }
+        else:
+            return
+        await self.websocket.send_text(json.dumps(out))
+
+    async def send_bytes(self, data: bytes):
+        pass  # binary frames are never negotiated on this endpoint
+
+    async def close(self, code: int = 1000):
+        await self.websocket.close(code=code)
+
+
+def _legacy_editor_message(raw: str) -> Dict[str, Any]:
+    # a legacy frame is the full editor text
+    return {"type": "editor_set", "content": raw}
+
 
 @router.websocket("/sessions/{session_id}")
 async def editor_websocket(
     websocket: WebSocket,
     session_id: int,
-    db: db_dependency,
 ):
-    # Accept connection
-    await websocket.accept() 
-
-    # Get token from query params
-    token = websocket.query_params.get("token")
-    if not token:
-        await websocket.close(code=1008) # Policy Violation
+    # Legacy endpoint, kept as a shim over the session gateway's editor channel (/ws)
+    current_user = await open_session_socket(websocket, session_id)
+    if current_user is None:
         return
-
-    # Validate token
+    _legacy_sockets[session_id] = _legacy_sockets.get(session_id, 0) + 1
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        current_user = {
-            "id": int(payload.get("sub")),
-            "username": payload.get("username", "")
-        }
-        if current_user["id"] is None:
-            await websocket.close(code=1008)
-            return
-    except JWTError:
-        await websocket.close(code=1008)
-        return
-    
-    # Verify user is a member of the session
-    member = db.query(SessionMember).filter_by(
-        session_id=session_id,
-        user_id=current_user['id']
-    ).first()
-
-    if not member:
-        await websocket.close(code = 1008)  # Policy Violation
-        return
-
-    # Send current editor state from DB (preferred) or memory
-    editor_entry = db.query(SessionEditor).filter_by(session_id=session_id).first()
-    if editor_entry:
-        # Load DB snapshot into memory for this session
-        editor_state[session_id] = editor_entry.content
-        await websocket.send_text(json.dumps({
-            "type": "editor_sync",
-            "content": editor_entry.content
-        }))
-    elif session_id in editor_state:
-        await websocket.send_text(json.dumps({
-            "type": "editor_sync",
-            "content": editor_state[session_id]
-        }))
-
-    # register connection
-    await manager.connect(session_id, websocket)
-
-    async def periodic_save(session_id: int, db: OrmSession):
-        while True:
-            await asyncio.sleep(10)
-            if session_id in editor_state:
-                content = editor_state[session_id]
-                editor_entry = db.query(SessionEditor).filter_by(session_id=session_id).first()
-                if editor_entry:
-                    editor_entry.content = content
-                else:
-                    editor_entry = SessionEditor(session_id=session_id, content=content)
-                    db.add(editor_entry)
-                db.commit()
-    
-    if session_id not in save_tasks:
-        save_tasks[session_id] = asyncio.create_task(periodic_save(session_id, db))
-
-    try: 
-        while True:
-            data = await websocket.receive_text()
-            # TODO: connect to Monaco editor, for now just broadcast received text
-            editor_state[session_id] = data # update state
-            await manager.broadcast(session_id, json.dumps({ 
-                "type": "editor_update",
-                "user": current_user["username"],
-                "content": data
-            }))
-    except WebSocketDisconnect:
-        manager.disconnect(session_id, websocket)
-
-        # final save on disconnect
-        if session_id in editor_state:
-            content = editor_state[session_id]
-            editor_entry = db.query(SessionEditor).filter_by(session_id=session_id).first()
-            if editor_entry:
-                editor_entry.content = content
-            else:
-                editor_entry = SessionEditor(session_id=session_id, content=content)
-                db.add(editor_entry)
-            db.commit()
-        
-        # If no more connections for this session, cancel periodic save task
-        if session_id in manager.active_connections and not manager.active_connections[session_id]:
-            task = save_tasks.pop(session_id, None)
-            if task:
-                task.cancel()
-        
\ No newline at end of file
+        await serve_session(
+            websocket, session_id, current_user, {EDITOR},
+            _LegacyEditorSocket(websocket, session_id), _legacy_editor_message,
+        )
+    finally:
+        _legacy_sockets[session_id] -= 1
+        if not _legacy_sockets[session_id]:
+            del _legacy_sockets[session_id]
+            _full_texts.pop(session_id, None)
@@ -4,12 +4,11 @@ from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 
 from db.database import get_db
-from core.auth import get_current_user
+from core.auth import Principal, get_principal
+from core.membership import check_membership, require_membership
 
-from models.user import User
 from models.material import Material
 from schemas.material import MaterialResponse
-from models.session_member import SessionMember
 
 import os
 import shutil
@@ -20,27 +19,16 @@ router = APIRouter(
 )
 
 db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[User, Depends(get_current_user)]
+user_dependency = Annotated[Principal, Depends(get_principal)]
+member_dependency = Annotated[Principal, Depends(require_membership)]
 
 @router.post("/upload", response_model=MaterialResponse, status_code=status.HTTP_201_CREATED)
 def upload_material(
     db: db_dependency,
-    current_user: user_dependency,
+    current_user: member_dependency,
     session_id: int,
     file: UploadFile = File(...)
 ):
-    # verify session membership
-    membership = (
-        db.query(SessionMember)
-        .filter(
-            SessionMember.session_id == session_id,
-            SessionMember.user_id == current_user.id
-        )
-        .first()
-    )
-    if not membership:
-        raise HTTPException(status_code=403, detail="Not authorized to upload to this session")
-
     # path inside container -> mapped to ./uploads on host
     upload_dir = "/app/uploads"
     os.makedirs(upload_dir, exist_ok=True)
@@ -68,21 +56,9 @@ def upload_material(
 @router.get("/{session_id}", response_model=List[MaterialResponse])
 def list_materials(
     db: db_dependency,
-    current_user: user_dependency,
+    current_user: member_dependency,
     session_id: int
 ):
-    # verify session membership
-    membership = (
-        db.query(SessionMember)
-        .filter(
-            SessionMember.session_id == session_id,
-            SessionMember.user_id == current_user.id
-        )
-        .first()
-    )
-    if not membership:
-        raise HTTPException(status_code=403, detail="Not authorized to view materials for this session")
-    
     materials = (
         db.query(Material)
         .filter(Material.session_id == session_id)
@@ -135,15 +111,7 @@ def download_material(
         raise HTTPException(status_code=404, detail="Material not found")
 
     # verify session membership
-    membership = (
-        db.query(SessionMember)
-        .filter(
-            SessionMember.session_id == material.session_id,
-            SessionMember.user_id == current_user.id
-        )
-        .first()
-    )
-    if not membership:
+    if not check_membership(material.session_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized to download this material")
     
     # verify file exists on disk
@@ -3,17 +3,17 @@ from sqlalchemy.orm import Session as OrmSession
 from typing import Annotated
 
 from db.database import get_db
-from core.auth import get_current_user
+from core.auth import Principal, get_principal
+from core.membership import check_membership
 
 from models.message import Message
-from models.session_member import SessionMember
 
 from schemas.message import MessageCreateRequest, MessageResponse
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
 db_dependency = Annotated[OrmSession, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
+user_dependency = Annotated[Principal, Depends(get_principal)]
 
 
 @router.post("/create", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
@@ -26,15 +26,7 @@ def create_message(
         raise HTTPException(status_code=401, detail="Not authenticated")
 
     # Verify session membership
-    membership = (
-        db.query(SessionMember) 
-        .filter(
-            SessionMember.session_id == message.session_id,
-            SessionMember.user_id == current_user.id
-        )
-        .first()
-    )
-    if not membership:
+    if not check_membership(message.session_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized to post in this session")
 
     db_message = Message(
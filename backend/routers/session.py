@@ -1,10 +1,14 @@
-from fastapi import Depends, HTTPException, status, APIRouter
-from sqlalchemy.orm import Session as OrmSession
+from fastapi import Depends, HTTPException, status, APIRouter, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession, selectinload
 import random, string
-from typing import Annotated, List
+from typing import Annotated, Iterator, List, Literal, Optional
 
-from db.database import get_db
-from core.auth import get_current_user
+from db.database import get_db, SessionLocal
+from core.auth import Principal, get_principal
+from core.membership import invalidate_membership, require_membership
 
 from schemas.session import SessionCreateRequest, SessionCreateResponse, SessionResponse, SessionJoinRequest
 from schemas.message import MessageResponse
@@ -21,7 +25,26 @@ router = APIRouter(
 )
 
 db_dependency = Annotated[OrmSession, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
+user_dependency = Annotated[Principal, Depends(get_principal)]
+member_dependency = Annotated[Principal, Depends(require_membership)]
+
+MESSAGE_PAGE_DEFAULT = 50
+MESSAGE_PAGE_MAX = 500
+
+def _with_members():
+    # Members and their users in one extra SELECT for all listed sessions (no per-row lazy loads).
+    # Built per query: creating it at import would configure the mappers before all models exist.
+    return selectinload(Session.members).joinedload(SessionMember.user)
+
+def _session_data(session: Session) -> dict:
+    return {
+        "id": session.id,
+        "title": session.title,
+        "invite_code": session.invite_code,
+        "created_at": session.created_at,
+        "created_by": session.created_by,
+        "members": [m.user for m in session.members],
+    }
 
 @router.post("/create", response_model=SessionCreateResponse, status_code=status.HTTP_201_CREATED)
 def create_session(
@@ -57,6 +80,7 @@ def create_session(
     db.add(creator_member)
     db.commit()
     db.refresh(creator_member)
+    invalidate_membership(new_session.id, current_user.id)
 
     return new_session
 
@@ -69,37 +93,35 @@ def join_session(
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    session = db.query(Session).filter(Session.invite_code == join_request.invite_code).first()
+    session = (
+        db.query(Session)
+        .options(_with_members())
+        .filter(Session.invite_code == join_request.invite_code)
+        .first()
+    )
 
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Check if user is already a member
-    existing = (
-        db.query(SessionMember)
-        .filter(SessionMember.session_id == session.id, SessionMember.user_id == current_user.id)
-        .first()
-    )
+    existing = any(m.user_id == current_user.id for m in session.members)
 
     if not existing:
+        session_id = session.id
         new_member = SessionMember(
-            session_id=session.id,
+            session_id=session_id,
             user_id=current_user.id
         )
         db.add(new_member)
-        db.commit()
-        db.refresh(new_member)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # a concurrent join of the same user won the unique index
+        invalidate_membership(session_id, current_user.id)  # drop a cached "not a member"
+        # reload with the new member (the commit expired the loaded ones)
+        session = db.query(Session).options(_with_members()).filter(Session.id == session_id).first()
 
-    members = [m.user for m in session.members]
-    session_data = {
-        "id": session.id,
-        "title": session.title,
-        "invite_code": session.invite_code,
-        "created_at": session.created_at,
-        "created_by": session.created_by,
-        "members": members
-    }   
-    return session_data
+    return _session_data(session)
 
 @router.get("/mine", response_model=List[SessionResponse])
 def get_my_sessions(
@@ -109,33 +131,16 @@ def get_my_sessions(
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    memberships = (
-        db.query(SessionMember)
-        .filter(SessionMember.user_id == current_user.id)
-        .all()
-    )
-
-    session_ids = [m.session_id for m in memberships]
-   
+    # membership filter as a subquery, members loaded in bulk: 2 queries regardless of counts
+    my_session_ids = select(SessionMember.session_id).where(SessionMember.user_id == current_user.id)
     sessions = (
         db.query(Session)
-        .filter(Session.id.in_(session_ids))
+        .filter(Session.id.in_(my_session_ids))
+        .options(_with_members())
         .all()
     )
-    
-    result = []
-    for s in sessions:
-        members = [m.user for m in s.members]
-        result.append({
-            "id": s.id,
-            "title": s.title,
-            "invite_code": s.invite_code,
-            "created_at": s.created_at,
-            "created_by": s.created_by,
-            "members": members
-        })
-
-    return result
+
+    return [_session_data(s) for s in sessions]
 
 @router.get("/{session_id}", response_model=SessionResponse)
 def get_session(
@@ -146,22 +151,12 @@ def get_session(
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    session = db.query(Session).filter(Session.id == session_id).first()
+    session = db.query(Session).options(_with_members()).filter(Session.id == session_id).first()
 
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    members = [m.user for m in session.members]
-    session_data = {
-        "id": session.id,
-        "title": session.title,
-        "invite_code": session.invite_code,
-        "created_at": session.created_at,
-        "created_by": session.created_by,
-        "members": members
-    }
 
-    return session_data
+    return _session_data(session)
 
 @router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_session(
@@ -182,42 +177,80 @@ def delete_session(
 
     db.delete(session)
     db.commit()
+    invalidate_membership(session_id)  # members are gone with the session (ON DELETE CASCADE)
     return
 
+def _message_rows(session_id: int):
+    # one joined query for the usernames instead of a lazy msg.user load per row
+    return (
+        select(
+            Message.id,
+            Message.content,
+            Message.session_id,
+            Message.user_id,
+            User.username,
+            Message.created_at,
+        )
+        .join(User, User.id == Message.user_id)
+        .where(Message.session_id == session_id)
+    )
+
+def _stream_messages_ndjson(session_id: int) -> Iterator[str]:
+    # own DB session: the request's one is closed before a streamed body is sent
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            _message_rows(session_id)
+            .order_by(Message.created_at.asc(), Message.id.asc())
+            .execution_options(yield_per=500)
+        ).mappings()
+        for row in rows:
+            yield MessageResponse.model_validate(row).model_dump_json() + "\n"
+    finally:
+        db.close()
+
 @router.get("/{session_id}/messages", response_model=List[MessageResponse])
 def get_session_messages(
     session_id: int,
     db: db_dependency,
-    current_user: user_dependency
+    current_user: member_dependency,
+    before_id: Optional[int] = Query(None, description="Page of messages right before this one"),
+    after_id: Optional[int] = Query(None, description="Page of messages right after this one"),
+    limit: Optional[int] = Query(None, ge=1, le=MESSAGE_PAGE_MAX),
+    output: Literal["json", "ndjson"] = Query("json", alias="format"),
 ):
-    if not current_user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    # check membership
-    membership = (
-        db.query(SessionMember)
-        .filter(SessionMember.session_id == session_id, SessionMember.user_id == current_user.id)
-        .first()
-    )
-    if not membership:
-        raise HTTPException(status_code=403, detail="Not a member of this session")
-
-    messages = (
-        db.query(Message)
-        .filter(Message.session_id == session_id)
-        .order_by(Message.created_at.asc())
-        .all()
-    )
-
-    result = []
-    for msg in messages:
-        result.append({
-            "id": msg.id,
-            "content": msg.content,
-            "session_id": msg.session_id,
-            "user_id": msg.user_id,
-            "username": msg.user.username, 
-            "created_at": msg.created_at
-        })
-    return result
-        
\ No newline at end of file
+    # Oldest first. No cursor/limit: whole history (as before). Otherwise keyset pages
+    # on (created_at, id): `limit` alone = latest messages, before_id walks back,
+    # after_id forward. format=ndjson streams the full history for exports.
+    # membership is checked (cached) by the dependency
+    if output == "ndjson":
+        return StreamingResponse(_stream_messages_ndjson(session_id), media_type="application/x-ndjson")
+
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before_id or after_id")
+
+    query = _message_rows(session_id)
+    key = tuple_(Message.created_at, Message.id)
+    cursor_id = before_id if before_id is not None else after_id
+    if cursor_id is not None:
+        cursor = db.execute(
+            select(Message.created_at, Message.id)
+            .where(Message.id == cursor_id, Message.session_id == session_id)
+        ).first()
+        if cursor is None:
+            raise HTTPException(status_code=404, detail="Cursor message not found")
+        query = query.where(key < tuple_(*cursor) if before_id is not None else key > tuple_(*cursor))
+
+    if after_id is not None:
+        rows = db.execute(
+            query.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit or MESSAGE_PAGE_DEFAULT)
+        ).mappings().all()
+    elif before_id is not None or limit is not None:
+        # newest first to take the page, then back to chronological order
+        rows = db.execute(
+            query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit or MESSAGE_PAGE_DEFAULT)
+        ).mappings().all()[::-1]
+    else:
+        rows = db.execute(query.order_by(Message.created_at.asc(), Message.id.asc())).mappings().all()
+
+    return [dict(row) for row in rows]
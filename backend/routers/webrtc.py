@@ -1,74 +1,47 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.orm import Session as OrmSession
-from typing import Annotated
-from jose import jwt, JWTError
-import json
+from fastapi import APIRouter, WebSocket
+from typing import Any, Dict
 
-from db.database import get_db
-from core.config import settings
-from core.connection_manager import ConnectionManager
-from models.session_member import SessionMember
+from core.codec import decode
+from routers.websocket import SIGNAL, open_session_socket, serve_session
 
 router = APIRouter(
     prefix="/webrtc",
     tags=["webrtc"]
 )
 
-manager = ConnectionManager()
-db_dependency = Annotated[OrmSession, Depends(get_db)]
 
-@router.websocket("/sessions/{session_id}")
-async def webrtc_websocket(
-    websocket: WebSocket,
-    session_id: int,
-    db: db_dependency,
-):
-    # Accept the connection
-    await websocket.accept()
+class _LegacySignalSocket:
+    """Passes only the {"type": "webrtc_signal"} relays old /webrtc clients understand."""
 
-    # Get token from query params
-    token = websocket.query_params.get("token")
-    if not token:
-        await websocket.close(code=1008) # Policy Violation
-        return
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
 
-    # Validate token
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        current_user = {
-            "id": int(payload.get("sub")),
-            "username": payload.get("username", "")
-        }
-        if current_user["id"] is None:
-            await websocket.close(code=1008)
-            return
-    except JWTError:
-        await websocket.close(code=1008)
-        return
+    async def send_text(self, message: str):
+        if decode(message).get("type") == "webrtc_signal":
+            await self.websocket.send_text(message)
 
-    # Verify user is a member of the session
-    member = db.query(SessionMember).filter_by(
-        session_id=session_id,
-        user_id=current_user['id']
-    ).first()
+    async def send_bytes(self, data: bytes):
+        pass
 
-    if not member:
-        await websocket.close(code=1008)  # Policy Violation
-        return
+    async def close(self, code: int = 1000):
+        await self.websocket.close(code=code)
 
-    # Register connection
-    await manager.connect(session_id, websocket)
 
-    try:
-        while True:
-            # Receive signaling message (offer, answer, ice-candidate, etc.)
-            data = await websocket.receive_text()
+def _legacy_signal_message(raw: str) -> Dict[str, Any]:
+    # Signaling message (offer, answer, ice-candidate, etc.) to broadcast to the other participants
+    return {"type": "webrtc_signal", "content": raw}
 
-            # Broadcast it to other participants in the same session
-            await manager.broadcast(session_id, json.dumps({
-                "type": "webrtc_signal",
-                "user": current_user["username"],
-                "content": data
-            }))
-    except WebSocketDisconnect:
-        manager.disconnect(session_id, websocket)
\ No newline at end of file
+
+@router.websocket("/sessions/{session_id}")
+async def webrtc_websocket(
+    websocket: WebSocket,
+    session_id: int,
+):
+    # Legacy endpoint, kept as a shim over the session gateway's signal channel (/ws)
+    current_user = await open_session_socket(websocket, session_id)
+    if current_user is None:
+        return
+    await serve_session(
+        websocket, session_id, current_user, {SIGNAL},
+        _LegacySignalSocket(websocket), _legacy_signal_message,
+    )
@@ -1,104 +1,362 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.orm import Session as OrmSession
-from typing import Annotated, Dict, List, Any
-from jose import jwt, JWTError
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from jose import JWTError
+import asyncio
 import json
 from datetime import datetime
 
-from db.database import get_db
+from db.database import AsyncSessionLocal
+from core.chat_ingest import ChatIngestor, PendingChat, provisional_id
+from core.codec import DecodeError, decode, encode
+from core.auth import verify_token
 from core.connection_manager import ConnectionManager
+from core.heartbeat import ConnectionSupervisor
+from core.membership import is_member
+from core.persistence import WriteBehindScheduler
+from core.sketch_compaction import compact_actions
+from core.stroke_codec import StrokeDecodeError, decode_stroke, encode_stroke, stamp_stroke
+from core.session_state import MemorySessionStateStore, create_state_store
 from core.config import settings
 
-from models.session_member import SessionMember
 from models.message import Message
-from models.session_sketch import SessionSketch  
+from models.session import Session
+from models.session_sketch_action import SessionSketchAction
 from models.session_editor import SessionEditor
 
 router = APIRouter(prefix="/ws", tags=["websocket"])
 manager = ConnectionManager()
 
-db_dependency = Annotated[OrmSession, Depends(get_db)]
-
-# In-memory event log per session
-sketch_state: Dict[int, List[dict]] = {}
-editor_text: Dict[int, str] = {}  # session_id -> current text  
-# Video call related in-memory states
-session_connected_users: Dict[int, set[int]] = {}  # session_id -> {user_id, ...}
-session_user_sockets: Dict[int, Dict[int, set[WebSocket]]] = {}  # session_id -> {user_id : {sockets, ...}}
-media_status: Dict[int, Dict[int, Dict[str, bool]]] = {}  # media_status[session_id][user_id] = {"mic": bool, "cam": bool}
+# Live sketch log, editor text, presence and media status per session
+# (in-process or Redis, see SESSION_STATE_BACKEND)
+state = create_state_store()
+
+# One socket per client carries every realtime feature; each broadcast is tagged
+# with its channel and only reaches sockets subscribed to it
+CHAT, SKETCH, EDITOR, SIGNAL = "chat", "sketch", "editor", "signal"  # signal = presence, media state, WebRTC
+CHANNELS = frozenset((CHAT, SKETCH, EDITOR, SIGNAL))
+# Channel each client message belongs to; a socket may only send on channels it is subscribed to,
+# so nothing writes to state that wasn't warmed (and synced) for it
+_MESSAGE_CHANNELS = {
+    "chat_message": CHAT,
+    "sketch_update": SKETCH, "sketch_get": SKETCH, "sketch_clear": SKETCH,
+    "editor_get": EDITOR, "editor_update": EDITOR, "editor_set": EDITOR, "editor_clear": EDITOR,
+    "presence_get": SIGNAL, "media_toggle": SIGNAL,
+    "webrtc_offer": SIGNAL, "webrtc_answer": SIGNAL, "webrtc_ice": SIGNAL, "webrtc_signal": SIGNAL,
+}
 
 # === Helper functions for code editor DB persistence ===
-def _load_editor_from_db(db: OrmSession, session_id: int) -> str:
-    rec = db.query(SessionEditor).filter_by(session_id=session_id).first()
-    if not rec or rec.content in (None, "", "null"):
+async def _load_editor_from_db(db: AsyncSession, session_id: int) -> str:
+    content = await db.scalar(select(SessionEditor.content).where(SessionEditor.session_id == session_id))
+    if content in (None, "", "null"):
         return ""
-    return rec.content
+    return content
 
-def _save_editor_to_db(db: OrmSession, session_id: int, text: str) -> None:
-    rec = db.query(SessionEditor).filter_by(session_id=session_id).first()
+async def _save_editor_to_db(db: AsyncSession, session_id: int, text: str) -> None:
+    # caller commits (see _write_snapshots)
+    rec = await db.scalar(select(SessionEditor).where(SessionEditor.session_id == session_id))
     if rec:
         rec.content = text
         rec.updated_at = datetime.utcnow()
     else:
         rec = SessionEditor(session_id=session_id, content=text, updated_at=datetime.utcnow())
         db.add(rec)
-    db.commit()
-
-def _apply_delta(base: str, offset: int, length: int, insert_text: str) -> str:
-    if offset <0:
-        offset = 0
-    if offset > len(base):
-        offset = len(base)
-    end = min(len(base), offset + max(0, length))
-    return base[:offset] + (insert_text or "") + base[end:]
 
 # === Helper functions for sketch DB persistence ===
-def _load_sketch_list_from_db(db: OrmSession, session_id: int) -> List[dict]:
-    rec = db.query(SessionSketch).filter_by(session_id=session_id).first()
-    if not rec or rec.content in (None, "", "null"):
-        return []
-    content = rec.content
-    if isinstance(content, str):
+# The sketch log is stored append-only as JSON chunks (SessionSketchAction); every
+# action carries its sequence number, chunks record the seq range they cover.
+async def _load_sketch_list_from_db(db: AsyncSession, session_id: int) -> List[dict]:
+    actions: List[dict] = []
+    chunks = await db.stream(
+        select(SessionSketchAction.seq, SessionSketchAction.content)
+        .where(SessionSketchAction.session_id == session_id)
+        .order_by(SessionSketchAction.seq.asc())
+        .execution_options(yield_per=64)
+    )
+    async for first_seq, content in chunks:
         try:
             parsed = json.loads(content)
         except json.JSONDecodeError:
-            return []
-    else:
-        parsed = content
-    if isinstance(parsed, list):
-        return parsed
-    if isinstance(parsed, dict):
-        return [parsed]
-    return []
-
-def _save_sketch_list_to_db(db: OrmSession, session_id: int, actions: List[dict]) -> None:
-    payload = json.dumps(actions, separators=(",", ":"))
-    rec = db.query(SessionSketch).filter_by(session_id=session_id).first()
-    if rec:
-        rec.content = payload
-        rec.updated_at = datetime.utcnow()
-    else:
-        rec = SessionSketch(session_id=session_id, content=payload, updated_at=datetime.utcnow())
-        db.add(rec)
-    db.commit()
+            continue
+        if isinstance(parsed, list):
+            for i, action in enumerate(parsed):
+                # chunks migrated from the old blob layout have no per-action seq yet
+                action.setdefault("seq", first_seq + i)
+            actions.extend(parsed)
+    return actions
+
+async def _persisted_sketch_seqs(db: AsyncSession, session_ids: List[int]) -> Dict[int, int]:
+    rows = await db.execute(
+        select(
+            SessionSketchAction.session_id,
+            func.max(SessionSketchAction.last_seq),
+        )
+        .where(SessionSketchAction.session_id.in_(session_ids))
+        .group_by(SessionSketchAction.session_id)
+    )
+    return {sid: int(last_seq) for sid, last_seq in rows}
+
+def _append_sketch_to_db(db: AsyncSession, session_id: int, actions: List[dict]) -> None:
+    # caller commits (see _write_snapshots); cost is proportional to the new actions only
+    size = settings.SKETCH_CHUNK_SIZE
+    for i in range(0, len(actions), size):
+        chunk = actions[i:i + size]
+        db.add(SessionSketchAction(
+            session_id=session_id,
+            seq=chunk[0]["seq"],
+            last_seq=chunk[-1]["seq"],
+            count=len(chunk),
+            content=json.dumps(chunk, separators=(",", ":")),
+        ))
+
+async def _reset_sketch_in_db(db: AsyncSession, session_id: int, actions: List[dict]) -> None:
+    # after a clear the stored log is rewritten from scratch
+    await db.execute(delete(SessionSketchAction).where(SessionSketchAction.session_id == session_id))
+    _append_sketch_to_db(db, session_id, actions)
+
+# === Write-behind persistence: edits mark the session dirty, batches are flushed periodically ===
+async def _write_snapshots(snapshots: Dict[int, Dict[str, Any]]) -> Tuple[Set[int], Set[int]]:
+    """Persist a batch of session snapshots with one commit; returns the (saved, failed) sessions.
+
+    Sessions in neither set were deleted meanwhile; their state is dropped.
+    """
+    saved: Set[int] = set()
+    failed: Set[int] = set()
+    async with AsyncSessionLocal() as db:
+        for session_id, snap in snapshots.items():
+            # savepoint per session so one bad row (e.g. session deleted meanwhile) doesn't sink the batch
+            try:
+                async with db.begin_nested():
+                    if "sketch_reset" in snap:
+                        await _reset_sketch_in_db(db, session_id, snap["sketch_reset"])
+                    elif "sketch_append" in snap:
+                        _append_sketch_to_db(db, session_id, snap["sketch_append"])
+                    if "editor" in snap:
+                        await _save_editor_to_db(db, session_id, snap["editor"])
+                saved.add(session_id)
+            except IntegrityError as e:
+                if await db.scalar(select(Session.id).where(Session.id == session_id)) is None:
+                    # the session row is gone: nothing left to save it to
+                    print(f"dropping unsaved state of session {session_id}:", e)
+                else:
+                    # another worker stored the same rows first (shared state store: a sketch chunk
+                    # at the same seq); the retry re-reads the stored seq and appends only the rest
+                    print(f"sketch seq conflict for session {session_id}, retrying:", e)
+                    failed.add(session_id)
+            except Exception as e:
+                print(f"persist error for session {session_id}:", e)
+                failed.add(session_id)
+        await db.commit()
+    return saved, failed
+
+async def _read_persisted_sketch_seqs(session_ids: List[int]) -> Dict[int, int]:
+    async with AsyncSessionLocal() as db:
+        return await _persisted_sketch_seqs(db, session_ids)
+
+async def _flush_sessions(batch: Dict[int, Set[str]]) -> None:
+    # "sketch" = actions were appended, "sketch_reset" = the log was cleared and must be rewritten
+    appended = [sid for sid, kinds in batch.items() if "sketch" in kinds and "sketch_reset" not in kinds]
+    persisted = await _read_persisted_sketch_seqs(appended) if appended else {}
+
+    snapshots: Dict[int, Dict[str, Any]] = {}
+    editor_revs: Dict[int, int] = {}
+    for session_id, kinds in batch.items():
+        snap: Dict[str, Any] = {}
+        if "sketch_reset" in kinds:
+            actions = await state.get_sketch(session_id)
+            if actions is not None:
+                snap["sketch_reset"] = actions
+        elif "sketch" in kinds:
+            tail = await state.get_sketch(session_id, persisted.get(session_id, 0))
+            if tail:
+                snap["sketch_append"] = tail
+        if "editor" in kinds:
+            current = await state.get_editor(session_id)
+            # the revision is the dirty counter: skip text this worker already wrote
+            if current is not None and current[1] != _saved_editor_rev.get(session_id):
+                snap["editor"] = current[0]
+                editor_revs[session_id] = current[1]
+        if snap:
+            snapshots[session_id] = snap
+    if snapshots:
+        saved, failed = await _write_snapshots(snapshots)
+        for session_id in editor_revs.keys() & saved:
+            _saved_editor_rev[session_id] = editor_revs[session_id]
+        for session_id in failed:
+            for kind in batch[session_id]:
+                persistence.mark_dirty(session_id, kind)  # retried next tick; keeps the state loaded
+        print(f"💾 Flushed {len(saved)} session(s) to DB")
+    # sessions whose release waited for this retry can be dropped now
+    for session_id in _release_retry & (batch.keys() - persistence.dirty.keys()):
+        _release_retry.discard(session_id)
+        asyncio.create_task(_release_session(session_id))
+
+persistence = WriteBehindScheduler(_flush_sessions)
+_saved_editor_rev: Dict[int, int] = {}  # editor revision last written to the DB by this worker
+_release_retry: Set[int] = set()  # sessions without sockets kept loaded until a failed write succeeds
+
+# === Chat: broadcast immediately with a provisional id, insert in micro-batches ===
+async def _insert_chat_batch(batch: List[PendingChat]) -> None:
+    rows = [
+        {k: m[k] for k in ("session_id", "user_id", "content", "created_at")}
+        for m in batch
+    ]
+    async with AsyncSessionLocal() as db:
+        try:
+            result = await db.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True), rows,
+            )
+            ids: List[Optional[int]] = list(result.scalars())
+            await db.commit()
+        except IntegrityError as e:
+            # a session deleted meanwhile: retry row by row so only its messages are lost.
+            # Anything else (DB down, ...) propagates and the ingestor keeps the batch queued.
+            print("chat batch insert failed, retrying per row:", e)
+            await db.rollback()
+            ids = []
+            for row in rows:
+                try:
+                    async with db.begin_nested():
+                        ids.append(await db.scalar(insert(Message).returning(Message.id), row))
+                except IntegrityError as row_error:
+                    print(f"dropping chat message for session {row['session_id']}:", row_error)
+                    ids.append(None)
+            await db.commit()
+
+    # Tell clients the real ids of what they already displayed
+    reconciled: Dict[int, Dict[str, int]] = {}
+    for m, message_id in zip(batch, ids):
+        if message_id is not None:
+            reconciled.setdefault(m["session_id"], {})[m["provisional_id"]] = message_id
+    for session_id, mapping in reconciled.items():
+        await manager.broadcast(session_id, encode({"type": "chat_ids", "ids": mapping}), channel=CHAT)
+
+chat_ingest = ChatIngestor(_insert_chat_batch)
+
+# === Live state, warmed from the DB the first time a session is touched ===
+async def _get_editor(session_id: int) -> Tuple[str, int]:
+    current = await state.get_editor(session_id)
+    if current is None:
+        async with AsyncSessionLocal() as db:
+            text = await _load_editor_from_db(db, session_id)
+        current = await state.init_editor(session_id, text)
+    return current
+
+async def _editor_sync_message(session_id: int) -> dict:
+    """Full editor text plus its revision, the base for the client's next editor_update."""
+    text, version = await _get_editor(session_id)
+    return {"type": "editor_sync", "content": text, "rev": version}
+
+async def _get_sketch(session_id: int) -> List[dict]:
+    actions = await state.get_sketch(session_id)
+    if actions is None:
+        async with AsyncSessionLocal() as db:
+            loaded = await _load_sketch_list_from_db(db, session_id)
+        actions = await state.init_sketch(session_id, loaded)
+    return actions
+
+async def _sketch_sync_message(session_id: int, since_seq: Any = None, epoch: Any = None) -> dict:
+    """Only the actions after `since_seq` if the client can resume from there, else a full snapshot."""
+    actions = await _get_sketch(session_id)
+    meta = await state.get_sketch_meta(session_id)
+    since_seq = _coerce_int(since_seq)
+    if (
+        meta is not None
+        and since_seq is not None
+        and epoch == meta["epoch"]
+        and meta["floor"] <= since_seq <= meta["seq"]
+        and meta["seq"] - since_seq <= settings.SKETCH_RESUME_MAX_GAP
+    ):
+        missing = await state.get_sketch(session_id, since_seq) or []
+        after = await state.get_sketch_meta(session_id)
+        if after is not None and after["gen"] == meta["gen"]:  # no clear/compaction raced the read
+            return {
+                "type": "sketch_delta",
+                "since_seq": since_seq,
+                "seq": missing[-1]["seq"] if missing else since_seq,
+                "epoch": meta["epoch"],
+                "content": missing,
+            }
+        actions = await _get_sketch(session_id)
+        meta = after
+    last_seq = max(meta["seq"] if meta else 0, actions[-1]["seq"] if actions else 0)
+    return {
+        "type": "sketch_sync",
+        "seq": last_seq,
+        "epoch": meta["epoch"] if meta else None,
+        "content": actions,
+    }
 
-def _has_connections(session_id: int) -> bool:
-    conns = manager.active_connections.get(session_id)
-    return bool(conns)
+# === Sketch compaction: fold old history into a compact checkpoint, keep a short raw tail ===
+_compacting: Set[int] = set()
+_compacted_len: Dict[int, int] = {}  # log length right after the last compaction (this worker)
+
+async def _compact_sketch(session_id: int) -> None:
+    try:
+        # read the generation first: any clear/compaction after this makes the swap a no-op
+        meta = await state.get_sketch_meta(session_id)
+        actions = await state.get_sketch(session_id)
+        if meta is None or actions is None:
+            return
+        count = len(actions) - settings.SKETCH_COMPACT_TAIL
+        if count <= 0:
+            return
+        checkpoint = await asyncio.to_thread(
+            compact_actions, actions[:count], settings.SKETCH_COMPACT_CELL, settings.SKETCH_COMPACT_MAX_CELLS,
+        )
+        upto_seq = actions[count - 1]["seq"]
+        if await state.replace_sketch_prefix(session_id, meta["gen"], upto_seq, checkpoint):
+            _compacted_len[session_id] = len(checkpoint) + len(actions) - count
+            persistence.mark_dirty(session_id, "sketch_reset")
+            print(f"🗜️ Compacted sketch for session {session_id}: {count} -> {len(checkpoint)} actions")
+    except Exception as e:
+        print("sketch compaction error:", e)
+    finally:
+        _compacting.discard(session_id)
+
+def _maybe_compact_sketch(session_id: int, length: int) -> None:
+    # re-run only after the log grew by half a threshold since the last pass
+    threshold = max(
+        settings.SKETCH_COMPACT_THRESHOLD,
+        _compacted_len.get(session_id, 0) + settings.SKETCH_COMPACT_THRESHOLD // 2,
+    )
+    if length >= threshold and session_id not in _compacting:
+        # a pass that fails or is raced counts too, so it isn't retried on every append
+        _compacted_len[session_id] = length
+        _compacting.add(session_id)
+        asyncio.create_task(_compact_sketch(session_id))
+
+async def _add_sketch_action(session_id: int, user: Dict[str, Any], action: dict, frame: Optional[bytes] = None):
+    """Append a sketch action and fan it out.
+
+    Sockets that negotiated binary sketch frames get the client's own frame
+    (only seq/user patched in) or, for JSON input, a fresh compact encoding.
+    """
+    action, length = await state.append_sketch(session_id, action)
+    persistence.mark_dirty(session_id, "sketch")
+    _maybe_compact_sketch(session_id, length)
+    event = {
+        "type": "sketch_update",
+        "user": {"id": user["id"], "username": user["username"]},
+        "seq": action["seq"],
+        "content": action,
+    }
+    if frame is not None:
+        frame = stamp_stroke(frame, action["seq"], user["id"])
+    elif manager.wants_binary(session_id):
+        frame = encode_stroke(action, action["seq"], user["id"])
+    if frame is None:
+        await manager.broadcast_event(session_id, event, channel=SKETCH)
+    else:
+        await manager.broadcast_binary(session_id, encode(event), frame, channel=SKETCH)
 
 # === Video Call functions === #
 
 async def _send_to_user(session_id: int, user_id: int, message: dict):
-    serialized = json.dumps(message)
-    buckets = session_user_sockets.get(session_id, {}).get(user_id, set())
-    to_drop = []
-    for ws in list(buckets):
-        try:
-            await ws.send_text(serialized)
-        except Exception:
-            to_drop.append(ws)
-    for ws in to_drop:
-        buckets.discard(ws)
+    # routed to the user's sockets on whichever worker holds them
+    await manager.send_to_user(session_id, user_id, encode(message), channel=SIGNAL)
 
 def _coerce_int(val):
     try:
@@ -113,324 +371,482 @@ def _flat(data: dict) -> dict:
     merged = {**c, **{k: v for k, v in data.items() if k != "content"}}
     return merged
 
-@router.websocket("/sessions/{session_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    session_id: int,
-    db: db_dependency,
-):
+def _parse_channels(raw: Any) -> Optional[Set[str]]:
+    """Known channel names from "chat,sketch" or ["chat", "sketch"]; None if nothing was given."""
+    if raw is None:
+        return None
+    names = raw.split(",") if isinstance(raw, str) else raw if isinstance(raw, list) else []
+    return {name.strip() for name in names if isinstance(name, str)} & CHANNELS
+
+async def open_session_socket(websocket: WebSocket, session_id: int) -> Optional[Dict[str, Any]]:
+    """Accept a session socket and check its token and membership once.
+
+    Returns the user ({"id", "username"}), or None after closing the socket.
+    """
     await websocket.accept()
 
     # ---- Auth ----
     token = websocket.query_params.get("token")
     if not token:
         await websocket.close(code=1008)
-        return
+        return None
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        current_user = {
-            "id": int(payload.get("sub")),
-            "username": payload.get("username", ""),
-        }
-        if current_user["id"] is None:
-            await websocket.close(code=1008)
-            return
+        principal = verify_token(token)  # same verified-token cache as the REST endpoints
     except JWTError:
         await websocket.close(code=1008)
-        return
+        return None
+    current_user = {"id": principal.id, "username": principal.username}
 
     # ---- Membership ----
-    member = db.query(SessionMember).filter_by(
-        session_id=session_id,
-        user_id=current_user["id"],
-    ).first()
-    if not member:
+    if not await is_member(session_id, current_user["id"]):
         print(f"⛔ User {current_user['id']} not a member of session {session_id}")
         await websocket.close(code=1008)
+        return None
+    return current_user
+
+async def _send_channel_syncs(session_id: int, websocket: Any, channels: Set[str]):
+    # Warm state + initial sync for the stateful channels
+    if SKETCH in channels:
+        await manager.send_snapshot(encode(await _sketch_sync_message(session_id)), websocket)
+    if EDITOR in channels:
+        await manager.send_snapshot(encode(await _editor_sync_message(session_id)), websocket)
+
+async def serve_session(
+    websocket: WebSocket,
+    session_id: int,
+    current_user: Dict[str, Any],
+    channels: Set[str],
+    outbound: Any = None,
+    translate: Optional[Callable[[str], Dict[str, Any]]] = None,
+):
+    """Run an authorized session socket until it disconnects.
+
+    `outbound` is what frames are written to (defaults to the socket; the
+    legacy endpoints pass an adapter that rewrites frames into their old
+    format) and `translate` turns a non-JSON text frame into a gateway
+    message. Presence (video call) is tracked for sockets subscribed to the
+    signal channel, whether from the start or by a later subscribe.
+    """
+    outbound = outbound or websocket
+    channels = set(channels)
+    present = SIGNAL in channels
+    print(f"👤 User {current_user['username']} joined session {session_id} ({', '.join(sorted(channels))})")
+
+    # Register connection (indexed under the user for targeted video call sends; `present`
+    # sockets count towards the session's video presence).
+    # Clients that connect with ?batch=1 accept {"type": "batch", "events": [...]} frames,
+    # with ?sketch=binary they send and receive strokes as binary frames (core.stroke_codec),
+    # with ?compress=1 large syncs arrive as compressed snapshot frames (core.compression),
+    # with ?heartbeat=1 they get {"type": "ping"} frames, must answer with anything (e.g.
+    # {"type": "pong"}) and are dropped after WS_IDLE_TIMEOUT seconds of silence.
+    batch = websocket.query_params.get("batch") in ("1", "true")
+    binary = websocket.query_params.get("sketch") == "binary"
+    compress = websocket.query_params.get("compress") in ("1", "true")
+    heartbeat = websocket.query_params.get("heartbeat") in ("1", "true")
+    await manager.connect(
+        session_id, outbound, current_user["id"],
+        batch=batch, binary=binary, compress=compress, channels=channels, heartbeat=heartbeat, present=present,
+    )
+    try:
+        if heartbeat:
+            supervisor.ensure_running()
+
+        if present:
+            await _presence_join(session_id, current_user["id"], outbound)
+
+        await _send_channel_syncs(session_id, outbound, channels)
+
+        # Main loop
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            manager.touch(outbound)
+            if message.get("bytes") is not None:
+                # Binary frames are compact sketch strokes
+                if SKETCH not in channels:
+                    continue  # e.g. the legacy /editor and /webrtc endpoints
+                try:
+                    action = decode_stroke(message["bytes"])
+                except StrokeDecodeError as e:
+                    print("⚠️ Invalid binary sketch frame:", e)
+                    continue
+                await _add_sketch_action(session_id, current_user, action, message["bytes"])
+                continue
+            raw = message.get("text") or ""
+            # Parse JSON
+            if translate is not None:
+                data = translate(raw)
+            else:
+                try:
+                    data = decode(raw)
+                except DecodeError:
+                    print("Invalid JSON received")
+                    continue
+            if not isinstance(data, dict):
+                continue
+            await _dispatch(session_id, current_user, outbound, channels, data)
+
+    # Handle disconnect
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # also after any other error: the registration, its writer task, the backplane
+        # subscription and the presence count must not outlive the socket
+        await _leave(outbound)
+
+async def _dispatch(
+    session_id: int,
+    current_user: Dict[str, Any],
+    websocket: Any,
+    channels: Set[str],
+    data: Dict[str, Any],
+):
+    """Handle one client message; `channels` is the socket's (mutable) subscription."""
+    mtype = data.get("type")
+    channel = _MESSAGE_CHANNELS.get(mtype)
+    if channel is not None and channel not in channels:
+        await manager.send_personal_message(encode({
+            "type": "error",
+            "error": "not_subscribed",
+            "channel": channel,
+        }), websocket)
         return
 
-    print(f"👤 User {current_user['username']} joined session {session_id}")
+    if mtype == "chat_message":
+        content = data.get("content", "")
+        if not isinstance(content, str):
+            print("⚠️ chat_message with invalid content:", type(content).__name__)
+            return
+        if not chat_ingest.has_room():
+            # the DB has been failing for a while: refuse rather than queue without bound
+            await manager.send_personal_message(encode({"type": "error", "error": "chat_unavailable"}), websocket)
+            return
+        pending = {
+            "provisional_id": provisional_id(),
+            "session_id": session_id,
+            "user_id": current_user["id"],
+            "content": content,
+            "created_at": datetime.utcnow(),
+        }
+        # shown right away; the real id follows in a "chat_ids" message once the batch is stored
+        await manager.broadcast(session_id, encode({
+            "type": "chat_message",
+            "user": current_user["username"],
+            "content": content,
+            "id": pending["provisional_id"],
+            "created_at": pending["created_at"].isoformat(),
+        }), channel=CHAT)
+        chat_ingest.submit(pending)
+
+    elif mtype == "sketch_update":
+        action = data.get("content")
+        if isinstance(action, dict):
+            await _add_sketch_action(session_id, current_user, action)
+
+    elif mtype == "sketch_get":
+        # optional {"since_seq", "epoch"}: resume from the last action the client saw
+        await manager.send_snapshot(encode(await _sketch_sync_message(
+            session_id, data.get("since_seq"), data.get("epoch"),
+        )), websocket)
+
+    elif mtype == "sketch_clear":
+        clear_seq = await state.clear_sketch(session_id)
+        _compacted_len.pop(session_id, None)
+        persistence.mark_dirty(session_id, "sketch_reset")
+        await manager.broadcast(session_id, encode({
+            "type": "sketch_cleared",
+            "user": {"id": current_user["id"], "username": current_user["username"]},
+            "seq": clear_seq,
+        }), channel=SKETCH)
+        print(f"🧼 Sketch cleared for session {session_id} by {current_user['username']}")
+
+    elif mtype == "editor_get":
+        await manager.send_snapshot(encode(await _editor_sync_message(session_id)), websocket)
+
+    elif mtype == "editor_update":
+        delta = data.get("content") or {}
+        if not isinstance(delta, dict):
+            print("⚠️ editor_update with invalid delta:", delta)
+            return
+        try:
+            offset = int(delta.get("offset", 0))
+            length = int(delta.get("length", 0))
+            insert_text = str(delta.get("text", ""))
+        except (TypeError, ValueError):
+            print("⚠️ editor_update with invalid delta:", delta)
+            return
 
-    # Register connection
-    await manager.connect(session_id, websocket)
+        # Versioned clients send the revision they edited ("base"); the delta is
+        # rebased onto everything applied since and broadcast with its new "rev".
+        base = _coerce_int(data.get("base")) if "base" in data else None
+        applied = await state.patch_editor(session_id, offset, length, insert_text, base)
+        if applied is None:
+            # history for that base is gone: resync the sender instead of guessing
+            await manager.send_snapshot(encode(await _editor_sync_message(session_id)), websocket)
+            return
+        rev, (offset, length, insert_text) = applied
+        persistence.mark_dirty(session_id, "editor")
+
+        update = {
+            "type": "editor_update",
+            "user": {"id": current_user["id"], "username": current_user["username"]},
+            "content": {
+                "offset": offset,
+                "length": length,
+                "text": insert_text,
+            },
+            "rev": rev,
+        }
+        if "op_id" in data:
+            update["op_id"] = data["op_id"]  # lets the sender match the ack to its pending delta
+        await manager.broadcast_event(session_id, update, channel=EDITOR)
+
+    elif mtype == "editor_set":
+        text = data.get("content")
+        if isinstance(text, str):
+            rev = await state.set_editor(session_id, text)
+            persistence.mark_dirty(session_id, "editor")
+            await manager.broadcast(session_id, encode({
+                "type": "editor_set",
+                "user": {"id": current_user["id"], "username": current_user["username"]},
+                "content": text,
+                "rev": rev,
+            }), channel=EDITOR)
+
+    elif mtype == "editor_clear":
+        rev = await state.set_editor(session_id, "")
+        persistence.mark_dirty(session_id, "editor")
+        await manager.broadcast(session_id, encode({
+            "type": "editor_cleared",
+            "user": {"id": current_user["id"], "username": current_user["username"]},
+            "rev": rev,
+        }), channel=EDITOR)
+        print(f"🧼 Editor cleared for session {session_id} by {current_user['username']}")
+
+    elif mtype == "presence_get":
+        await manager.send_personal_message(encode({
+            "type": "presence",
+            "users": await _presence(session_id),
+        }), websocket)
+
+    elif mtype == "media_toggle":
+        changes = {}
+        if "micEnabled" in data:
+            changes["mic"] = bool(data["micEnabled"])
+        if "camEnabled" in data:
+            changes["cam"] = bool(data["camEnabled"])
+        st = await state.patch_media(session_id, current_user["id"], **changes)
+        await manager.broadcast(session_id, encode({
+            "type": "media_state",
+            "user_id": current_user["id"],
+            "mic": st["mic"],
+            "cam": st["cam"],
+        }), key=f"media_state:{current_user['id']}", channel=SIGNAL)
+
+    elif mtype == "webrtc_offer":
+        f = _flat(data)
+        to_user_id = _coerce_int(f.get("to_user_id"))
+        sdp = f.get("sdp")
+        if to_user_id is None or not isinstance(sdp, str):
+            await manager.send_personal_message(encode({"type": "webrtc_error", "error": "invalid_offer"}), websocket)
+            return
+        if not await _is_present(session_id, to_user_id):
+            await manager.send_personal_message(encode({"type": "webrtc_error", "error": "target_offline"}), websocket)
+            return
+        print(f"📡 Relay webrtc_offer s={session_id} from={current_user['id']} -> to={to_user_id}")
+        await _send_to_user(session_id, to_user_id, {
+            "type": "webrtc_offer",
+            "from_user_id": current_user["id"],
+            "sdp": sdp,
+        })
+
+    elif mtype == "webrtc_answer":
+        f = _flat(data)
+        to_user_id = _coerce_int(f.get("to_user_id"))
+        sdp = f.get("sdp")
+        if to_user_id is None or not isinstance(sdp, str):
+            await manager.send_personal_message(encode({"type": "webrtc_error", "error": "invalid_answer"}), websocket)
+            return
+        if not await _is_present(session_id, to_user_id):
+            await manager.send_personal_message(encode({"type": "webrtc_error", "error": "target_offline"}), websocket)
+            return
+        print(f"📡 Relay webrtc_answer s={session_id} from={current_user['id']} -> to={to_user_id}")
+        await _send_to_user(session_id, to_user_id, {
+            "type": "webrtc_answer",
+            "from_user_id": current_user["id"],
+            "sdp": sdp,
+        })
+
+    elif mtype == "webrtc_ice":
+        f = _flat(data)
+        to_user_id = _coerce_int(f.get("to_user_id"))
+        candidate = f.get("candidate")
+        if to_user_id is None or candidate is None:
+            await manager.send_personal_message(encode({"type": "webrtc_error", "error": "invalid_ice"}), websocket)
+            return
+        if not await _is_present(session_id, to_user_id):
+            await manager.send_personal_message(encode({"type": "webrtc_error", "error": "target_offline"}), websocket)
+            return
+        # candidate may be dict or string depending on browser; relay as-is
+        print(f"📡 Relay webrtc_ice s={session_id} from={current_user['id']} -> to={to_user_id}")
+        await _send_to_user(session_id, to_user_id, {
+            "type": "webrtc_ice",
+            "from_user_id": current_user["id"],
+            "candidate": candidate,
+        })
+
+    elif mtype == "webrtc_signal":
+        # opaque signaling payload from legacy /webrtc clients, relayed to everyone in the session
+        await manager.broadcast(session_id, encode({
+            "type": "webrtc_signal",
+            "user": current_user["username"],
+            "content": data.get("content"),
+        }), channel=SIGNAL)
+
+    elif mtype == "ping":
+        await manager.send_personal_message(encode({"type": "pong"}), websocket)
+
+    elif mtype == "pong":
+        pass  # heartbeat answer; receiving it already refreshed the socket
+
+    elif mtype in ("subscribe", "unsubscribe"):
+        requested = _parse_channels(data.get("channels")) or set()
+        added = requested - channels if mtype == "subscribe" else set()
+        if mtype == "subscribe":
+            channels |= requested
+        else:
+            channels -= requested
+        manager.set_channels(websocket, channels)
+        await manager.send_personal_message(encode({"type": "subscribed", "channels": sorted(channels)}), websocket)
+        # Presence follows the signal subscription
+        conn = manager.connections.get(websocket)
+        if conn is not None and conn.present != (SIGNAL in channels):
+            conn.present = SIGNAL in channels
+            if conn.present:
+                await _presence_join(session_id, current_user["id"], websocket)
+            else:
+                await _presence_leave(session_id, current_user["id"])
+        await _send_channel_syncs(session_id, websocket, added)
 
-    # register user socket for video call
-    session_user_sockets.setdefault(session_id, {}).setdefault(current_user["id"], set()).add(websocket)
-    session_connected_users.setdefault(session_id, set()).add(current_user["id"])
-    media_status.setdefault(session_id, {}).setdefault(current_user["id"], {"mic": False, "cam": False})
+    else:
+        print("Unknown message type:", mtype)
+
+async def _presence_join(session_id: int, user_id: int, websocket: Any):
+    # Video call presence: count the socket, send it who is there and announce the user
+    await state.add_presence(session_id, user_id)
+    await state.patch_media(session_id, user_id)
 
     # Notify current presence (video)
-    await websocket.send_json({
+    await manager.send_personal_message(encode({
         "type": "presence",
-        "users": sorted(list(session_connected_users.get(session_id, set()))),
-    })
-    await websocket.send_json({
+        "users": await _presence(session_id),
+    }), websocket)
+    await manager.send_personal_message(encode({
         "type": "media_state_snapshot",
-        "status": media_status.get(session_id, {}),
-    })
+        "status": await state.get_media(session_id),
+    }), websocket)
     # Notify others of new user (video)
-    await manager.broadcast(session_id, json.dumps({
+    await manager.broadcast(session_id, encode({
         "type": "presence_join",
-        "user_id": current_user["id"],
-    }))
+        "user_id": user_id,
+    }), channel=SIGNAL)
 
-    # Warm memory + initial sync (sketch)
-    if session_id not in sketch_state:
-        sketch_state[session_id] = _load_sketch_list_from_db(db, session_id)
-    await websocket.send_json({
-        "type": "sketch_sync",
-        "content": sketch_state[session_id],
-    })
-
-    # Warm memory + initial sync (code editor)
-    if session_id not in editor_text:
-        editor_text[session_id] = _load_editor_from_db(db, session_id)
-    await websocket.send_json({
-        "type": "editor_sync",
-        "content": editor_text[session_id],
-    })
-
-    # Main loop
+async def _presence_leave(session_id: int, user_id: int):
+    # Video call presence/media cleanup
     try:
-        while True:
-            raw = await websocket.receive_text()
-            # Parse JSON
-            try:
-                data: Dict[str, Any] = json.loads(raw)
-            except json.JSONDecodeError:
-                print("Invalid JSON received")
-                continue
-
-            mtype = data.get("type")
-
-            if mtype == "chat_message":
-                content = data.get("content", "")
-                new_message = Message(
-                    content=content,
-                    session_id=session_id,
-                    user_id=current_user["id"],
-                )
-                db.add(new_message)
-                db.commit()
-                db.refresh(new_message)
-                await manager.broadcast(session_id, json.dumps({
-                    "type": "chat_message",
-                    "user": current_user["username"],
-                    "content": content,
-                    "id": new_message.id,
-                    "created_at": new_message.created_at.isoformat(),
-                }))
-
-            elif mtype == "sketch_update":
-                action = data.get("content")
-                if isinstance(action, dict):
-                    sketch_state.setdefault(session_id, []).append(action)
-                    await manager.broadcast(session_id, json.dumps({
-                        "type": "sketch_update",
-                        "user": {"id": current_user["id"], "username": current_user["username"]},
-                        "content": action,
-                    }))
-
-            elif mtype == "sketch_get":
-                await websocket.send_json({
-                    "type": "sketch_sync",
-                    "content": sketch_state.get(session_id, []),
-                })
-
-            elif mtype == "sketch_clear":
-                sketch_state[session_id] = []
-                _save_sketch_list_to_db(db, session_id, [])  # persist immediately on clear
-                await manager.broadcast(session_id, json.dumps({
-                    "type": "sketch_cleared",
-                    "user": {"id": current_user["id"], "username": current_user["username"]},
-                }))
-                print(f"🧼 Sketch cleared for session {session_id} by {current_user['username']}")
-
-            elif mtype == "editor_get":
-                await websocket.send_json({
-                    "type": "editor_sync",
-                    "content": editor_text.get(session_id, ""),
-                })
-            
-            elif mtype == "editor_update":
-                delta = data.get("content") or {}
-                try:
-                    offset = int(delta.get("offset", 0))
-                    length = int(delta.get("length", 0))
-                    insert_text = str(delta.get("text", ""))
-                except (TypeError, ValueError):
-                    print("⚠️ editor_update with invalid delta:", delta)
-                    continue
-
-                before = editor_text.get(session_id, "")
-                after = _apply_delta(before, offset, length, insert_text)
-                editor_text[session_id] = after
-
-                await manager.broadcast(session_id, json.dumps({
-                    "type": "editor_update",
-                    "user": {"id": current_user["id"], "username": current_user["username"]},
-                    "content": {
-                        "offset": offset,
-                        "length": length,
-                        "text": insert_text,
-                    },
-                }))
-
-            elif mtype == "editor_set":
-                text = data.get("content")
-                if isinstance(text, str):
-                    editor_text[session_id] = text
-                    await manager.broadcast(session_id, json.dumps({
-                        "type": "editor_set",
-                        "user": {"id": current_user["id"], "username": current_user["username"]},
-                        "content": text,
-                    }))
-            
-            elif mtype == "editor_clear":
-                editor_text[session_id] = ""
-                _save_editor_to_db(db, session_id, "")
-                await manager.broadcast(session_id, json.dumps({
-                    "type": "editor_cleared",
-                    "user": {"id": current_user["id"], "username": current_user["username"]},
-                }))
-                print(f"🧼 Editor cleared for session {session_id} by {current_user['username']}")
-            
-            elif mtype == "presence_get":
-                await websocket.send_json({
-                    "type": "presence",
-                    "users": sorted(list(session_connected_users.get(session_id, set()))),
-                })
-            
-            elif mtype == "media_toggle":
-                st = media_status.setdefault(session_id, {}).setdefault(current_user["id"], {"mic": False, "cam": False})
-                if "micEnabled" in data:
-                    st["mic"] = bool(data["micEnabled"])
-                if "camEnabled" in data:
-                    st["cam"] = bool(data["camEnabled"])
-                await manager.broadcast(session_id, json.dumps({
+        # If the user has NO more sockets open in this session (on any worker), mark them offline
+        no_more_user_sockets = await state.remove_presence(session_id, user_id) == 0
+        if no_more_user_sockets:
+            # Presence: broadcast leave
+            await manager.broadcast(session_id, encode({
+                "type": "presence_leave",
+                "user_id": user_id,
+            }), channel=SIGNAL)
+
+            # Media: if they had mic/cam on, force to off so UIs update
+            st = (await state.get_media(session_id)).get(user_id)
+            if st and (st.get("mic") or st.get("cam")):
+                await state.patch_media(session_id, user_id, mic=False, cam=False)
+                await manager.broadcast(session_id, encode({
                     "type": "media_state",
-                    "user_id": current_user["id"],
-                    "mic": st["mic"],
-                    "cam": st["cam"],
-                }))
-            
-            elif mtype == "webrtc_offer":
-                f = _flat(data)
-                to_user_id = _coerce_int(f.get("to_user_id"))
-                sdp = f.get("sdp")
-                if to_user_id is None or not isinstance(sdp, str):
-                    await websocket.send_json({"type": "webrtc_error", "error": "invalid_offer"})
-                    continue
-                if to_user_id not in session_connected_users.get(session_id, set()):
-                    await websocket.send_json({"type": "webrtc_error", "error": "target_offline"})
-                    continue
-                print(f"📡 Relay webrtc_offer s={session_id} from={current_user['id']} -> to={to_user_id}")
-                await _send_to_user(session_id, to_user_id, {
-                    "type": "webrtc_offer",
-                    "from_user_id": current_user["id"],
-                    "sdp": sdp,
-                })
-
-            elif mtype == "webrtc_answer":
-                f = _flat(data)
-                to_user_id = _coerce_int(f.get("to_user_id"))
-                sdp = f.get("sdp")
-                if to_user_id is None or not isinstance(sdp, str):
-                    await websocket.send_json({"type": "webrtc_error", "error": "invalid_answer"})
-                    continue
-                if to_user_id not in session_connected_users.get(session_id, set()):
-                    await websocket.send_json({"type": "webrtc_error", "error": "target_offline"})
-                    continue
-                print(f"📡 Relay webrtc_answer s={session_id} from={current_user['id']} -> to={to_user_id}")
-                await _send_to_user(session_id, to_user_id, {
-                    "type": "webrtc_answer",
-                    "from_user_id": current_user["id"],
-                    "sdp": sdp,
-                })
-
-            elif mtype == "webrtc_ice":
-                f = _flat(data)
-                to_user_id = _coerce_int(f.get("to_user_id"))
-                candidate = f.get("candidate")
-                if to_user_id is None or candidate is None:
-                    await websocket.send_json({"type": "webrtc_error", "error": "invalid_ice"})
-                    continue
-                if to_user_id not in session_connected_users.get(session_id, set()):
-                    await websocket.send_json({"type": "webrtc_error", "error": "target_offline"})
-                    continue
-                # candidate may be dict or string depending on browser; relay as-is
-                print(f"📡 Relay webrtc_ice s={session_id} from={current_user['id']} -> to={to_user_id}")
-                await _send_to_user(session_id, to_user_id, {
-                    "type": "webrtc_ice",
-                    "from_user_id": current_user["id"],
-                    "candidate": candidate,
-                })
-            
-            else:
-                print("Unknown message type:", mtype)
+                    "user_id": user_id,
+                    "mic": False,
+                    "cam": False,
+                }), key=f"media_state:{user_id}", channel=SIGNAL)
+
+    except Exception as e:
+        print("presence/media cleanup error:", e)
+
+async def _release_session(session_id: int):
+    """Persist a session whose last local socket left and drop what this worker keeps for it."""
+    await persistence.flush([session_id])  # also waits for a flush of it already in flight
+    if persistence.is_dirty(session_id) and not manager.has_connections(session_id):
+        _release_retry.add(session_id)  # the write failed: keep the state until a retry saves it
+        return
+    if manager.has_connections(session_id) or session_id in _compacting:
+        return  # someone rejoined meanwhile or a compaction is running
+    _compacted_len.pop(session_id, None)
+    _saved_editor_rev.pop(session_id, None)
+    await state.unload(session_id)
+
+async def _presence(session_id: int) -> List[int]:
+    # The in-process store only ever sees this worker's sockets, so the registry already
+    # has the answer; with a shared store other workers' users count too
+    if isinstance(state, MemorySessionStateStore):
+        return sorted(manager.connections.present_users(session_id))
+    return await state.get_presence(session_id)
+
+async def _is_present(session_id: int, user_id: int) -> bool:
+    # A present socket on this worker settles it without asking the state store
+    if manager.connections.is_present(session_id, user_id):
+        return True
+    return not isinstance(state, MemorySessionStateStore) and await state.is_present(session_id, user_id)
+
+async def _leave(websocket: Any):
+    # Remove this WebSocket from the session fanout and the user's routing bucket;
+    # a socket the reaper already removed was cleaned up then
+    conn = manager.disconnect(websocket)
+    if conn is None:
+        return
+    session_id = conn.session_id
 
-    # Handle disconnect
-    except WebSocketDisconnect:
-        # Remove this WebSocket from the session fanout
-        manager.disconnect(session_id, websocket)
+    if conn.present:
+        await _presence_leave(session_id, conn.user_id)
 
-        # Video call presence/media cleanup
-        try:
-            # Remove this socket from the routing map for this user
-            user_map = session_user_sockets.get(session_id, {})
-            user_bucket = user_map.get(current_user["id"], set())
-            if websocket in user_bucket:
-                user_bucket.discard(websocket)
-
-            # If the user has NO more sockets open in this session, mark them offline
-            no_more_user_sockets = not user_bucket
-            if no_more_user_sockets:
-                # Presence: mark offline & broadcast leave
-                present = session_connected_users.get(session_id, set())
-                if current_user["id"] in present:
-                    present.discard(current_user["id"])
-                    await manager.broadcast(session_id, json.dumps({
-                        "type": "presence_leave",
-                        "user_id": current_user["id"],
-                    }))
-
-                # Media: if they had mic/cam on, force to off so UIs update
-                st = media_status.get(session_id, {}).get(current_user["id"])
-                if st and (st.get("mic") or st.get("cam")):
-                    st["mic"] = False
-                    st["cam"] = False
-                    await manager.broadcast(session_id, json.dumps({
-                        "type": "media_state",
-                        "user_id": current_user["id"],
-                        "mic": False,
-                        "cam": False,
-                    }))
-
-        except Exception as e:
-            print("presence/media cleanup error:", e)
-
-        # Persist sketch/editor state to DB on disconnect
-        try:
-            actions = sketch_state.get(session_id, [])
-            _save_sketch_list_to_db(db, session_id, actions)
-            print(f"💾 Saved sketch on disconnect for session {session_id} (actions={len(actions)})")
-        except Exception as e:
-            print("sketch save on disconnect error:", e)
+    # Last socket on this worker gone: persist now instead of waiting for the next tick
+    if not manager.has_connections(session_id):
+        await _release_session(session_id)
 
-        try:
-            text = editor_text.get(session_id, "")
-            _save_editor_to_db(db, session_id, text)
-            print(f"💾 Saved editor on disconnect for session {session_id} (len={len(text)})")
-        except Exception as e:
-            print("editor save on disconnect error:", e)
+    # if nobody is connected to this session anymore, purge presence/media state
+    try:
+        if not manager.has_connections(session_id) and not await _presence(session_id):
+            await state.drop_presence(session_id)
+            print(f"🧹 Purged presence/media maps for empty session {session_id}")
+    except Exception as e:
+        print("session purge error:", e)
+
+async def _reap(session_id: int, websocket: Any, user_id: Optional[int]):
+    # Heartbeat socket went silent: same cleanup as a disconnect, then close it
+    print(f"💀 Reaping silent socket of user {user_id} in session {session_id}")
+    await _leave(websocket)
+    try:
+        await websocket.close(code=1001)
+    except Exception:
+        pass
 
-        # if no more connections to this session, purge in-memory states
-        try:
-            # manager.active_connections.get(session_id) returns a list/set of sockets for this session
-            if not manager.active_connections.get(session_id):
-                session_user_sockets.pop(session_id, None)
-                session_connected_users.pop(session_id, None)
-                media_status.pop(session_id, None)
-                print(f"🧹 Purged presence/media maps for empty session {session_id}")
-        except Exception as e:
-            print("session purge error:", e)
\ No newline at end of file
+supervisor = ConnectionSupervisor(manager, _reap)
+
+@router.websocket("/sessions/{session_id}")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    session_id: int,
+):
+    # Multiplexed session gateway. ?channels=chat,sketch,editor,signal picks what the
+    # socket receives (default: everything); {"type": "subscribe"/"unsubscribe",
+    # "channels": [...]} changes it later and is answered with {"type": "subscribed"}.
+    current_user = await open_session_socket(websocket, session_id)
+    if current_user is None:
+        return
+    channels = _parse_channels(websocket.query_params.get("channels"))
+    await serve_session(websocket, session_id, current_user, CHANNELS if channels is None else channels)
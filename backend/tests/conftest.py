@@ -0,0 +1,60 @@
+import importlib
+import os
+
+import pytest
+
+# Settings are read at import time; keep tests off the real database, Redis and mail server
+os.environ["DB_URL"] = "sqlite://"
+os.environ.pop("ASYNC_DB_URL", None)
+os.environ["REALTIME_BACKPLANE"] = "local"
+os.environ["SESSION_STATE_BACKEND"] = "memory"
+os.environ["MEMBERSHIP_CACHE_BACKEND"] = "memory"
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("MAIL_USERNAME", "test")
+os.environ.setdefault("MAIL_PASSWORD", "test")
+os.environ.setdefault("MAIL_FROM", "test@example.com")
+os.environ.setdefault("MAIL_PORT", "25")
+os.environ.setdefault("MAIL_SERVER", "localhost")
+
+
+def import_models():
+    """Register every table on Base.metadata (and let the mappers resolve each other)."""
+    for name in ("material", "message", "session", "session_editor", "session_member", "session_sketch_action", "user"):
+        importlib.import_module(f"models.{name}")
+
+
+@pytest.fixture
+def db():
+    """ORM session on a fresh in-memory SQLite database with every table created."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    from db.database import Base
+
+    import_models()
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False, future=True)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def fresh_gateway(monkeypatch):
+    """Fresh write-behind scheduler and chat ingestor for the session gateway.
+
+    Their asyncio primitives bind to the first event loop that waits on them,
+    and every test runs its own loop.
+    """
+    from core.chat_ingest import ChatIngestor
+    from core.persistence import WriteBehindScheduler
+    from routers import websocket as gateway
+
+    monkeypatch.setattr(gateway, "persistence", WriteBehindScheduler(gateway._flush_sessions))
+    monkeypatch.setattr(gateway, "chat_ingest", ChatIngestor(gateway._insert_chat_batch))
+    return gateway
@@ -0,0 +1,98 @@
+import asyncio
+
+from core.backplane import InMemoryBroker, PubSubBackplane
+from core.connection_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+async def _settle(cond, timeout=1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not cond():
+        assert asyncio.get_running_loop().time() < deadline, "timed out waiting for delivery"
+        await asyncio.sleep(0.01)
+
+
+def _two_workers():
+    broker = InMemoryBroker()
+    return (
+        ConnectionManager("test", backplane=PubSubBackplane(broker), coalesce_window=0),
+        ConnectionManager("test", backplane=PubSubBackplane(broker), coalesce_window=0),
+    )
+
+
+def test_broadcast_reaches_sockets_on_every_worker_once():
+    async def run():
+        a, b = _two_workers()
+        on_a, on_b, other_session = FakeSocket(), FakeSocket(), FakeSocket()
+        await a.connect(1, on_a, user_id=10)
+        await b.connect(1, on_b, user_id=11)
+        await b.connect(2, other_session, user_id=12)
+
+        await a.broadcast(1, "hello")
+        await _settle(lambda: on_b.sent)
+        await asyncio.sleep(0.05)  # a stray echo would show up by now
+
+        assert on_a.sent == ["hello"]
+        assert on_b.sent == ["hello"]
+        assert other_session.sent == []
+        await a.backplane.close()
+        await b.backplane.close()
+
+    asyncio.run(run())
+
+
+def test_send_to_user_targets_the_users_sockets_on_other_workers():
+    async def run():
+        a, b = _two_workers()
+        sender, target_a, target_b, bystander = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+        await a.connect(1, sender, user_id=10)
+        await a.connect(1, target_a, user_id=11)
+        await b.connect(1, target_b, user_id=11)
+        await b.connect(1, bystander, user_id=12)
+
+        await a.send_to_user(1, 11, "offer")
+        await _settle(lambda: target_b.sent)
+        await asyncio.sleep(0.05)
+
+        assert target_a.sent == ["offer"]
+        assert target_b.sent == ["offer"]
+        assert sender.sent == []
+        assert bystander.sent == []
+        await a.backplane.close()
+        await b.backplane.close()
+
+    asyncio.run(run())
+
+
+def test_channel_filter_applies_on_the_receiving_worker():
+    async def run():
+        a, b = _two_workers()
+        everything, chat_only = FakeSocket(), FakeSocket()
+        await a.connect(1, FakeSocket(), user_id=10)
+        await b.connect(1, everything, user_id=11)
+        await b.connect(1, chat_only, user_id=12, channels={"chat"})
+
+        await a.broadcast(1, "stroke", channel="sketch")
+        await a.broadcast(1, "msg", channel="chat")
+        await _settle(lambda: len(everything.sent) == 2)
+        await asyncio.sleep(0.05)
+
+        assert everything.sent == ["stroke", "msg"]
+        assert chat_only.sent == ["msg"]
+        await a.backplane.close()
+        await b.backplane.close()
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+
+from core.chat_ingest import ChatIngestor
+
+
+class SlowWriter:
+    def __init__(self, delay=0.05, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.written = []
+        self.calls = 0
+        self.started = asyncio.Event()
+
+    async def __call__(self, batch):
+        self.calls += 1
+        self.started.set()
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("db down")
+        self.written.extend(m["content"] for m in batch)
+
+
+def _message(n):
+    return {"session_id": 1, "user_id": 1, "content": n}
+
+
+def test_stop_writes_the_batch_in_flight_and_the_rest():
+    async def run():
+        writer = SlowWriter()
+        ingest = ChatIngestor(writer, interval=0.01, max_batch=5)
+        for n in range(5):
+            ingest.submit(_message(n))
+        await writer.started.wait()  # messages 0-4 are being written
+        ingest.submit(_message(99))
+        await ingest.stop()
+
+        assert writer.written == [0, 1, 2, 3, 4, 99]
+        assert ingest.queue == []
+
+    asyncio.run(run())
+
+
+def test_stop_interrupts_the_retry_backoff():
+    async def run():
+        writer = SlowWriter(delay=0, fail=True)
+        ingest = ChatIngestor(writer, interval=0.01, max_batch=5)
+        ingest.submit(_message(1))
+        await writer.started.wait()
+        await asyncio.sleep(0.05)  # now backing off after the failed write
+        writer.fail = False
+
+        await asyncio.wait_for(ingest.stop(), 0.5)
+        assert writer.written == [1]
+
+    asyncio.run(run())
+
+
+def test_failed_write_backs_off_even_with_a_full_queue():
+    async def run():
+        writer = SlowWriter(delay=0, fail=True)
+        ingest = ChatIngestor(writer, interval=0.01, max_batch=2)
+        for n in range(4):
+            ingest.submit(_message(n))
+        await asyncio.sleep(0.2)
+
+        assert writer.calls == 1
+        assert len(ingest.queue) == 4
+        writer.fail = False
+        await ingest.stop()
+
+    asyncio.run(run())
+
+
+def test_queue_is_capped_while_writes_fail():
+    async def run():
+        writer = SlowWriter(delay=0, fail=True)
+        ingest = ChatIngestor(writer, interval=0.01, max_batch=2, max_queue=3)
+        accepted = [ingest.submit(_message(n)) for n in range(4)]
+
+        assert accepted == [True, True, True, False]
+        assert not ingest.has_room()
+        writer.fail = False
+        await ingest.stop()
+        assert writer.written == [0, 1, 2]
+
+    asyncio.run(run())
@@ -0,0 +1,115 @@
+import asyncio
+
+from core.backplane import InMemoryBroker, PubSubBackplane
+from core.connection_manager import (
+    OVERFLOW_COALESCE,
+    OVERFLOW_DISCONNECT,
+    OVERFLOW_DROP_OLDEST,
+    SLOW_CONSUMER_CLOSE_CODE,
+    ConnectionManager,
+)
+
+
+class StallingSocket:
+    """Socket whose sends hang until `release` is set."""
+
+    def __init__(self, stalled=True):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+        if not stalled:
+            self.release.set()
+
+    async def send_text(self, message):
+        assert isinstance(message, str), "binary frame sent as text"
+        await self.release.wait()
+        self.sent.append(message)
+
+    async def send_bytes(self, data):
+        await self.release.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def _manager(policy, size):
+    return ConnectionManager(
+        "test", backplane=PubSubBackplane(InMemoryBroker()), queue_size=size, overflow_policy=policy, coalesce_window=0,
+    )
+
+
+async def _stall_on_first_frame(manager, socket):
+    """Connect `socket` and leave its writer stuck sending "m0", so later frames queue up."""
+    await manager.connect(1, socket, user_id=1)
+    await manager.broadcast(1, "m0")
+    await asyncio.sleep(0.01)
+
+
+def test_drop_oldest_evicts_the_oldest_queued_frame():
+    async def run():
+        manager = _manager(OVERFLOW_DROP_OLDEST, size=3)
+        slow = StallingSocket()
+        await _stall_on_first_frame(manager, slow)
+        for n in range(1, 6):
+            await manager.broadcast(1, f"m{n}")
+
+        slow.release.set()
+        await asyncio.sleep(0.01)
+
+        assert slow.sent == ["m0", "m3", "m4", "m5"]
+        assert slow.closed_with is None
+        await manager.backplane.close()
+
+    asyncio.run(run())
+
+
+def test_coalesce_replaces_the_frame_with_the_same_key_in_place():
+    async def run():
+        manager = _manager(OVERFLOW_COALESCE, size=3)
+        slow = StallingSocket()
+        await _stall_on_first_frame(manager, slow)
+        await manager.broadcast(1, "presence v1", key="presence")
+        await manager.broadcast(1, "a")
+        await manager.broadcast(1, "b")  # queue full
+        await manager.broadcast(1, "presence v2", key="presence")
+
+        slow.release.set()
+        await asyncio.sleep(0.01)
+
+        assert slow.sent == ["m0", "presence v2", "a", "b"]
+        await manager.backplane.close()
+
+    asyncio.run(run())
+
+
+def test_disconnect_closes_only_the_slow_socket():
+    async def run():
+        manager = _manager(OVERFLOW_DISCONNECT, size=2)
+        slow, fast = StallingSocket(), StallingSocket(stalled=False)
+        await manager.connect(1, fast, user_id=2)
+        await _stall_on_first_frame(manager, slow)
+        for n in range(1, 5):
+            await manager.broadcast(1, f"m{n}")
+            await asyncio.sleep(0)  # the fast socket's writer keeps up
+        await asyncio.sleep(0.01)
+
+        assert slow.closed_with == SLOW_CONSUMER_CLOSE_CODE
+        assert fast.closed_with is None
+        assert fast.sent == ["m0", "m1", "m2", "m3", "m4"]
+        assert slow.sent == []
+        await manager.backplane.close()
+
+    asyncio.run(run())
+
+
+def test_personal_message_to_an_unregistered_socket_keeps_its_frame_type():
+    async def run():
+        manager = _manager(OVERFLOW_DISCONNECT, size=2)
+        socket = StallingSocket(stalled=False)
+        await manager.send_personal_message(b"\x01\x02", socket)
+        await manager.send_personal_message("text", socket)
+
+        assert socket.sent == [b"\x01\x02", "text"]
+
+    asyncio.run(run())
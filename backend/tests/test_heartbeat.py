@@ -0,0 +1,36 @@
+import asyncio
+
+from core.backplane import InMemoryBroker, PubSubBackplane
+from core.connection_manager import ConnectionManager
+from core.heartbeat import ConnectionSupervisor
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        pass
+
+
+def test_zero_interval_and_timeout_are_not_replaced_by_the_settings():
+    async def run():
+        manager = ConnectionManager("test", backplane=PubSubBackplane(InMemoryBroker()), coalesce_window=0)
+        reaped = []
+
+        async def reap(session_id, websocket, user_id):
+            reaped.append(user_id)
+
+        supervisor = ConnectionSupervisor(manager, reap, interval=0, idle_timeout=0)
+        await manager.connect(1, FakeSocket(), user_id=1, heartbeat=True)
+        supervisor.ensure_running()
+        await asyncio.sleep(0.01)  # long past an idle timeout of 0
+
+        assert supervisor._task is None  # no pings
+        assert await supervisor.sweep() == 1
+        assert reaped == []  # never reaped
+
+    asyncio.run(run())
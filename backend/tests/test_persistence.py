@@ -0,0 +1,63 @@
+import asyncio
+
+from core.persistence import WriteBehindScheduler
+
+
+class SlowStore:
+    """Flush callback that takes a while, so stop() can land mid-write."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.written = []
+        self.started = asyncio.Event()
+
+    async def __call__(self, batch):
+        self.started.set()
+        await asyncio.sleep(self.delay)
+        self.written.append(batch)
+
+
+def test_stop_finishes_the_batch_in_flight_and_flushes_the_rest():
+    async def run():
+        store = SlowStore()
+        scheduler = WriteBehindScheduler(store, interval=0.01, max_dirty=100)
+        scheduler.mark_dirty(1, "sketch")
+        await store.started.wait()  # session 1 is being written
+        scheduler.mark_dirty(2, "editor")
+        await scheduler.stop()
+
+        assert store.written == [{1: {"sketch"}}, {2: {"editor"}}]
+        assert not scheduler.dirty
+
+    asyncio.run(run())
+
+
+def test_cancelled_flush_keeps_its_batch_dirty():
+    async def run():
+        store = SlowStore(delay=10)
+        scheduler = WriteBehindScheduler(store, interval=60, max_dirty=100)
+        scheduler.dirty = {1: {"sketch"}}
+        flush = asyncio.create_task(scheduler.flush())
+        await store.started.wait()
+        flush.cancel()
+        try:
+            await flush
+        except asyncio.CancelledError:
+            pass
+
+        assert scheduler.dirty == {1: {"sketch"}}
+
+    asyncio.run(run())
+
+
+def test_task_exits_once_nothing_is_dirty():
+    async def run():
+        store = SlowStore(delay=0)
+        scheduler = WriteBehindScheduler(store, interval=0.01, max_dirty=100)
+        scheduler.mark_dirty(1, "editor")
+        await asyncio.sleep(0.1)
+
+        assert store.written == [{1: {"editor"}}]
+        assert scheduler._task is None
+
+    asyncio.run(run())
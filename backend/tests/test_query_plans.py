@@ -0,0 +1,43 @@
+"""EXPLAIN regression checks: the hot lookups must be index searches, not table scans.
+
+Runs on the SQLite test database built from the models, so it catches an
+index dropped from a model or a query that stops matching its index.
+"""
+from sqlalchemy import select
+
+from models.material import Material
+from models.message import Message
+from models.session_member import SessionMember
+from models.user import User
+from routers.session import _message_rows
+
+
+def _plan(db, stmt) -> str:
+    sql = str(stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    rows = db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + sql).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def test_membership_lookup_uses_the_composite_index(db):
+    plan = _plan(db, select(SessionMember.id).where(SessionMember.session_id == 1, SessionMember.user_id == 2))
+
+    assert "ix_session_members_session_user (session_id=? AND user_id=?)" in plan
+
+
+def test_message_history_is_read_in_index_order(db):
+    plan = _plan(db, _message_rows(1).order_by(Message.created_at.asc(), Message.id.asc()))
+
+    assert "ix_messages_session_created_id (session_id=?)" in plan
+    assert "TEMP B-TREE" not in plan  # no sort step
+
+
+def test_materials_by_session_use_an_index(db):
+    plan = _plan(db, select(Material).where(Material.session_id == 1))
+
+    assert "ix_materials_session_id (session_id=?)" in plan
+
+
+def test_user_by_email_uses_the_unique_index(db):
+    plan = _plan(db, select(User).where(User.email == "a@example.com"))
+
+    assert "USING INDEX" in plan and "(email=?)" in plan
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from core.auth import Principal
+from models.session import Session
+from models.session_member import SessionMember
+from models.user import User
+from routers.session import get_my_sessions, get_session
+
+
+def _user(db, n):
+    user = User(email=f"u{n}@example.com", username=f"u{n}", password_hash="x")
+    db.add(user)
+    db.flush()
+    return user
+
+
+def _populate(db, sessions, members):
+    """`sessions` sessions created by one user, each with `members` members (the creator included)."""
+    owner = _user(db, 0)
+    others = [_user(db, n) for n in range(1, members)]
+    for n in range(sessions):
+        session = Session(title=f"s{n}", invite_code=f"CODE{n:04d}", created_by=owner.id)
+        db.add(session)
+        db.flush()
+        for user in [owner, *others]:
+            db.add(SessionMember(session_id=session.id, user_id=user.id))
+    db.commit()
+    principal = Principal(owner.id, owner.username, float("inf"))
+    db.expunge_all()  # nothing preloaded in the identity map
+    return principal
+
+
+@contextmanager
+def _count_statements(db):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+
+def test_my_sessions_query_count_does_not_grow_with_sessions_or_members(db):
+    principal = _populate(db, sessions=12, members=6)
+    with _count_statements(db) as statements:
+        sessions = get_my_sessions(db, principal)
+
+    assert len(sessions) == 12
+    assert all(len(s["members"]) == 6 for s in sessions)
+    assert len(statements) == 2
+
+
+def test_my_sessions_query_count_is_the_same_for_one_session(db):
+    principal = _populate(db, sessions=1, members=1)
+    with _count_statements(db) as statements:
+        get_my_sessions(db, principal)
+
+    assert len(statements) == 2
+
+
+def test_get_session_loads_members_in_one_extra_query(db):
+    principal = _populate(db, sessions=1, members=8)
+    session_id = db.query(Session.id).scalar()
+    with _count_statements(db) as statements:
+        data = get_session(session_id, db, principal)
+
+    assert sorted(m.username for m in data["members"]) == sorted(f"u{n}" for n in range(8))
+    assert len(statements) == 2
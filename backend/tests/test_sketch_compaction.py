@@ -0,0 +1,49 @@
+import time
+
+from core.sketch_compaction import compact_actions
+
+
+def _stroke(points, mode="draw", line_width=4):
+    return {"type": "stroke", "mode": mode, "lineWidth": line_width, "points": [{"x": x, "y": y} for x, y in points]}
+
+
+def test_eraser_covering_a_stroke_drops_both():
+    drawn = _stroke([(100, 100), (120, 100)])
+    eraser = _stroke([(90, 100), (130, 100)], mode="erase", line_width=40)
+
+    assert compact_actions([drawn, eraser]) == []
+
+
+def test_single_point_eraser_erases_nothing():
+    drawn = _stroke([(100, 100), (102, 100)])
+    dot = _stroke([(101, 100)], mode="erase", line_width=40)
+
+    assert compact_actions([drawn, dot]) == [drawn, dot]
+
+
+def test_zero_length_eraser_erases_nothing():
+    drawn = _stroke([(100, 100), (102, 100)])
+    dot = _stroke([(101, 100), (101, 100)], mode="erase", line_width=40)
+
+    assert drawn in compact_actions([drawn, dot])
+
+
+def test_oversized_strokes_are_kept_without_analysing_them():
+    drawn = _stroke([(100, 100), (120, 100)])
+    huge_eraser = _stroke([(0, 0), (10, 0)], mode="erase", line_width=1e6)
+    huge_drawn = _stroke([(0, 0), (10, 0)], line_width=1e6)
+    far_eraser = _stroke([(5000, 5000), (5010, 5000)], mode="erase")
+
+    start = time.perf_counter()
+    out = compact_actions([drawn, huge_eraser, huge_drawn, far_eraser])
+
+    assert time.perf_counter() - start < 1.0
+    assert out == [drawn, huge_eraser, huge_drawn, far_eraser]
+
+
+def test_unparseable_coordinates_are_ignored():
+    drawn = _stroke([(100, 100), (120, 100)])
+    drawn["points"].append({"x": 10 ** 400, "y": 0})
+    drawn["points"].append({"x": float("nan"), "y": 0})
+
+    assert compact_actions([drawn]) == [drawn]
@@ -0,0 +1,30 @@
+from core.stroke_codec import decode_stroke, encode_stroke, stamp_stroke
+
+
+def _stroke(points, **extra):
+    return {"type": "stroke", "points": [{"x": x, "y": y} for x, y in points], "color": "#000", "lineWidth": 2, **extra}
+
+
+def test_round_trip_quantizes_points():
+    frame = encode_stroke(_stroke([(1.3, 2.0), (-5.25, 7.5)]), seq=3, user_id=9)
+
+    decoded = decode_stroke(frame)
+    assert decoded["points"] == [{"x": 1.25, "y": 2.0}, {"x": -5.25, "y": 7.5}]
+    assert decoded["lineWidth"] == 2
+
+
+def test_unrepresentable_strokes_are_rejected_not_raised():
+    assert encode_stroke(_stroke([(10 ** 400, 0)])) is None
+    assert encode_stroke(_stroke([(float("inf"), 0)])) is None
+    assert encode_stroke(_stroke([(float("nan"), 0)])) is None
+    assert encode_stroke(_stroke([(1e30, 0)])) is None
+    assert encode_stroke(_stroke([(0, 0)], lineWidth=10 ** 400)) is None
+    assert encode_stroke(_stroke([(0, 0)]), seq=2 ** 32) is None
+    assert encode_stroke(_stroke([(0, 0)]), user_id=-1) is None
+
+
+def test_stamp_rejects_seq_beyond_header():
+    frame = encode_stroke(_stroke([(0, 0)]))
+
+    assert decode_stroke(stamp_stroke(frame, 5, 6))["points"] == [{"x": 0, "y": 0}]
+    assert stamp_stroke(frame, 2 ** 32, 6) is None
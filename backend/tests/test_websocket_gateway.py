@@ -0,0 +1,165 @@
+import asyncio
+import json
+
+import pytest
+
+from routers import websocket as gateway
+from routers.websocket import CHAT, SIGNAL, serve_session
+
+USER = {"id": 7, "username": "ada"}
+
+pytestmark = pytest.mark.usefixtures("fresh_gateway")
+
+
+class FakeWebSocket:
+    """Plays back client frames; an exception in the list is raised by receive()."""
+
+    def __init__(self, frames=(), query=None):
+        self.query_params = query or {}
+        self.frames = list(frames)
+        self.sent = []
+
+    async def receive(self):
+        await asyncio.sleep(0)
+        if not self.frames:
+            return {"type": "websocket.disconnect", "code": 1000}
+        frame = self.frames.pop(0)
+        if isinstance(frame, Exception):
+            raise frame
+        if isinstance(frame, bytes):
+            return {"type": "websocket.receive", "bytes": frame}
+        return {"type": "websocket.receive", "text": frame}
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+async def _other_tasks():
+    await asyncio.sleep(0.01)  # let cancelled writer tasks finish
+    return {t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()}
+
+
+def test_failing_handler_still_unregisters_the_socket():
+    async def run():
+        socket = FakeWebSocket([RuntimeError("redis down")])
+        with pytest.raises(RuntimeError):
+            await serve_session(socket, 1, USER, {CHAT, SIGNAL})
+
+        assert len(gateway.manager.connections) == 0
+        assert not gateway.manager.has_connections(1)
+        assert await gateway.state.get_presence(1) == []
+        assert await _other_tasks() == set()
+
+    asyncio.run(run())
+
+
+def test_disconnect_leaves_no_tasks_or_connections():
+    async def run():
+        sockets = [FakeWebSocket(['{"type": "ping"}']) for _ in range(3)]
+        await asyncio.gather(*(serve_session(s, 2, USER, {CHAT, SIGNAL}) for s in sockets))
+
+        assert len(gateway.manager.connections) == 0
+        assert await gateway.state.get_presence(2) == []
+        assert await _other_tasks() == set()
+
+    asyncio.run(run())
+
+
+def test_messages_for_unsubscribed_channels_are_rejected():
+    async def run():
+        socket = FakeWebSocket([
+            '{"type": "editor_update", "content": {"offset": 0, "length": 0, "text": "x"}}',
+            '{"type": "sketch_update", "content": {"type": "stroke", "points": []}}',
+            b"\x01\x00",
+        ])
+        await serve_session(socket, 3, USER, {CHAT})
+
+        assert await gateway.state.get_editor(3) is None
+        assert await gateway.state.get_sketch(3) is None
+        assert [json.loads(m)["channel"] for m in socket.sent] == ["editor", "sketch"]
+        assert not gateway.persistence.is_dirty(3)
+
+    asyncio.run(run())
+
+
+def test_legacy_editor_sockets_share_one_document_read_per_revision(monkeypatch):
+    from routers import editor
+
+    async def run():
+        await gateway.state.init_editor(4, "")
+        rev, _ = await gateway.state.patch_editor(4, 0, 0, "hi")
+        reads = []
+        get_editor = gateway.state.get_editor
+
+        async def counting_get_editor(session_id):
+            reads.append(session_id)
+            return await get_editor(session_id)
+
+        monkeypatch.setattr(gateway.state, "get_editor", counting_get_editor)
+        sockets = [FakeWebSocket() for _ in range(5)]
+        update = json.dumps({"type": "editor_update", "user": USER, "content": {}, "rev": rev})
+        for socket in sockets:
+            await editor._LegacyEditorSocket(socket, 4).send_text(update)
+
+        assert reads == [4]
+        assert all(json.loads(s.sent[0])["content"] == "hi" for s in sockets)
+        editor._full_texts.pop(4, None)
+
+    asyncio.run(run())
+
+
+def test_presence_comes_from_the_registry_with_the_memory_store(monkeypatch):
+    async def run():
+        async def no_store_read(session_id):
+            raise AssertionError("presence read from the state store")
+
+        monkeypatch.setattr(gateway.state, "get_presence", no_store_read)
+        other = FakeWebSocket()
+        await gateway.manager.connect(5, other, 8, present=True)
+        socket = FakeWebSocket(['{"type": "presence_get"}'])
+        await serve_session(socket, 5, USER, {SIGNAL})
+        gateway.manager.disconnect(other)
+
+        presence = [json.loads(m)["users"] for m in socket.sent if json.loads(m)["type"] == "presence"]
+        assert presence == [[7, 8], [7, 8]]
+
+    asyncio.run(run())
+
+
+def test_chat_message_without_text_content_is_ignored():
+    async def run():
+        socket = FakeWebSocket(['{"type": "chat_message", "content": {"text": "hi"}}'])
+        await serve_session(socket, 6, USER, {CHAT})
+
+        assert socket.sent == []
+        assert gateway.chat_ingest.queue == []
+
+    asyncio.run(run())
+
+
+def test_presence_follows_the_signal_subscription():
+    async def run():
+        socket = FakeWebSocket([
+            '{"type": "subscribe", "channels": ["signal"]}',
+            '{"type": "presence_get"}',
+            '{"type": "unsubscribe", "channels": ["signal"]}',
+        ])
+        peer = FakeWebSocket()
+        await gateway.manager.connect(7, peer, 8, present=True)
+        await gateway.state.add_presence(7, 8)
+        await serve_session(socket, 7, USER, {CHAT})
+        gateway.manager.disconnect(peer)
+
+        types = [json.loads(m)["type"] for m in socket.sent]
+        assert types[:3] == ["subscribed", "presence", "media_state_snapshot"]
+        assert [json.loads(m)["users"] for m in socket.sent if json.loads(m)["type"] == "presence"] == [[7, 8], [7, 8]]
+        assert await gateway.state.get_presence(7) == [8]
+        assert not gateway.manager.connections.is_present(7, USER["id"])
+
+    asyncio.run(run())
@@ -0,0 +1,199 @@
+"""Write-behind lifecycle of the session gateway: what the last disconnect leaves behind."""
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db.database import Base
+from models.message import Message
+from models.session import Session
+from models.session_editor import SessionEditor
+from models.session_sketch_action import SessionSketchAction
+from models.user import User
+from routers import websocket as gateway
+from routers.websocket import CHANNELS, CHAT, serve_session
+
+from conftest import import_models
+from test_websocket_gateway import FakeWebSocket, USER
+
+pytestmark = pytest.mark.usefixtures("fresh_gateway")
+
+EDIT = json.dumps({"type": "editor_update", "content": {"offset": 0, "length": 0, "text": "hello"}})
+STROKE = json.dumps({"type": "sketch_update", "content": {"type": "stroke", "points": [{"x": 1, "y": 2}]}})
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    event.listen(engine.sync_engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+
+    async def create():
+        import_models()
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    monkeypatch.setattr(gateway, "AsyncSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+def _seed(engine, session_id, chunk_seqs=()):
+    """The session row, plus sketch chunks another worker already stored."""
+    async def seed():
+        async with async_sessionmaker(bind=engine)() as db:
+            db.add(User(id=session_id, email=f"u{session_id}@example.com", username=f"u{session_id}", password_hash="x"))
+            db.add(Session(id=session_id, title="s", invite_code=f"CODE{session_id}", created_by=session_id))
+            for seq in chunk_seqs:
+                db.add(SessionSketchAction(
+                    session_id=session_id, seq=seq, last_seq=seq, count=1,
+                    content=json.dumps([{"type": "stroke", "seq": seq}]),
+                ))
+            await db.commit()
+
+    asyncio.run(seed())
+
+
+async def _stale_seqs(session_ids):
+    return {}  # read before another worker stored its chunks
+
+
+async def _stored(engine, session_id):
+    async with async_sessionmaker(bind=engine)() as db:
+        text = await db.scalar(select(SessionEditor.content).where(SessionEditor.session_id == session_id))
+        chunks = (await db.scalars(
+            select(SessionSketchAction.count).where(SessionSketchAction.session_id == session_id)
+        )).all()
+    return text, sum(chunks)
+
+
+async def _other_tasks():
+    await asyncio.sleep(0.01)
+    return {t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()}
+
+
+def test_last_disconnect_saves_and_leaves_nothing_running(engine):
+    _seed(engine, 10)
+
+    async def run():
+        await serve_session(FakeWebSocket([EDIT, STROKE]), 10, USER, set(CHANNELS))
+
+        assert await _stored(engine, 10) == ("hello", 1)
+        assert await gateway.state.get_editor(10) is None  # unloaded, the DB has it all
+        assert not gateway.persistence.dirty
+        assert gateway.persistence._task is None
+        assert await _other_tasks() == set()
+        assert engine.sync_engine.pool.checkedout() == 0
+
+    asyncio.run(run())
+
+
+def test_failed_save_keeps_the_state_until_a_retry_succeeds(engine, monkeypatch):
+    _seed(engine, 11)
+
+    async def run():
+        save = gateway._save_editor_to_db
+
+        async def failing_save(db, session_id, text):
+            raise RuntimeError("disk full")
+
+        monkeypatch.setattr(gateway, "_save_editor_to_db", failing_save)
+        await serve_session(FakeWebSocket([EDIT]), 11, USER, set(CHANNELS))
+
+        assert gateway.persistence.is_dirty(11)
+        assert await gateway.state.get_editor(11) is not None  # not unloaded with the edit unsaved
+
+        monkeypatch.setattr(gateway, "_save_editor_to_db", save)
+        await gateway.persistence.stop()
+        await asyncio.sleep(0.01)  # the deferred release
+
+        assert (await _stored(engine, 11))[0] == "hello"
+        assert await gateway.state.get_editor(11) is None
+        assert await _other_tasks() == set()
+        assert engine.sync_engine.pool.checkedout() == 0
+
+    asyncio.run(run())
+
+
+
+def test_seq_conflict_with_another_worker_is_retried(engine, monkeypatch):
+    _seed(engine, 12, chunk_seqs=[1])
+
+    async def run():
+        await gateway.state.init_editor(12, "")
+        await gateway.state.init_sketch(12, [])
+        await gateway.state.patch_editor(12, 0, 0, "hello")
+        for _ in range(2):
+            await gateway.state.append_sketch(12, {"type": "stroke", "points": []})
+
+        read_seqs = gateway._read_persisted_sketch_seqs
+        monkeypatch.setattr(gateway, "_read_persisted_sketch_seqs", _stale_seqs)
+        await gateway._flush_sessions({12: {"sketch", "editor"}})
+
+        assert gateway.persistence.dirty == {12: {"sketch", "editor"}}
+        assert 12 not in gateway._saved_editor_rev  # the editor text was rolled back with the chunk
+        assert await _stored(engine, 12) == (None, 1)
+
+        monkeypatch.setattr(gateway, "_read_persisted_sketch_seqs", read_seqs)
+        await gateway.persistence.stop()  # final flush
+
+        assert await _stored(engine, 12) == ("hello", 2)
+        assert not gateway.persistence.dirty
+
+    asyncio.run(run())
+
+
+def test_state_of_a_deleted_session_is_dropped(engine):
+    _seed(engine, 13)
+
+    async def run():
+        await gateway.state.init_sketch(13, [])
+        await gateway.state.append_sketch(13, {"type": "stroke", "points": []})
+        async with async_sessionmaker(bind=engine)() as db:
+            await db.execute(delete(Session).where(Session.id == 13))
+            await db.commit()
+
+        await gateway._flush_sessions({13: {"sketch"}})
+
+        assert not gateway.persistence.dirty
+
+    asyncio.run(run())
+
+
+def test_chat_batch_stays_queued_while_the_db_is_down(tmp_path, monkeypatch):
+    down = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'test.db'}")
+    monkeypatch.setattr(gateway, "AsyncSessionLocal", async_sessionmaker(bind=down))
+    chat = json.dumps({"type": "chat_message", "content": "hi"})
+
+    async def run():
+        await serve_session(FakeWebSocket([chat]), 14, USER, {CHAT})
+
+        assert not await gateway.chat_ingest.flush()
+        assert [m["content"] for m in gateway.chat_ingest.queue] == ["hi"]
+        gateway.chat_ingest.queue.clear()
+        await gateway.chat_ingest.stop()
+        await down.dispose()
+
+    asyncio.run(run())
+
+
+def test_chat_rows_of_a_deleted_session_are_dropped_alone(engine):
+    _seed(engine, 15)
+
+    async def run():
+        for session_id in (15, 16):  # 16 doesn't exist
+            gateway.chat_ingest.submit({
+                "provisional_id": f"tmp-{session_id}", "session_id": session_id, "user_id": 15,
+                "content": "hi", "created_at": datetime.utcnow(),
+            })
+        await gateway.chat_ingest.stop()
+
+        assert gateway.chat_ingest.queue == []
+        async with async_sessionmaker(bind=engine)() as db:
+            stored = (await db.scalars(select(Message.session_id))).all()
+        assert stored == [15]
+
+    asyncio.run(run())
@@ -21,7 +21,7 @@ const useSessionSocket = (sessionId) => {
       }
 
       const socket = new WebSocket(
-        `${WEBSOCKET_BASE_URL}/ws/sessions/${sessionId}?token=${token}`
+        `${WEBSOCKET_BASE_URL}/ws/sessions/${sessionId}?token=${token}&heartbeat=1`
       );
       console.log("🔌 Creating WS:", socket.url);
       socketRef.current = socket;
@@ -39,6 +39,13 @@ const useSessionSocket = (sessionId) => {
       };
       socket.onerror = (err) =>
         console.error("❌ Session WebSocket error:", err);
+      // Heartbeat: answer server pings so the connection isn't reaped as idle
+      socket.addEventListener("message", (event) => {
+        if (event.data !== '{"type":"ping"}') return; // exact compact frame the server sends
+        if (socket.readyState === WebSocket.OPEN) {
+          socket.send(JSON.stringify({ type: "pong" }));
+        }
+      });
     }, 10);
 
     return () => {